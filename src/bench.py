@@ -0,0 +1,315 @@
+from dataclasses import asdict, dataclass
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlencode
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .config import load_config
+from .models import Listing
+from .offline import FIXTURES_DIR, fixture_transport
+from .scrapers import domovita, kufar, realt
+from .scrapers.domovita import parse_domovita_html
+from .scrapers.http import close_http_pool, configure_http_pool, get_http_pool
+from .scrapers.kufar import fetch_kufar_via_api_from_html, parse_kufar_html
+from .scrapers.nextdata import extract_next_data
+from .scrapers.realt import fetch_realt_via_json_from_html, parse_realt_html
+
+
+BASELINE_FILE = FIXTURES_DIR / "bench_baseline.json"
+KUFAR_PAGE_URL = "https://re.kufar.by/l/minsk/snyat/kvartiru"
+
+# Во сколько раз размножаются объявления в search_large.* и сколько мусорной разметки в noisy.html
+LARGE_FACTOR = 15
+NOISE_BLOCKS = 3000
+
+
+@dataclass
+class BenchResult:
+    parser: str
+    fixture: str
+    listings: int
+    sec_per_page: float
+    pages_per_sec: float
+    listings_per_sec: float
+    peak_kib: float
+    alloc_blocks: int
+
+
+def _kufar_api_fixture(page: Path) -> str:
+    # Ответ API к странице X.html лежит в X.api.json, общий — в api.json
+    own = page.with_name(page.stem + ".api.json")
+    return f"kufar/{own.name}" if own.exists() else "kufar/api.json"
+
+
+def _cases(fixtures_dir: Path) -> List[tuple]:
+    """(парсер, фикстура, функция(html) -> объявления) для всех страниц в fixtures/."""
+    loop = asyncio.new_event_loop()
+    cases: List[tuple] = []
+    active = {"api": ""}
+
+    def kufar_api(page: Path) -> Callable[[str], List[Listing]]:
+        api_fixture = _kufar_api_fixture(page)
+
+        def run(html: str) -> List[Listing]:
+            # Пул с транспортом на нужный ответ API пересоздаётся только при смене случая
+            if active["api"] != api_fixture:
+                loop.run_until_complete(close_http_pool())
+                configure_http_pool(transport=fixture_transport(fixtures_dir, {"api.kufar.by": api_fixture}))
+                active["api"] = api_fixture
+            return loop.run_until_complete(fetch_kufar_via_api_from_html(html, page_url=KUFAR_PAGE_URL))
+
+        return run
+
+    for page in sorted((fixtures_dir / "kufar").glob("*.html")):
+        cases.append(("parse_kufar_html", page, parse_kufar_html))
+        cases.append(("fetch_kufar_via_api_from_html", page, kufar_api(page)))
+    for page in sorted((fixtures_dir / "domovita").glob("*.html")):
+        cases.append(("parse_domovita_html", page, parse_domovita_html))
+    for page in sorted((fixtures_dir / "realt").glob("*.html")):
+        cases.append(("parse_realt_html", page, parse_realt_html))
+        cases.append(("fetch_realt_via_json_from_html", page, fetch_realt_via_json_from_html))
+    return cases
+
+
+def _measure(parser: str, page: Path, func: Callable[[str], List[Listing]], min_time: float) -> BenchResult:
+    html = page.read_text(encoding="utf-8")
+    func(html)  # прогрев: импорты, кэши селекторов
+
+    # Память отдельно от времени: tracemalloc замедляет выполнение в разы
+    gc.collect()
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    result = func(html)
+    alloc_blocks = sys.getallocatedblocks() - blocks_before
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    listings = len(result)
+    del result
+
+    timings: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < 5 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func(html)
+        timings.append(time.perf_counter() - start)
+    per_page = statistics.median(timings)
+    return BenchResult(
+        parser=parser,
+        fixture=str(page.relative_to(page.parents[1])),
+        listings=listings,
+        sec_per_page=per_page,
+        pages_per_sec=1.0 / per_page,
+        listings_per_sec=listings / per_page,
+        peak_kib=peak / 1024,
+        alloc_blocks=alloc_blocks,
+    )
+
+
+def _key(r: BenchResult) -> str:
+    return f"{r.parser}::{r.fixture}"
+
+
+def _compare(results: List[BenchResult], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Сравнение с базой: медленнее или прожорливее на tolerance и больше — регрессия."""
+    regressions = []
+    for r in results:
+        base = baseline.get(_key(r))
+        if not base:
+            continue
+        if r.sec_per_page > base["sec_per_page"] * (1 + tolerance):
+            regressions.append(f"{_key(r)}: {base['sec_per_page'] * 1000:.2f} → {r.sec_per_page * 1000:.2f} ms/page")
+        if r.peak_kib > base["peak_kib"] * (1 + tolerance) + 64:
+            regressions.append(f"{_key(r)}: peak {base['peak_kib']:.0f} → {r.peak_kib:.0f} KiB")
+        if r.listings != base["listings"]:
+            regressions.append(f"{_key(r)}: listings {base['listings']} → {r.listings}")
+    return regressions
+
+
+def _print_table(results: List[BenchResult], baseline: Dict[str, Any]) -> None:
+    header = f"{'parser':32} {'fixture':34} {'items':>6} {'ms/page':>9} {'pages/s':>9} {'items/s':>10} {'peak KiB':>9} {'blocks':>8} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        base = baseline.get(_key(r))
+        delta = f"{(r.sec_per_page / base['sec_per_page'] - 1) * 100:+.0f}%" if base else "—"
+        print(
+            f"{r.parser:32} {r.fixture:34} {r.listings:6d} {r.sec_per_page * 1000:9.2f} {r.pages_per_sec:9.1f} "
+            f"{r.listings_per_sec:10.0f} {r.peak_kib:9.0f} {r.alloc_blocks:8d} {delta:>8}"
+        )
+
+
+# --- Фикстуры -----------------------------------------------------------------
+
+def _replace_next_data(html: str, data: Optional[dict], raw: Optional[str] = None) -> str:
+    payload = raw if raw is not None else json.dumps(data, ensure_ascii=False)
+    return re.sub(
+        r'(<script id="__NEXT_DATA__"[^>]*>).*?(</script>)',
+        lambda m: m.group(1) + payload + m.group(2),
+        html,
+        count=1,
+        flags=re.S,
+    )
+
+
+def _renumber(text: str, ids: List[str], copy: int) -> str:
+    for item_id in ids:
+        text = text.replace(item_id, f"{item_id}{copy:02d}")
+    return text
+
+
+def synthesize(fixtures_dir: Path = FIXTURES_DIR) -> List[Path]:
+    """Строит большие и вырожденные страницы из базовых search.html / api.json."""
+    written: List[Path] = []
+
+    def write(rel: str, text: str) -> None:
+        path = fixtures_dir / rel
+        path.write_text(text, encoding="utf-8")
+        written.append(path)
+
+    # Kufar: много карточек и ответ API на 15 страниц, пустая выдача, битый __NEXT_DATA__
+    html = (fixtures_dir / "kufar/search.html").read_text(encoding="utf-8")
+    api = json.loads((fixtures_dir / "kufar/api.json").read_text(encoding="utf-8"))
+    links = re.findall(r'\s*<a data-name="adLink"[^\n]*</a>', html)
+    link_ids = [re.search(r"/vi/(\d+)", l).group(1) for l in links]
+    block = "".join(links)
+    big_links = "".join(_renumber(block, link_ids, c) for c in range(LARGE_FACTOR))
+    write("kufar/search_large.html", html.replace(block, big_links))
+    ads = [
+        {**ad, "ad_id": int(f"{ad['ad_id']}{c:02d}"), "ad_link": f"{ad['ad_link']}{c:02d}"}
+        for c in range(LARGE_FACTOR) for ad in api["ads"]
+    ]
+    write("kufar/search_large.api.json", json.dumps({**api, "ads": ads}, ensure_ascii=False, indent=1))
+    data = extract_next_data(html) or {}
+    no_query = json.loads(json.dumps(data))
+    no_query.get("props", {}).get("initialState", {}).get("router", {}).pop("queryForBe", None)
+    write("kufar/empty.html", _replace_next_data(html.replace(block, ""), no_query))
+    raw = json.dumps(data, ensure_ascii=False)
+    write("kufar/broken_next_data.html", _replace_next_data(html, None, raw[: len(raw) // 2]))
+
+    # Domovita: много карточек, пустая выдача, карточки среди мегабайта посторонней разметки
+    html = (fixtures_dir / "domovita/search.html").read_text(encoding="utf-8")
+    cards = re.findall(r'\s*<div class="found_item[^"]*" data-key="\d+">.*?\n\s*</div>(?=\s*(?:<div class="found_item|</div>))', html, flags=re.S)
+    card_ids = [re.search(r'data-key="(\d+)"', c).group(1) for c in cards]
+    block = "".join(cards)
+    write("domovita/search_large.html", html.replace(block, "".join(_renumber(block, card_ids, c) for c in range(LARGE_FACTOR))))
+    write("domovita/empty.html", html.replace(block, '\n    <div class="empty">Ничего не найдено</div>'))
+    noise = "".join(
+        f'\n  <div class="menu-item"><a href="/minsk/flats/sale/{i}">Продажа {i}</a><span class="badge">{i % 7}</span></div>'
+        for i in range(NOISE_BLOCKS)
+    )
+    write("domovita/noisy.html", html.replace("<body>", "<body>" + noise, 1).replace("</body>", noise + "\n</body>", 1))
+
+    # Realt: много объектов, битый __NEXT_DATA__, выдача только в разметке (без JSON)
+    html = (fixtures_dir / "realt/search.html").read_text(encoding="utf-8")
+    data = extract_next_data(html) or {}
+    listing = data["props"]["pageProps"]["initialState"]["objectsListing"]
+    objects = listing["objects"]
+    big = json.loads(json.dumps(data))
+    big["props"]["pageProps"]["initialState"]["objectsListing"]["objects"] = [
+        {**o, "code": int(f"{o['code']}{c:02d}")} for c in range(LARGE_FACTOR) for o in objects
+    ]
+    write("realt/search_large.html", _replace_next_data(html, big))
+    raw = json.dumps(data, ensure_ascii=False)
+    write("realt/broken_next_data.html", _replace_next_data(html, None, raw[: len(raw) // 2]))
+    cards_html = "".join(
+        f'\n    <div class="listing-item"><a href="/rent/flat-for-long/object/{o["code"]}/">{o["title"]}</a>'
+        f'<span class="price-byr">{o["price"]} $</span><span class="address-line">{o["address"]}</span></div>'
+        for o in objects
+    )
+    html_only = re.sub(r'\s*<script id="__NEXT_DATA__".*?</script>', "", html, flags=re.S)
+    write("realt/html_only.html", html_only.replace("<main></main>", f"<main>{cards_html}\n  </main>"))
+    return written
+
+
+async def record(fixtures_dir: Path = FIXTURES_DIR) -> List[Path]:
+    """Сохраняет живые страницы выдачи (и ответ API Kufar) как recorded-ДАТА.*"""
+    cfg = load_config()
+    stamp = date.today().strftime("%Y%m%d")
+    pool = get_http_pool()
+    written: List[Path] = []
+
+    async def save(rel: str, url: str, headers: Dict[str, str]) -> str:
+        resp = await pool.get(url, headers=headers)
+        resp.raise_for_status()
+        path = fixtures_dir / rel
+        path.write_bytes(resp.content)
+        written.append(path)
+        return resp.text
+
+    html = await save(f"kufar/recorded-{stamp}.html", cfg.kufar_url, kufar.HEADERS)
+    query = kufar._extract_query_for_be_from_html(html)
+    if query:
+        api_url = f"{kufar.API_URL}?{urlencode(query)}"
+        await save(f"kufar/recorded-{stamp}.api.json", api_url, {**kufar.HEADERS, "Accept": "application/json"})
+    await save(f"domovita/recorded-{stamp}.html", cfg.domovita_url, domovita.HEADERS)
+    await save(f"realt/recorded-{stamp}.html", cfg.realt_url, realt.HEADERS)
+    await close_http_pool()
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.bench",
+        description="Бенчмарк парсеров на страницах из fixtures/: пропускная способность, пик памяти, сравнение с базой",
+    )
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--filter", default="", help="только случаи, где parser::fixture содержит подстроку")
+    parser.add_argument("--min-time", type=float, default=1.0, help="минимальное время замеров на случай, сек")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как новую базу")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение относительно базы (доля)")
+    parser.add_argument("--json", action="store_true", help="вывести результаты JSON")
+    parser.add_argument("--synthesize", action="store_true", help="пересобрать большие и вырожденные фикстуры")
+    parser.add_argument("--record", action="store_true", help="записать живые страницы (нужна сеть)")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:offline")
+        for path in asyncio.run(record(args.fixtures)):
+            print(f"recorded {path}")
+        return
+    if args.synthesize:
+        for path in synthesize(args.fixtures):
+            print(f"wrote {path}")
+        return
+
+    baseline: Dict[str, Any] = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+
+    results = []
+    for name, page, func in _cases(args.fixtures):
+        if args.filter and args.filter not in f"{name}::{page}":
+            continue
+        results.append(_measure(name, page, func, args.min_time))
+
+    if args.json:
+        print(json.dumps([asdict(r) for r in results], indent=1))
+    else:
+        _print_table(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(
+            json.dumps({_key(r): asdict(r) for r in results}, indent=1, sort_keys=True) + "\n", encoding="utf-8"
+        )
+        print(f"\nbaseline saved to {args.baseline}")
+        return
+    regressions = _compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nregressions:")
+        print("\n".join(f"  {r}" for r in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
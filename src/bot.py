@@ -1,52 +1,168 @@
-from typing import Iterable
+from dataclasses import replace
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+import asyncio
+import hmac
+import json
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from telegram.constants import ParseMode
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+from telegram.constants import MessageLimit, ParseMode
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
 
 from .config import load_config
 from .state import StateStore
 from .models import Listing
+from .delivery import Broadcaster
+from .listing_cache import get_listing_cache
+from .metrics import WEBHOOK_UPDATES, timed_command
+from .httpserver import HttpServer, Request, Response
+from .tracing import span
+from .sources import SOURCES, fetch_with_fallback, source_url
+from .filters import parse_filter_args
+from .dedup import get_dedup_index
+from .health import DEGRADED, HEALTHY, OPEN, SourceHealth, get_health
+from .jobqueue import JobQueue
 
 # Состояния для conversation handler
 WAITING_FOR_PRICE = 1
 
+DELETE_BUTTON = InlineKeyboardMarkup([[InlineKeyboardButton(text="🗑 Удалить", callback_data="delete")]])
+
+FILTER_HELP = (
+    "Настройка: /filter цена 200-400 комнаты 1,2 районы центральный,советский "
+    "источники kufar,realt слова балкон\n"
+    "Можно менять отдельные поля; «-» сбрасывает поле, /filter сброс — весь фильтр."
+)
+
 
 def format_listing_message(item: Listing) -> str:
     parts = [
         f"Источник: {item.source}",
         f"Заголовок: {item.title}" if item.title else None,
         f"Цена: {item.price}" if item.price else None,
+        f"Параметры: {item.details}" if item.details else None,
         f"Локация: {item.location}" if item.location else None,
         f"URL: {item.url}",
     ]
     return "\n".join([p for p in parts if p])
 
 
+def format_source_health(health: SourceHealth) -> str:
+    if health.state == OPEN:
+        probe = health.probe_in()
+        status = "⛔ не работает, браузер на паузе"
+        if probe is not None:
+            status += f" (проба через {max(1, round(probe / 60))} мин)"
+    elif health.state == DEGRADED:
+        status = "⚠️ сбои"
+    else:
+        status = "✅ работает"
+    lines = [f"• {health.name.capitalize()}: {status}"]
+    if health.consecutive_failures:
+        lines.append(f"  неудач подряд: {health.consecutive_failures}")
+    last = health.last_success.strftime("%Y-%m-%d %H:%M:%S") if health.last_success else "нет с запуска"
+    lines.append(f"  последний успешный опрос: {last}")
+    if health.last_error and health.state != HEALTHY:
+        lines.append(f"  ошибка: {health.last_error[:200]}")
+    return "\n".join(lines)
+
+
+def pack_messages(texts: Iterable[str], limit: int = MessageLimit.MAX_TEXT_LENGTH, separator: str = "\n\n") -> List[str]:
+    """Склеивает тексты в минимум сообщений, каждое не длиннее limit символов."""
+    packed: List[str] = []
+    current = ""
+    for text in texts:
+        text = text[:limit]
+        if current and len(current) + len(separator) + len(text) <= limit:
+            current = f"{current}{separator}{text}"
+            continue
+        if current:
+            packed.append(current)
+        current = text
+    if current:
+        packed.append(current)
+    return packed
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обновления разных чатов обрабатываются параллельно, одного чата — по очереди.
+
+    ConversationHandler (/max_price) рассчитывает на последовательную обработку:
+    ответ с ценой не должен обогнать саму команду.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        lock = self._chat_locks.setdefault(chat.id, asyncio.Lock())
+        self._waiting[chat.id] = self._waiting.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiting[chat.id] -= 1
+            if not self._waiting[chat.id]:
+                # Замки чатов без очереди не копим
+                del self._waiting[chat.id]
+                del self._chat_locks[chat.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 class BotApp:
-    def __init__(self, state: StateStore) -> None:
+    def __init__(self, state: StateStore, queue: Optional[JobQueue] = None) -> None:
         cfg = load_config()
         self.state = state
-        self.app = Application.builder().token(cfg.telegram_token).build()
-        self.app.add_handler(CommandHandler("start", self.cmd_start))
-        self.app.add_handler(CommandHandler("stop", self.cmd_stop))
-        self.app.add_handler(CommandHandler("kufar", self.cmd_kufar))
-        self.app.add_handler(CommandHandler("domovita", self.cmd_domovita))
-        self.app.add_handler(CommandHandler("realt", self.cmd_realt))
-        self.app.add_handler(CommandHandler("last_dates", self.cmd_last_dates))
+        # --mode bot: выдачу и состояние источников присылают воркеры через очередь
+        self.queue = queue
+        builder = Application.builder().token(cfg.telegram_token)
+        if cfg.telegram_api_url:
+            # Свой Bot API сервер или локальный стенд вместо api.telegram.org
+            builder = builder.base_url(cfg.telegram_api_url)
+        if cfg.update_concurrency > 1:
+            builder = builder.concurrent_updates(PerChatUpdateProcessor(cfg.update_concurrency))
+        self.app = builder.build()
+        self.webhook_secret: Optional[str] = None
+        self.broadcaster = Broadcaster(
+            self.app.bot,
+            global_rate=cfg.telegram_global_rate,
+            per_chat_rate=cfg.telegram_chat_rate,
+            max_concurrency=cfg.broadcast_concurrency,
+        )
+        self.digest_mode = cfg.digest_mode
+        self.digest_threshold = cfg.digest_threshold
+        self.app.add_handler(CommandHandler("start", timed_command("start", self.cmd_start)))
+        self.app.add_handler(CommandHandler("stop", timed_command("stop", self.cmd_stop)))
+        self.app.add_handler(CommandHandler("kufar", timed_command("kufar", self.cmd_kufar)))
+        self.app.add_handler(CommandHandler("domovita", timed_command("domovita", self.cmd_domovita)))
+        self.app.add_handler(CommandHandler("realt", timed_command("realt", self.cmd_realt)))
+        self.app.add_handler(CommandHandler("last_dates", timed_command("last_dates", self.cmd_last_dates)))
+        self.app.add_handler(CommandHandler("filter", timed_command("filter", self.cmd_filter)))
+        self.app.add_handler(CommandHandler("health", timed_command("health", self.cmd_health)))
         
         # Conversation handler для изменения цены
         price_conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("max_price", self.cmd_max_price)],
+            entry_points=[CommandHandler("max_price", timed_command("max_price", self.cmd_max_price))],
             states={
-                WAITING_FOR_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_new_price)],
+                WAITING_FOR_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, timed_command("max_price_input", self.handle_new_price))],
             },
-            fallbacks=[CommandHandler("cancel", self.cmd_cancel)],
+            fallbacks=[CommandHandler("cancel", timed_command("cancel", self.cmd_cancel))],
         )
         self.app.add_handler(price_conv_handler)
         
-        self.app.add_handler(CallbackQueryHandler(self.cb_latest, pattern=r"^latest:(kufar|domovita|realt)$"))
-        self.app.add_handler(CallbackQueryHandler(self.cb_delete, pattern=r"^delete$"))
+        self.app.add_handler(CallbackQueryHandler(timed_command("cb_latest", self.cb_latest), pattern=r"^latest:(kufar|domovita|realt)$"))
+        self.app.add_handler(CallbackQueryHandler(timed_command("cb_delete", self.cb_delete), pattern=r"^delete$"))
         self.app.add_error_handler(self.error_handler)
 
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -54,7 +170,7 @@ class BotApp:
         self.state.add_chat(chat_id)
         keyboard = ReplyKeyboardMarkup([
             [KeyboardButton("/kufar"), KeyboardButton("/domovita"), KeyboardButton("/realt")],
-            [KeyboardButton("/last_dates"), KeyboardButton("/max_price")],
+            [KeyboardButton("/last_dates"), KeyboardButton("/max_price"), KeyboardButton("/filter")],
         ], resize_keyboard=True)
         await context.bot.send_message(
             chat_id=chat_id,
@@ -80,6 +196,7 @@ class BotApp:
     async def cmd_last_dates(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         chat_id = update.effective_chat.id
         lines = ["📅 Дата и время последних постов:\n"]
+        await self.state.refresh_async()
         
         for source in ["kufar", "domovita", "realt"]:
             last_date = self.state.last_date_by_source.get(source)
@@ -91,6 +208,32 @@ class BotApp:
         
         await context.bot.send_message(chat_id=chat_id, text="\n".join(lines))
 
+    async def cmd_health(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat_id = update.effective_chat.id
+        lines = ["🩺 Состояние источников:\n"] + [format_source_health(await self._source_health(name)) for name in SOURCES]
+        await context.bot.send_message(chat_id=chat_id, text="\n".join(lines))
+
+    async def _source_health(self, source: str) -> SourceHealth:
+        if self.queue is not None:
+            health = await asyncio.to_thread(self.queue.source_health, source)
+            if health is not None:
+                return health
+        return get_health().get(source)
+
+    async def cmd_filter(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat_id = update.effective_chat.id
+        current = self.state.get_chat_filter(chat_id)
+        if not context.args:
+            await context.bot.send_message(chat_id=chat_id, text=f"{current.describe()}\n\n{FILTER_HELP}")
+            return
+        try:
+            new_filter = parse_filter_args(context.args, current, SOURCES)
+        except ValueError as e:
+            await context.bot.send_message(chat_id=chat_id, text=f"❌ {e}\n\n{FILTER_HELP}")
+            return
+        self.state.set_chat_filter(chat_id, new_filter)
+        await context.bot.send_message(chat_id=chat_id, text=f"✅ Фильтр сохранён.\n\n{new_filter.describe()}")
+
     async def cmd_max_price(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         chat_id = update.effective_chat.id
         # Получаем текущую цену из state или config
@@ -121,11 +264,14 @@ class BotApp:
             
             # Сохраняем новую цену
             self.state.set_max_price(new_price)
+            # Интервал опроса адаптивный: следующий цикл наступит в пределах POLL_MIN_SEC..POLL_MAX_SEC
+            cfg = load_config()
             
             await context.bot.send_message(
                 chat_id=chat_id,
                 text=f"✅ Максимальная цена изменена на {new_price} USD\n\n"
-                     f"Новая цена будет применена при следующем цикле парсинга (в течение 60 секунд)."
+                     f"Новая цена будет применена при следующем цикле парсинга "
+                     f"(обычно через {cfg.poll_min_sec}–{cfg.poll_max_sec} секунд)."
             )
             return ConversationHandler.END
             
@@ -141,138 +287,109 @@ class BotApp:
         await context.bot.send_message(chat_id=chat_id, text="Отменено.")
         return ConversationHandler.END
 
+    async def _latest_items(self, source: str) -> List[Listing]:
+        # Выдача из кэша поллера; при промахе — одна общая загрузка на всех ожидающих
+        if self.queue is not None:
+            # Сайты опрашивают воркеры: бот показывает их последнюю выдачу и сам не скачивает,
+            # даже если воркер источник ещё не опросил
+            return await asyncio.to_thread(self.queue.source_listings, source)
+        cfg = load_config(override_max_price=self.state.get_max_price())
+        url = source_url(cfg, source)
+        try:
+            budget = SOURCES[source].budget(cfg)
+            return await get_listing_cache().get(source, url, lambda: fetch_with_fallback(source, url, budget))
+        except Exception as e:
+            logging.getLogger("bot").warning("%s latest fetch failed: %s", source, e)
+            return []
+
     async def _send_latest(self, update: Update, context: ContextTypes.DEFAULT_TYPE, source: str) -> None:
         chat_id = update.effective_chat.id
-        from .config import load_config
-        from .scrapers.kufar import fetch_kufar, parse_kufar_html
-        from .scrapers.domovita import fetch_domovita, parse_domovita_html
-        from .scrapers.realt import fetch_realt, parse_realt_html
-        from .browser import fetch_rendered_html
-
-        cfg = load_config()
-        url_map = {
-            "kufar": cfg.kufar_url,
-            "domovita": cfg.domovita_url,
-            "realt": cfg.realt_url,
-        }
-        url = url_map[source]
-
-        # 1) пробуем обычный fetch
-        if source == "kufar":
-            items = fetch_kufar(url)
-        elif source == "domovita":
-            items = fetch_domovita(url)
-        else:
-            items = fetch_realt(url)
-
-        # 2) если пусто — fallback на рендер
-        if not items:
-            try:
-                wait_sel = {
-                    "kufar": "a[href*='/item/']",
-                    "domovita": "a[href*='/rent/']",
-                    "realt": "a[href*='/rent/flat-for-long/']",
-                }[source]
-                html = await fetch_rendered_html(url, wait_selector=wait_sel)
-                if source == "kufar":
-                    items = parse_kufar_html(html)
-                elif source == "domovita":
-                    items = parse_domovita_html(html)
-                else:
-                    items = parse_realt_html(html)
-            except Exception:
-                items = []
+        items = await self._latest_items(source)
 
         if not items:
             await context.bot.send_message(chat_id=chat_id, text="Ничего не нашлось. Попробуйте позже.")
             return
 
-        latest = items[0]
+        latest = self._latest_for_chat(chat_id, items)
+        if latest is None:
+            await context.bot.send_message(chat_id=chat_id, text="Под ваш фильтр ничего не нашлось.")
+            return
         await context.bot.send_message(chat_id=chat_id, text=format_listing_message(latest))
 
+    def _latest_for_chat(self, chat_id: int, items: List[Listing]) -> Optional[Listing]:
+        # Источник выбран явно командой — из фильтра чата учитываем всё, кроме источников
+        flt = replace(self.state.get_chat_filter(chat_id), sources=frozenset())
+        return next((i for i in items if flt.matches(i)), None)
+
+    def _use_digest(self, total: int) -> bool:
+        # Решение на весь цикл по числу его объявлений, а не по тому, сколько досталось чату
+        return self.digest_mode == "on" or (self.digest_mode == "auto" and total > self.digest_threshold)
+
+    def _render(self, texts: List[str], digest: bool) -> List[Dict[str, Any]]:
+        if digest:
+            # Много объявлений за цикл: пакуем в сообщения до 4096 символов
+            texts = pack_messages(texts)
+        return [
+            dict(
+                text=text,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=digest,
+                reply_markup=DELETE_BUTTON,
+            )
+            for text in texts
+        ]
+
     async def broadcast(self, items: Iterable[Listing]) -> None:
         if not self.state.chat_ids:
             return
-        text_chunks = [format_listing_message(i) for i in items]
-        delete_button = InlineKeyboardMarkup([[InlineKeyboardButton(text="🗑 Удалить", callback_data="delete")]])
-        for chat_id in list(self.state.chat_ids):
-            for text in text_chunks:
-                try:
-                    await self.app.bot.send_message(
-                        chat_id=chat_id,
-                        text=text,
-                        parse_mode=ParseMode.HTML,
-                        disable_web_page_preview=False,
-                        reply_markup=delete_button
-                    )
-                except Exception:
-                    # Ошибки чата игнорируем, чтобы не падал процесс
-                    continue
+        items = list(items)
+        with span("broadcast.dedup") as sp:
+            # Та же квартира с другого сайта, уже разосланная за последние дни
+            earlier = get_dedup_index().process(items)
+            sp.set(duplicates=len(earlier))
+        if earlier:
+            logging.getLogger("bot").info(
+                "broadcast: %d duplicates of earlier listings: %s",
+                len(earlier),
+                ", ".join(f"{items[i].url} = {e.url}" for i, e in list(earlier.items())[:3]),
+            )
+        with span("broadcast.match", listings=len(items)) as sp:
+            # Чаты с одинаковым набором подходящих объявлений получают одни и те же сообщения
+            routes = self.state.filter_index().route(items, earlier)
+            sp.set(routes=len(routes), chats=sum(len(chats) for _, chats in routes))
+        with span("broadcast.render") as sp:
+            # Каждое объявление рендерится один раз и переиспользуется для всех чатов
+            texts = [format_listing_message(i) for i in items]
+            digest = self._use_digest(len(items))
+            batches = [(chats, self._render([texts[i] for i in idxs], digest)) for idxs, chats in routes]
+            sp.set(messages=sum(len(m) for _, m in batches))
+        # Чаты обслуживаются параллельно в пределах лимитов Telegram; ошибки не роняют процесс
+        results = await asyncio.gather(*(self.broadcaster.broadcast(chats, messages) for chats, messages in batches))
+        sent = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        if failed:
+            logging.getLogger("bot").warning("broadcast: sent=%d failed=%d", sent, failed)
 
     async def notify_no_updates(self, count: int) -> None:
         if not self.state.chat_ids:
             return
         text = f"За последние {count} циклов (по 60 сек) новых объявлений не появилось."
-        for chat_id in list(self.state.chat_ids):
-            try:
-                await self.app.bot.send_message(chat_id=chat_id, text=text)
-            except Exception:
-                continue
+        await self.broadcaster.broadcast(list(self.state.chat_ids), [dict(text=text)])
 
     async def cb_latest(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         query = update.callback_query
         await query.answer()
         source = query.data.split(":", 1)[1]
-        # Дальнейшая логика реализуется в main через общие функции, чтобы не плодить дублирование
-        # Здесь просто проксируем событие через job_queue в общий обработчик, но проще — подтянуть прямо тут
-        from .config import load_config
-        from .scrapers.kufar import fetch_kufar
-        from .scrapers.domovita import fetch_domovita
-        from .scrapers.realt import fetch_realt
-        from .browser import fetch_rendered_html
-        from .scrapers.kufar import parse_kufar_html
-        from .scrapers.domovita import parse_domovita_html
-        from .scrapers.realt import parse_realt_html
-
-        cfg = load_config()
-        url_map = {
-            "kufar": cfg.kufar_url,
-            "domovita": cfg.domovita_url,
-            "realt": cfg.realt_url,
-        }
-        url = url_map[source]
-
-        # 1) пробуем обычный fetch
-        if source == "kufar":
-            items = fetch_kufar(url)
-        elif source == "domovita":
-            items = fetch_domovita(url)
-        else:
-            items = fetch_realt(url)
-
-        # 2) если пусто — fallback на рендер
-        if not items:
-            try:
-                wait_sel = {
-                    "kufar": "a[href*='/item/']",
-                    "domovita": "a[href*='/rent/']",
-                    "realt": "a[href*='/rent/flat-for-long/']",
-                }[source]
-                html = await fetch_rendered_html(url, wait_selector=wait_sel)
-                if source == "kufar":
-                    items = parse_kufar_html(html)
-                elif source == "domovita":
-                    items = parse_domovita_html(html)
-                else:
-                    items = parse_realt_html(html)
-            except Exception:
-                items = []
+        items = await self._latest_items(source)
 
         if not items:
             await query.edit_message_text(text="Ничего не нашлось. Попробуйте позже.")
             return
 
-        latest = items[0]
+        latest = self._latest_for_chat(query.message.chat_id, items)
+        if latest is None:
+            await query.edit_message_text(text="Под ваш фильтр ничего не нашлось.")
+            return
         await query.edit_message_text(text=format_listing_message(latest))
 
     async def cb_delete(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -292,3 +409,43 @@ class BotApp:
     def run_polling(self) -> None:
         self.app.run_polling(close_loop=False)
 
+    async def start_webhook(self, server: HttpServer, url: str, secret: str) -> None:
+        """Принимает обновления на встроенном сервере и регистрирует url в Telegram.
+
+        Путь маршрута берётся из url: снаружи его может отдавать прокси с TLS.
+        """
+        self.webhook_secret = secret
+        server.route("POST", urlsplit(url).path or "/", self.handle_webhook)
+        await self.app.initialize()
+        # Разбирает app.update_queue с параллелизмом из concurrent_updates
+        await self.app.start()
+        await server.start()
+        await self.app.bot.set_webhook(url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+        logging.getLogger("bot").info("webhook set to %s", url)
+
+    async def stop_webhook(self) -> None:
+        # Вебхук в Telegram не снимаем: обновления дождутся следующего запуска,
+        # а run_polling снимает его сам
+        await self.app.stop()
+        await self.app.shutdown()
+
+    async def handle_webhook(self, request: Request) -> Response:
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not self.webhook_secret or not hmac.compare_digest(token.encode(), self.webhook_secret.encode()):
+            WEBHOOK_UPDATES.labels("forbidden").inc()
+            return Response(403, b"")
+        try:
+            data = json.loads(request.body)
+            # de_json ждёт объект: на списке, строке или «message»: 5 падает с AttributeError
+            update = Update.de_json(data, self.app.bot) if isinstance(data, dict) else None
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.getLogger("bot").warning("bad webhook update: %s", e)
+            update = None
+        if update is None:
+            WEBHOOK_UPDATES.labels("bad_request").inc()
+            return Response(400, b"")
+        # Отвечаем сразу: обработка идёт в фоне, Telegram не ждёт её и не шлёт повторы
+        await self.app.update_queue.put(update)
+        WEBHOOK_UPDATES.labels("accepted").inc()
+        return Response(200, b"")
+
@@ -1,12 +1,49 @@
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple, TypeVar
+import asyncio
+import logging
+import os
+
 from playwright.sync_api import sync_playwright
-from playwright.async_api import async_playwright
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright, Response, Route
+
+
+T = TypeVar("T")
+
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+
+# Для парсинга карточек не нужны ни картинки, ни шрифты, ни счётчики
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_URL_PARTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "mc.yandex.ru",
+    "an.yandex.ru",
+    "yandex.ru/ads",
+    "facebook.net",
+    "connect.facebook",
+    "top-fwz1.mail.ru",
+    "adfox",
+    "criteo",
+    "hotjar",
+)
+
+# Какие ответы страницы слушать при перехвате выдачи: запросы самого сайта к своему API
+CAPTURE_RESOURCE_TYPES = {"xhr", "fetch"}
+# Сколько ещё ждать запрос к API после события load, прежде чем взять HTML
+CAPTURE_GRACE_SEC = 2.0
+# Память потомков проверяем раз в столько страниц: обход /proc не бесплатный
+RSS_CHECK_EVERY = 10
 
 
 def fetch_rendered_html_sync(url: str, wait_selector: str | None = None, timeout_ms: int = 20000) -> str:
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         context = browser.new_context(
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+            user_agent=USER_AGENT,
             viewport={"width": 1366, "height": 768},
             locale="ru-RU",
         )
@@ -23,23 +60,271 @@ def fetch_rendered_html_sync(url: str, wait_selector: str | None = None, timeout
         return html
 
 
-async def fetch_rendered_html(url: str, wait_selector: str | None = None, timeout_ms: int = 20000) -> str:
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
-            viewport={"width": 1366, "height": 768},
-            locale="ru-RU",
-        )
-        page = await context.new_page()
-        await page.goto(url, wait_until="networkidle", timeout=timeout_ms)
-        if wait_selector:
+async def _route_filter(route: Route) -> None:
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def _descendants_rss_mb(root_pid: int) -> float:
+    # Суммарный RSS всех потомков процесса (драйвер Playwright + Chromium) по /proc
+    try:
+        children: dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    stat = f.read().decode(errors="replace")
+            except OSError:
+                continue
+            # Поле comm может содержать пробелы и скобки — ppid идёт после последней ')'
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        total = 0
+        stack = list(children.get(root_pid, []))
+        while stack:
+            pid = stack.pop()
+            stack.extend(children.get(pid, []))
             try:
-                await page.wait_for_selector(wait_selector, timeout=timeout_ms)
+                with open(f"/proc/{pid}/statm", "rb") as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, ValueError, IndexError):
+                continue
+        return total / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+class BrowserPool:
+    """Долгоживущий Chromium с переиспользуемым контекстом и страницами.
+
+    Одновременно рендерится не больше max_concurrency страниц; браузер
+    перезапускается после max_pages отрендеренных страниц или при превышении
+    max_rss_mb суммарной памяти.
+    """
+
+    def __init__(self, max_concurrency: int = 2, max_pages: int = 50, max_rss_mb: int = 1024) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self._sem = asyncio.Semaphore(self.max_concurrency)
+        self._lock = asyncio.Lock()
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+        self._context: Optional[BrowserContext] = None
+        self._idle_pages: List[Page] = []
+        self._pages_served = 0
+        self._rss_checked_at = 0
+        self._active = 0
+        self.logger = logging.getLogger("browser")
+
+    async def _ensure_context(self) -> BrowserContext:
+        async with self._lock:
+            if self._browser is not None and not self._browser.is_connected():
+                self.logger.warning("browser disconnected, relaunching")
+                await self._shutdown_browser()
+            if self._context is None:
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                self._context = await self._browser.new_context(
+                    user_agent=USER_AGENT,
+                    viewport={"width": 1366, "height": 768},
+                    locale="ru-RU",
+                )
+                await self._context.route("**/*", _route_filter)
+                self._pages_served = 0
+                self._rss_checked_at = 0
+            return self._context
+
+    async def _needs_recycle(self) -> bool:
+        if self._browser is None:
+            return False
+        if self.max_pages and self._pages_served >= self.max_pages:
+            return True
+        if self.max_rss_mb and self._pages_served - self._rss_checked_at >= RSS_CHECK_EVERY:
+            # Обход /proc уводим с event loop в поток
+            self._rss_checked_at = self._pages_served
+            rss_mb = await asyncio.to_thread(_descendants_rss_mb, os.getpid())
+            if rss_mb >= self.max_rss_mb:
+                return True
+        return False
+
+    async def _shutdown_browser(self) -> None:
+        pages, self._idle_pages = self._idle_pages, []
+        for page in pages:
+            try:
+                await page.close()
             except Exception:
                 pass
-        html = await page.content()
-        await context.close()
-        await browser.close()
-        return html
+        context, browser = self._context, self._browser
+        self._context = None
+        self._browser = None
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    async def _maybe_recycle(self) -> None:
+        # Перезапускаем только когда ни одна страница не занята
+        async with self._lock:
+            if self._active == 0 and await self._needs_recycle():
+                self.logger.info("recycling browser after %d pages", self._pages_served)
+                await self._shutdown_browser()
+
+    async def _acquire_page(self) -> Page:
+        context = await self._ensure_context()
+        while self._idle_pages:
+            page = self._idle_pages.pop()
+            if not page.is_closed():
+                return page
+        return await context.new_page()
+
+    async def _release_page(self, page: Page, reusable: bool) -> None:
+        self._pages_served += 1
+        if reusable and not page.is_closed() and len(self._idle_pages) < self.max_concurrency:
+            self._idle_pages.append(page)
+        else:
+            try:
+                await page.close()
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def _page(self) -> AsyncIterator[Page]:
+        async with self._sem:
+            await self._maybe_recycle()
+            self._active += 1
+            page: Optional[Page] = None
+            reusable = False
+            try:
+                page = await self._acquire_page()
+                yield page
+                reusable = True
+            finally:
+                self._active -= 1
+                if page is not None:
+                    await self._release_page(page, reusable)
+
+    async def fetch_html(self, url: str, wait_selector: str | None = None, timeout_ms: int = 20000) -> str:
+        async with self._page() as page:
+            if wait_selector:
+                # Карточки появляются задолго до networkidle, который ждёт рекламу и счётчики
+                await page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
+                try:
+                    await page.wait_for_selector(wait_selector, timeout=timeout_ms)
+                except Exception:
+                    pass
+            else:
+                await page.goto(url, wait_until="networkidle", timeout=timeout_ms)
+            return await page.content()
+
+    async def capture_json(
+        self,
+        url: str,
+        matches: Callable[[str], bool],
+        parse: Callable[[Any], Optional[T]],
+        timeout_ms: int = 20000,
+    ) -> Tuple[Optional[T], Optional[str]]:
+        """Выдача из собственного запроса сайта к API вместо разбора DOM.
+
+        Слушает XHR/fetch-ответы, для которых matches(url) истинно, и возвращает
+        (parse(json), None) по первому ответу с непустым разбором — не дожидаясь
+        загрузки остальной страницы. Если такого ответа нет до timeout_ms или в
+        течение CAPTURE_GRACE_SEC после события load, возвращает (None, HTML той же страницы).
+        """
+        async with self._page() as page:
+            loop = asyncio.get_running_loop()
+            responses: "asyncio.Queue[Response]" = asyncio.Queue()
+
+            def on_response(response: Response) -> None:
+                if response.request.resource_type in CAPTURE_RESOURCE_TYPES and matches(response.url):
+                    responses.put_nowait(response)
+
+            page.on("response", on_response)
+            loaded: Optional["asyncio.Future[None]"] = None
+            try:
+                deadline = loop.time() + timeout_ms / 1000
+                await page.goto(url, wait_until="commit", timeout=timeout_ms)
+                loaded = asyncio.ensure_future(page.wait_for_load_state("load", timeout=timeout_ms))
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    getter = asyncio.ensure_future(responses.get())
+                    waiters = {getter} if loaded.done() else {getter, loaded}
+                    done, _ = await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                    if getter not in done:
+                        getter.cancel()
+                        if loaded.done():
+                            deadline = min(deadline, loop.time() + CAPTURE_GRACE_SEC)
+                        continue
+                    response = getter.result()
+                    try:
+                        result = parse(await response.json()) if response.ok else None
+                    except Exception as e:
+                        self.logger.debug("captured response %s not parsed: %s", response.url, e)
+                        continue
+                    if result:
+                        # Остальная страница не нужна: останавливаем её загрузку и скрипты
+                        await page.goto("about:blank")
+                        return result, None
+            finally:
+                page.remove_listener("response", on_response)
+                if loaded is not None:
+                    if loaded.done():
+                        loaded.exception()
+                    else:
+                        loaded.cancel()
+            # Сайт не запросил выдачу отдельно (например, отдал её в HTML) — разбираем страницу
+            return None, await page.content()
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._shutdown_browser()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
+_pool: Optional[BrowserPool] = None
+
+
+def configure_browser_pool(max_concurrency: int, max_pages: int, max_rss_mb: int) -> BrowserPool:
+    global _pool
+    _pool = BrowserPool(max_concurrency=max_concurrency, max_pages=max_pages, max_rss_mb=max_rss_mb)
+    return _pool
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool()
+    return _pool
+
+
+async def close_browser_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def fetch_rendered_html(url: str, wait_selector: str | None = None, timeout_ms: int = 20000) -> str:
+    return await get_browser_pool().fetch_html(url, wait_selector=wait_selector, timeout_ms=timeout_ms)
+
 
+async def capture_rendered_json(
+    url: str, matches: Callable[[str], bool], parse: Callable[[Any], Optional[T]], timeout_ms: int = 20000
+) -> Tuple[Optional[T], Optional[str]]:
+    return await get_browser_pool().capture_json(url, matches, parse, timeout_ms=timeout_ms)
@@ -1,6 +1,7 @@
 import os
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 
@@ -20,6 +21,60 @@ class AppConfig:
     kufar_url: str
     domovita_url: str
     realt_url: str
+    # Эндпоинт поискового API Kufar и адрес Bot API; пусто — боевые, подменяются для стендов
+    kufar_api_url: Optional[str] = None
+    telegram_api_url: Optional[str] = None
+    # Пул Playwright: сколько страниц рендерим одновременно и когда перезапускать браузер
+    browser_max_concurrency: int = 2
+    browser_max_pages: int = 50
+    browser_max_rss_mb: int = 1024
+    # Хранилище состояния: json (data/state.json) или sqlite (data/state.db)
+    state_backend: str = "json"
+    # Срок хранения просмотренных ID (дни) и размер фильтра Блума перед поиском (0 — выключен)
+    seen_retention_days: int = 30
+    seen_bloom_bits: int = 0
+    # Сколько страниц выдачи дочитывать после простоя или всплеска объявлений
+    crawl_max_pages: int = 5
+    # Лимиты рассылки: сообщений в секунду на бота и на чат, чатов обслуживается одновременно
+    telegram_global_rate: float = 25.0
+    telegram_chat_rate: float = 1.0
+    broadcast_concurrency: int = 16
+    # Дайджест: auto — склеивать, если за цикл больше digest_threshold объявлений; on / off
+    digest_mode: str = "auto"
+    digest_threshold: int = 5
+    # Сколько секунд команды бота отдают выдачу из кэша поллера
+    listing_cache_ttl_sec: int = 120
+    # Границы адаптивного интервала опроса источника, секунды
+    poll_min_sec: int = 30
+    poll_max_sec: int = 600
+    # Бюджет на опрос одного источника, секунды (0 — у каждого источника свой, по умолчанию 90)
+    source_timeout_sec: int = 0
+    # Эндпоинт /metrics в формате Prometheus (порт 0 — выключен)
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    # Поиск той же квартиры на разных сайтах: окно в часах (0 — выключен) и предел записей в памяти
+    dedup_window_hours: int = 72
+    dedup_max_entries: int = 20000
+    # Автомат размыкания источника: после скольких неудач подряд браузер ставится на паузу
+    # и через сколько секунд пробовать снова (пауза удваивается до breaker_probe_max_sec)
+    breaker_open_after: int = 3
+    breaker_probe_sec: int = 300
+    breaker_probe_max_sec: int = 3600
+    # Раздельные процессы (--mode worker / --mode bot): срок аренды источника воркером, секунды,
+    # и сколько источников один воркер берёт себе (0 — сколько свободно)
+    queue_lease_sec: int = 60
+    worker_max_sources: int = 0
+    # Вебхук вместо long polling: публичный адрес, на который Telegram шлёт обновления
+    # (пусто — long polling), локальный адрес встроенного сервера за прокси и секрет запросов
+    # (пусто — случайный на каждый запуск)
+    webhook_url: Optional[str] = None
+    webhook_host: str = "127.0.0.1"
+    webhook_port: int = 8080
+    webhook_secret: Optional[str] = None
+    # Сколько обновлений Telegram обрабатывать одновременно (обновления одного чата — по очереди)
+    update_concurrency: int = 16
+    # Писать span'ы этапов опроса и рассылки в лог (логгер trace, одна JSON-строка на span)
+    trace_spans: bool = False
 
 
 def load_config(override_max_price: int = None) -> AppConfig:
@@ -33,6 +88,18 @@ def load_config(override_max_price: int = None) -> AppConfig:
         val = val.strip() if isinstance(val, str) else ""
         return val or default
 
+    def env_int(key: str, default: int) -> int:
+        try:
+            return int(env_or_default(key, str(default)))
+        except ValueError:
+            return default
+
+    def env_float(key: str, default: float) -> float:
+        try:
+            return float(env_or_default(key, str(default)))
+        except ValueError:
+            return default
+
     # Максимальная цена парсинга (USD)
     # Приоритет: override_max_price > MAX_PRICE из .env > 350
     if override_max_price is not None:
@@ -59,5 +126,38 @@ def load_config(override_max_price: int = None) -> AppConfig:
             "REALT_URL",
             f"https://realt.by/rent/flat-for-long/?addressV2=%5B%7B%22townUuid%22%3A%224cb07174-7b00-11eb-8943-0cc47adabd66%22%7D%5D&page=1&priceTo={max_price}&priceType=840&rooms=1&rooms=2",
         ),
+        kufar_api_url=env_or_default("KUFAR_API_URL", "") or None,
+        telegram_api_url=env_or_default("TELEGRAM_API_URL", "") or None,
+        browser_max_concurrency=env_int("BROWSER_MAX_CONCURRENCY", 2),
+        browser_max_pages=env_int("BROWSER_MAX_PAGES", 50),
+        browser_max_rss_mb=env_int("BROWSER_MAX_RSS_MB", 1024),
+        state_backend=env_or_default("STATE_BACKEND", "json").lower(),
+        seen_retention_days=env_int("SEEN_RETENTION_DAYS", 30),
+        seen_bloom_bits=env_int("SEEN_BLOOM_BITS", 0),
+        crawl_max_pages=env_int("CRAWL_MAX_PAGES", 5),
+        telegram_global_rate=env_float("TELEGRAM_GLOBAL_RATE", 25.0),
+        telegram_chat_rate=env_float("TELEGRAM_CHAT_RATE", 1.0),
+        broadcast_concurrency=env_int("BROADCAST_CONCURRENCY", 16),
+        digest_mode=env_or_default("DIGEST_MODE", "auto").lower(),
+        digest_threshold=env_int("DIGEST_THRESHOLD", 5),
+        listing_cache_ttl_sec=env_int("LISTING_CACHE_TTL_SEC", 120),
+        poll_min_sec=env_int("POLL_MIN_SEC", 30),
+        poll_max_sec=env_int("POLL_MAX_SEC", 600),
+        source_timeout_sec=env_int("SOURCE_TIMEOUT_SEC", 0),
+        metrics_host=env_or_default("METRICS_HOST", "127.0.0.1"),
+        metrics_port=env_int("METRICS_PORT", 0),
+        dedup_window_hours=env_int("DEDUP_WINDOW_HOURS", 72),
+        dedup_max_entries=env_int("DEDUP_MAX_ENTRIES", 20000),
+        breaker_open_after=env_int("BREAKER_OPEN_AFTER", 3),
+        breaker_probe_sec=env_int("BREAKER_PROBE_SEC", 300),
+        breaker_probe_max_sec=env_int("BREAKER_PROBE_MAX_SEC", 3600),
+        queue_lease_sec=env_int("QUEUE_LEASE_SEC", 60),
+        worker_max_sources=env_int("WORKER_MAX_SOURCES", 0),
+        webhook_url=env_or_default("WEBHOOK_URL", "") or None,
+        webhook_host=env_or_default("WEBHOOK_HOST", "127.0.0.1"),
+        webhook_port=env_int("WEBHOOK_PORT", 8080),
+        webhook_secret=env_or_default("WEBHOOK_SECRET", "") or None,
+        update_concurrency=env_int("UPDATE_CONCURRENCY", 16),
+        trace_spans=env_int("TRACE_SPANS", 0) > 0,
     )
 
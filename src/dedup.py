@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import math
+import re
+import time
+import zlib
+
+from .models import Listing
+
+
+NUM_PERM = 32
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 2
+# Порог сходства названий улиц (дом уже совпал точно); полосы LSH 16 × 2 дают кандидатов примерно от 0.25
+SIMILARITY = 0.4
+# Допуски при сверке кандидата: цена и площадь у одной квартиры на разных сайтах чуть расходятся
+PRICE_TOLERANCE = 0.1
+AREA_TOLERANCE = 0.07
+# Дальше этого по координатам — разные дома, даже если адрес совпал (одноимённые улицы в разных городах)
+MAX_DISTANCE_M = 300
+
+_MERSENNE = (1 << 61) - 1
+_PERMUTATIONS = [
+    (1 + (zlib.crc32(f"a{i}".encode()) * 2654435761) % (_MERSENNE - 1), zlib.crc32(f"b{i}".encode()))
+    for i in range(NUM_PERM)
+]
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_HOUSE_RE = re.compile(r"\d+[а-я]?(?:к\d+)?")
+# Слова, которые есть в любом адресе или не различают дома: типы улиц, город, районы Минска,
+# а также слова описания квартиры — иначе «квартира 45 м²» читается как улица и дом
+_STOP_WORDS = frozenset(
+    "г город минск беларусь ул улица пр проспект пер переулок бульвар тракт проезд р н район д дом кв "
+    "центральный советский первомайский партизанский заводской ленинский октябрьский московский фрунзенский "
+    "квартира квартиру квартиры комнатная комнатную комнаты комната комнат комн студия сдается сдам сдаю "
+    "аренда снять м м2 м² кв м кв этаж этаже этажей площадь".split()
+)
+# Число перед единицей измерения — площадь или этаж, а не номер дома
+_UNIT_WORDS = frozenset("м м2 м² кв этаж этаже этажей".split())
+
+
+def address_key(item: Listing) -> Optional[Tuple[str, str]]:
+    """(улица, дом) из поля адреса: «ул. Притыцкого, 12» → ("притыцкого", "12").
+
+    Заголовок не разбираем: в нём числа — это комнаты, площадь и этаж.
+    """
+    if not item.location:
+        return None
+    tokens = _NON_WORD_RE.sub(" ", item.location.lower().replace("ё", "е")).split()
+    words = [
+        (w, nxt in _UNIT_WORDS)
+        for w, nxt in zip(tokens, tokens[1:] + [""])
+        if w not in _STOP_WORDS
+    ]
+    for (street, _), (house, before_unit) in zip(words, words[1:]):
+        if len(street) >= 3 and street.isalpha() and _HOUSE_RE.fullmatch(house) and not before_unit:
+            return street, house
+    return None
+
+
+def _shingles(text: str) -> Set[int]:
+    # Границы слова входят в шинглы: короткие названия улиц дают достаточно признаков
+    padded = f" {text} "
+    return {zlib.crc32(padded[i:i + SHINGLE].encode()) for i in range(len(padded) - SHINGLE + 1)}
+
+
+def minhash(shingles: Set[int]) -> Tuple[int, ...]:
+    return tuple(min((a * s + b) % _MERSENNE for s in shingles) for a, b in _PERMUTATIONS)
+
+
+def _close(a: Optional[float], b: Optional[float], tolerance: float) -> bool:
+    # Неизвестное значение не противоречит: сверяем только то, что есть у обоих
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+def _distance_m(a: Listing, b: Listing) -> Optional[float]:
+    if a.lat is None or a.lon is None or b.lat is None or b.lon is None:
+        return None
+    # Равнопромежуточная проекция: на сотнях метров погрешность ничтожна
+    x = math.radians(b.lon - a.lon) * math.cos(math.radians((a.lat + b.lat) / 2))
+    y = math.radians(b.lat - a.lat)
+    return 6371000 * math.hypot(x, y)
+
+
+@dataclass
+class Fingerprint:
+    listing: Listing
+    house: str
+    signature: Tuple[int, ...]
+    price: Optional[float]
+    rooms: Optional[int]
+    area: Optional[float]
+    seen_at: float
+
+    @classmethod
+    def of(cls, item: Listing, now: float) -> Optional["Fingerprint"]:
+        address = address_key(item)
+        if address is None:
+            # Без улицы и дома совпадение было бы случайным — такие объявления не склеиваем
+            return None
+        street, house = address
+        return cls(item, house, minhash(_shingles(street)), item.price_usd, item.rooms, item.area, now)
+
+    def similarity(self, other: "Fingerprint") -> float:
+        return sum(1 for x, y in zip(self.signature, other.signature) if x == y) / NUM_PERM
+
+    def same_flat(self, other: "Fingerprint") -> bool:
+        if self.house != other.house:
+            return False
+        if self.rooms is not None and other.rooms is not None and self.rooms != other.rooms:
+            return False
+        distance = _distance_m(self.listing, other.listing)
+        if distance is not None and distance > MAX_DISTANCE_M:
+            return False
+        return (
+            _close(self.price, other.price, PRICE_TOLERANCE)
+            and _close(self.area, other.area, AREA_TOLERANCE)
+            and self.similarity(other) >= SIMILARITY
+        )
+
+
+class DuplicateIndex:
+    """Поиск той же квартиры на других сайтах среди недавно разосланных объявлений.
+
+    Номер дома должен совпасть точно, название улицы — приблизительно: MinHash
+    по биграммам названия и LSH-полосы внутри дома находят опечатки и варианты
+    написания («Притыцкого» / «Притицкого»). Затем сверяются комнаты, цена и площадь. Объявления живут
+    window_sec и не больше max_entries — старые вытесняются, память ограничена.
+    window_sec <= 0 выключает поиск.
+    """
+
+    def __init__(self, window_sec: float = 72 * 3600, max_entries: int = 20000) -> None:
+        self.window_sec = window_sec
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Fingerprint]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _bands(fp: Fingerprint) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        return [(fp.house, b, fp.signature[b * ROWS:(b + 1) * ROWS]) for b in range(BANDS)]
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            key, fp = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - fp.seen_at <= self.window_sec:
+                break
+            del self._entries[key]
+            for band in self._bands(fp):
+                bucket = self._buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band]
+
+    def _find(self, fp: Fingerprint) -> Optional[Fingerprint]:
+        candidates: Set[Tuple[str, str]] = set()
+        for band in self._bands(fp):
+            candidates.update(self._buckets.get(band, ()))
+        best: Optional[Fingerprint] = None
+        for key in candidates:
+            other = self._entries[key]
+            # Объявления одного сайта не склеиваем: похожие квартиры в одном доме — разные квартиры
+            if other.listing.source == fp.listing.source or not fp.same_flat(other):
+                continue
+            if best is None or fp.similarity(other) > fp.similarity(best):
+                best = other
+        return best
+
+    def _add(self, fp: Fingerprint) -> None:
+        key = (fp.listing.source, fp.listing.id)
+        if key in self._entries:
+            return
+        self._entries[key] = fp
+        for band in self._bands(fp):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def process(self, items: Sequence[Listing], now: Optional[float] = None) -> Dict[int, Listing]:
+        """Запоминает объявления и возвращает {индекс в items: ранее разосланное объявление той же квартиры}."""
+        if self.window_sec <= 0:
+            return {}
+        now = time.time() if now is None else now
+        self._evict(now)
+        earlier: Dict[int, Listing] = {}
+        for idx, item in enumerate(items):
+            fp = Fingerprint.of(item, now)
+            if fp is None:
+                continue
+            match = self._find(fp)
+            if match is not None:
+                earlier[idx] = match.listing
+            self._add(fp)
+        self._evict(now)
+        return earlier
+
+
+_index: Optional[DuplicateIndex] = None
+
+
+def configure_dedup(window_sec: float, max_entries: int) -> DuplicateIndex:
+    global _index
+    _index = DuplicateIndex(window_sec, max_entries)
+    return _index
+
+
+def get_dedup_index() -> DuplicateIndex:
+    global _index
+    if _index is None:
+        _index = DuplicateIndex()
+    return _index
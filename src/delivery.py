@@ -0,0 +1,174 @@
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+import asyncio
+import logging
+import time
+
+from telegram import Bot
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+from .metrics import SEND_FAILURES, SEND_RETRIES, SEND_SECONDS
+from .tracing import span
+
+
+# Всплеск общего лимита: полный бакет в rate токенов выпустил бы вдвое больше лимита за первую секунду
+GLOBAL_BURST = 2.0
+# RetryAfter от стольких разных чатов за FLOOD_WINDOW_SEC — это лимит бота, а не одного чата
+GLOBAL_FLOOD_CHATS = 3
+FLOOD_WINDOW_SEC = 1.0
+
+
+class TokenBucket:
+    """Token bucket: в среднем rate операций в секунду, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        # RetryAfter от Telegram: никто не отправляет, пока не истечёт пауза
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle_since(self) -> float:
+        return self._updated
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if hasattr(value, "total_seconds"):
+        return float(value.total_seconds())
+    return float(value)
+
+
+class Broadcaster:
+    """Рассылка с ограниченной параллельностью и лимитами Telegram.
+
+    Общий token bucket держит глобальный лимит бота, отдельные — лимит на чат.
+    Сообщения одному чату уходят по порядку; RetryAfter ставит на паузу этот
+    чат, а всю рассылку — только когда он приходит сразу нескольким чатам.
+    Сообщение после паузы повторяется, сетевые ошибки повторяются с
+    экспоненциальной паузой.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25.0,
+        per_chat_rate: float = 1.0,
+        max_concurrency: int = 16,
+        max_retries: int = 5,
+    ) -> None:
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, capacity=GLOBAL_BURST)
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Последний RetryAfter по чатам — отличить лимит чата от лимита бота
+        self._flooded: Dict[int, float] = {}
+        self.logger = logging.getLogger("delivery")
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Бакеты простаивающих чатов давно полные — их можно забыть
+                cutoff = time.monotonic() - 60
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if b.idle_since > cutoff}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _on_retry_after(self, chat_id: int, chat_bucket: TokenBucket, delay: float) -> None:
+        chat_bucket.pause(delay)
+        now = time.monotonic()
+        self._flooded = {k: t for k, t in self._flooded.items() if now - t < FLOOD_WINDOW_SEC}
+        self._flooded[chat_id] = now
+        if len(self._flooded) >= GLOBAL_FLOOD_CHATS:
+            self.logger.warning("flood control for %d chats at once, pausing all sends for %.1fs", len(self._flooded), delay)
+            self.global_bucket.pause(delay)
+        else:
+            self.logger.warning("flood control for chat %s, retry in %.1fs", chat_id, delay)
+
+    async def send(self, chat_id: int, **kwargs: Any) -> bool:
+        """Отправляет одно сообщение с учётом лимитов и повторов. True — доставлено."""
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with span("telegram.send", attempt=attempt):
+                    await self.bot.send_message(chat_id=chat_id, **kwargs)
+                SEND_SECONDS.observe(time.perf_counter() - start)
+                return True
+            except RetryAfter as e:
+                self._on_retry_after(chat_id, chat_bucket, _retry_after_seconds(e))
+                reason = "retry_after"
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован / чат удалён / некорректное сообщение — повтор не поможет
+                self.logger.warning("send to chat %s rejected: %s", chat_id, e)
+                SEND_FAILURES.labels(type(e).__name__.lower()).inc()
+                return False
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    self.logger.warning("send to chat %s failed after %d retries: %s", chat_id, attempt, e)
+                    SEND_FAILURES.labels("network").inc()
+                    return False
+                await asyncio.sleep(min(30.0, 2 ** attempt))
+                reason = "network"
+            except Exception as e:
+                self.logger.warning("send to chat %s failed: %s", chat_id, e)
+                SEND_FAILURES.labels("other").inc()
+                return False
+            attempt += 1
+            if attempt > self.max_retries * 4:
+                self.logger.warning("send to chat %s gave up after %d attempts", chat_id, attempt)
+                SEND_FAILURES.labels(reason).inc()
+                return False
+            SEND_RETRIES.labels(reason).inc()
+
+    async def _send_all_to_chat(self, chat_id: int, messages: Sequence[Dict[str, Any]]) -> Tuple[int, int]:
+        sent = failed = 0
+        async with self._sem:
+            for message in messages:
+                if await self.send(chat_id, **message):
+                    sent += 1
+                else:
+                    failed += 1
+        return sent, failed
+
+    async def broadcast(self, chat_ids: Iterable[int], messages: Sequence[Dict[str, Any]]) -> Tuple[int, int]:
+        """Рассылает messages (kwargs для send_message) во все чаты. Возвращает (доставлено, ошибок)."""
+        if not messages:
+            return 0, 0
+        chat_ids = list(chat_ids)
+        with span("telegram.broadcast", chats=len(chat_ids), messages=len(messages)) as sp:
+            results: List[Tuple[int, int]] = await asyncio.gather(
+                *(self._send_all_to_chat(chat_id, messages) for chat_id in chat_ids)
+            )
+            sent = sum(r[0] for r in results)
+            failed = sum(r[1] for r in results)
+            sp.set(sent=sent, failed=failed)
+        return sent, failed
@@ -0,0 +1,304 @@
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, replace
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+import re
+
+from .models import Listing
+
+
+# Слова фильтра совпадают с началом слова объявления: «балкон» находит «балконом»
+MIN_TERM_LEN = 3
+
+_WORD_RE = re.compile(r"\w+")
+
+FIELD_ALIASES = {
+    "цена": "price", "price": "price",
+    "комнаты": "rooms", "rooms": "rooms",
+    "районы": "districts", "район": "districts", "districts": "districts",
+    "источники": "sources", "sources": "sources",
+    "слова": "keywords", "keywords": "keywords",
+}
+RESET_WORDS = {"сброс", "reset"}
+CLEAR_VALUE = "-"
+
+
+def _words(*texts: Optional[str]) -> Set[str]:
+    return {w for t in texts if t for w in _WORD_RE.findall(t.lower())}
+
+
+def _term_hit(terms: Iterable[str], words: Set[str]) -> bool:
+    return any(w.startswith(t) for t in terms for w in words)
+
+
+@dataclass(frozen=True)
+class ChatFilter:
+    """Что хочет получать один чат. Пустое поле — без ограничения.
+
+    Цена задаётся в долларах; у объявления без цены в $ или без числа комнат ограничение
+    по этому полю его не отсекает: лучше лишнее сообщение, чем пропущенная квартира.
+    """
+
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    rooms: FrozenSet[int] = frozenset()
+    districts: FrozenSet[str] = frozenset()
+    sources: FrozenSet[str] = frozenset()
+    keywords: FrozenSet[str] = frozenset()
+
+    @property
+    def is_empty(self) -> bool:
+        return self == NO_FILTER
+
+    def matches(self, item: Listing) -> bool:
+        if self.sources and item.source not in self.sources:
+            return False
+        price = item.price_usd
+        if price is not None:
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+        rooms = item.rooms
+        if self.rooms and rooms is not None and rooms not in self.rooms:
+            return False
+        if self.districts and not _term_hit(self.districts, _words(item.location)):
+            return False
+        if self.keywords and not _term_hit(self.keywords, _words(item.title, item.location)):
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {}
+        if self.min_price is not None:
+            data["min_price"] = self.min_price
+        if self.max_price is not None:
+            data["max_price"] = self.max_price
+        for name in ("rooms", "districts", "sources", "keywords"):
+            values = getattr(self, name)
+            if values:
+                data[name] = sorted(values)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ChatFilter":
+        return cls(
+            min_price=data.get("min_price"),
+            max_price=data.get("max_price"),
+            rooms=frozenset(int(r) for r in data.get("rooms") or ()),
+            districts=frozenset(data.get("districts") or ()),
+            sources=frozenset(data.get("sources") or ()),
+            keywords=frozenset(data.get("keywords") or ()),
+        )
+
+    def describe(self) -> str:
+        if self.is_empty:
+            return "Фильтр не задан: приходят все новые объявления."
+        lines = []
+        if self.min_price is not None or self.max_price is not None:
+            low = self.min_price if self.min_price is not None else ""
+            high = self.max_price if self.max_price is not None else ""
+            lines.append(f"• Цена, USD: {low}-{high}")
+        if self.rooms:
+            lines.append("• Комнаты: " + ", ".join(str(r) for r in sorted(self.rooms)))
+        if self.districts:
+            lines.append("• Районы: " + ", ".join(sorted(self.districts)))
+        if self.sources:
+            lines.append("• Источники: " + ", ".join(sorted(self.sources)))
+        if self.keywords:
+            lines.append("• Слова: " + ", ".join(sorted(self.keywords)))
+        return "\n".join(lines)
+
+
+NO_FILTER = ChatFilter()
+
+
+def _parse_price(value: str) -> Tuple[Optional[int], Optional[int]]:
+    low, sep, high = value.partition("-")
+    if not sep:
+        raise ValueError("Цена задаётся диапазоном: 200-400, -400 или 200-")
+    try:
+        bounds = (int(low) if low else None, int(high) if high else None)
+    except ValueError:
+        raise ValueError("Цена — целые числа в USD, например 200-400")
+    if bounds[0] is not None and bounds[1] is not None and bounds[0] > bounds[1]:
+        raise ValueError("Нижняя граница цены больше верхней")
+    return bounds
+
+
+def _parse_terms(values: List[str], what: str) -> FrozenSet[str]:
+    terms = frozenset(v.lower() for v in values)
+    short = [t for t in terms if len(t) < MIN_TERM_LEN or not _WORD_RE.fullmatch(t)]
+    if short:
+        raise ValueError(f"{what}: нужно одно слово не короче {MIN_TERM_LEN} букв, а не «{short[0]}»")
+    return terms
+
+
+def parse_filter_args(args: Sequence[str], current: ChatFilter, known_sources: Iterable[str]) -> ChatFilter:
+    """Разбирает аргументы /filter поверх текущего фильтра.
+
+    `цена 200-400 комнаты 1,2 районы центральный источники kufar слова балкон`;
+    значение «-» сбрасывает поле, `сброс` — весь фильтр.
+    """
+    if len(args) == 1 and args[0].lower() in RESET_WORDS:
+        return NO_FILTER
+    fields: Dict[str, List[str]] = {}
+    key: Optional[str] = None
+    for arg in args:
+        alias = FIELD_ALIASES.get(arg.lower())
+        if alias is not None:
+            key = alias
+            fields[key] = []
+            continue
+        if key is None:
+            raise ValueError(f"Неизвестное поле «{arg}». Поля: цена, комнаты, районы, источники, слова")
+        fields[key].extend(v for v in arg.split(",") if v)
+
+    changes: Dict[str, Any] = {}
+    for key, values in fields.items():
+        if values == [CLEAR_VALUE] or not values:
+            if key == "price":
+                changes.update(min_price=None, max_price=None)
+            else:
+                changes[key] = frozenset()
+            continue
+        if key == "price":
+            changes["min_price"], changes["max_price"] = _parse_price("".join(values))
+        elif key == "rooms":
+            try:
+                changes["rooms"] = frozenset(int(v) for v in values)
+            except ValueError:
+                raise ValueError("Комнаты — числа через запятую, например 1,2")
+        elif key == "sources":
+            known = set(known_sources)
+            sources = frozenset(v.lower() for v in values)
+            unknown = sources - known
+            if unknown:
+                raise ValueError(f"Неизвестный источник «{sorted(unknown)[0]}». Есть: {', '.join(sorted(known))}")
+            changes["sources"] = sources
+        elif key == "districts":
+            changes["districts"] = _parse_terms(values, "Район")
+        else:
+            changes["keywords"] = _parse_terms(values, "Слово")
+    return replace(current, **changes)
+
+
+def _bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class FilterIndex:
+    """Поиск подписчиков, которым подходит объявление, без перебора их фильтров.
+
+    Чаты с одинаковым фильтром объединяются в группы; каждое условие — битовая
+    маска групп (int). Источник и комнаты — маска на значение, цена — маски по
+    границам диапазонов (bisect по отсортированным границам), районы и слова —
+    posting-списки по началу слова. Маска объявления — AND масок всех условий.
+    """
+
+    def __init__(self, filters_by_chat: Mapping[int, ChatFilter]) -> None:
+        grouped: Dict[ChatFilter, List[int]] = {}
+        for chat_id, flt in filters_by_chat.items():
+            grouped.setdefault(flt, []).append(chat_id)
+        self.groups: List[Tuple[ChatFilter, List[int]]] = list(grouped.items())
+        self.all_groups = (1 << len(self.groups)) - 1
+
+        self._any_source = 0
+        self._by_source: Dict[str, int] = {}
+        self._any_rooms = 0
+        self._by_rooms: Dict[int, int] = {}
+        self._any_district = 0
+        self._by_district: Dict[str, int] = {}
+        self._any_keyword = 0
+        self._by_keyword: Dict[str, int] = {}
+        no_min = no_max = 0
+        mins: Dict[int, int] = {}
+        maxes: Dict[int, int] = {}
+        for g, (flt, _chats) in enumerate(self.groups):
+            bit = 1 << g
+            self._any_source |= self._post(bit, flt.sources, self._by_source)
+            self._any_rooms |= self._post(bit, flt.rooms, self._by_rooms)
+            self._any_district |= self._post(bit, flt.districts, self._by_district)
+            self._any_keyword |= self._post(bit, flt.keywords, self._by_keyword)
+            if flt.min_price is None:
+                no_min |= bit
+            else:
+                mins[flt.min_price] = mins.get(flt.min_price, 0) | bit
+            if flt.max_price is None:
+                no_max |= bit
+            else:
+                maxes[flt.max_price] = maxes.get(flt.max_price, 0) | bit
+
+        # _min_ok[i]: группы с min_price <= цены, если цена попала после i-й границы
+        self._min_edges = sorted(mins)
+        self._min_ok = [no_min]
+        for edge in self._min_edges:
+            self._min_ok.append(self._min_ok[-1] | mins[edge])
+        # _max_ok[i]: группы с max_price >= цены, если цена не выше i-й границы
+        self._max_edges = sorted(maxes)
+        self._max_ok = [no_max] * (len(self._max_edges) + 1)
+        for i in range(len(self._max_edges) - 1, -1, -1):
+            self._max_ok[i] = self._max_ok[i + 1] | maxes[self._max_edges[i]]
+        self._term_lens = sorted({len(t) for t in (*self._by_district, *self._by_keyword)})
+
+    @staticmethod
+    def _post(bit: int, values: Iterable[Any], postings: Dict[Any, int]) -> int:
+        # Группа без ограничения попадает в маску «любое значение», иначе — в posting каждого значения
+        empty = True
+        for value in values:
+            postings[value] = postings.get(value, 0) | bit
+            empty = False
+        return bit if empty else 0
+
+    def _terms_mask(self, words: Set[str], postings: Dict[str, int]) -> int:
+        mask = 0
+        if not postings:
+            return mask
+        for word in words:
+            for n in self._term_lens:
+                if n > len(word):
+                    break
+                mask |= postings.get(word[:n], 0)
+        return mask
+
+    def match(self, item: Listing) -> int:
+        """Маска групп, которым подходит объявление."""
+        mask = self._any_source | self._by_source.get(item.source, 0)
+        price = item.price_usd
+        if price is not None:
+            mask &= self._min_ok[bisect_right(self._min_edges, price)]
+            mask &= self._max_ok[bisect_left(self._max_edges, price)]
+        rooms = item.rooms
+        if rooms is not None:
+            mask &= self._any_rooms | self._by_rooms.get(rooms, 0)
+        if mask & ~self._any_district:
+            mask &= self._any_district | self._terms_mask(_words(item.location), self._by_district)
+        if mask & ~self._any_keyword:
+            mask &= self._any_keyword | self._terms_mask(_words(item.title, item.location), self._by_keyword)
+        return mask
+
+    def chats(self, mask: int) -> List[int]:
+        return [chat_id for g in _bits(mask) for chat_id in self.groups[g][1]]
+
+    def route(
+        self, items: Sequence[Listing], delivered: Optional[Mapping[int, Listing]] = None
+    ) -> List[Tuple[Tuple[int, ...], List[int]]]:
+        """Раскладка рассылки: (индексы объявлений, чаты) — чатам с одинаковым набором одни сообщения.
+
+        delivered — для дубликатов: {индекс: та же квартира, разосланная раньше}; чаты,
+        которым подходила она, дубликат не получают.
+        """
+        delivered = delivered or {}
+        per_group: Dict[int, List[int]] = {}
+        for idx, item in enumerate(items):
+            mask = self.match(item)
+            if idx in delivered:
+                mask &= ~self.match(delivered[idx])
+            for g in _bits(mask):
+                per_group.setdefault(g, []).append(idx)
+        by_items: Dict[Tuple[int, ...], List[int]] = {}
+        for g, idxs in per_group.items():
+            by_items.setdefault(tuple(idxs), []).extend(self.groups[g][1])
+        return list(by_items.items())
@@ -0,0 +1,150 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+import logging
+import time
+
+from .metrics import SOURCE_STATE_CHANGES
+from .models import MINSK_TZ
+from .utils import parse_datetime
+
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+OPEN = "open"
+
+
+class SourceHealth:
+    """Автомат размыкания одного источника.
+
+    healthy — последний опрос удался; degraded — неудачи подряд, но меньше
+    open_after, фолбэк на браузер ещё пробуем; open — источник считается
+    сломанным: дешёвый запрос идёт по расписанию поллера, а браузер запускается
+    только пробой (half-open) раз в backoff. Неудачная проба удваивает backoff
+    до backoff_max_sec, любой успешный опрос возвращает источник в healthy.
+    """
+
+    def __init__(self, name: str, open_after: int, backoff_sec: float, backoff_max_sec: float) -> None:
+        self.name = name
+        self.open_after = max(1, open_after)
+        self.backoff_sec = backoff_sec
+        self.backoff_max_sec = max(backoff_sec, backoff_max_sec)
+        self.state = HEALTHY
+        self.consecutive_failures = 0
+        self.last_success: Optional[datetime] = None
+        self.last_failure: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.backoff = backoff_sec
+        self.probe_at: Optional[float] = None
+        self._probing = False
+
+    def allow_fallback(self, now: Optional[float] = None) -> bool:
+        """Можно ли запускать браузер; в open разрешает одну пробу, когда вышел backoff."""
+        if self.state != OPEN:
+            return True
+        now = time.monotonic() if now is None else now
+        if self._probing or self.probe_at is None or now < self.probe_at:
+            return False
+        self._probing = True
+        return True
+
+    def probe_in(self, now: Optional[float] = None) -> Optional[float]:
+        if self.state != OPEN or self.probe_at is None:
+            return None
+        return max(0.0, self.probe_at - (time.monotonic() if now is None else now))
+
+    def to_dict(self) -> Dict[str, Any]:
+        probe = self.probe_in()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_success": self.last_success.isoformat() if self.last_success else None,
+            "last_error": self.last_error,
+            # Монотонные часы у каждого процесса свои — наружу отдаём время по часам системы
+            "probe_at": time.time() + probe if probe is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, name: str, data: Dict[str, Any]) -> "SourceHealth":
+        """Состояние, присланное процессом-воркером: только для показа в /health."""
+        health = cls(name, open_after=1, backoff_sec=0, backoff_max_sec=0)
+        health.state = data.get("state") or HEALTHY
+        health.consecutive_failures = int(data.get("consecutive_failures") or 0)
+        health.last_success = parse_datetime(data.get("last_success"))
+        health.last_error = data.get("last_error")
+        if data.get("probe_at") is not None:
+            health.probe_at = time.monotonic() + data["probe_at"] - time.time()
+        return health
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.last_success = datetime.now(MINSK_TZ)
+        self.last_error = None
+        self.backoff = self.backoff_sec
+        self.probe_at = None
+        self._probing = False
+        self._set_state(HEALTHY)
+
+    def record_failure(self, now: Optional[float] = None) -> None:
+        """Неудачный опрос; причину вызывающий кладёт в last_error."""
+        now = time.monotonic() if now is None else now
+        self.consecutive_failures += 1
+        self.last_failure = datetime.now(MINSK_TZ)
+        if self.state == OPEN:
+            # Неудачи дешёвого запроса пробу не откладывают, неудачная проба — удваивает паузу
+            if self._probing:
+                self._probing = False
+                self.backoff = min(self.backoff * 2, self.backoff_max_sec)
+                self.probe_at = now + self.backoff
+        elif self.consecutive_failures >= self.open_after:
+            self.backoff = self.backoff_sec
+            self.probe_at = now + self.backoff
+            self._set_state(OPEN)
+        else:
+            self._set_state(DEGRADED)
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger = logging.getLogger("health")
+        if state == OPEN:
+            logger.warning(
+                "%s: %d failed polls in a row (%s), browser fallback paused for %.0fs",
+                self.name, self.consecutive_failures, self.last_error or "no listings", self.backoff,
+            )
+        elif state == HEALTHY and self.state == OPEN:
+            logger.warning("%s: recovered", self.name)
+        else:
+            logger.info("%s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        SOURCE_STATE_CHANGES.labels(self.name, state).inc()
+
+
+class HealthRegistry:
+    def __init__(self, open_after: int = 3, backoff_sec: float = 300.0, backoff_max_sec: float = 3600.0) -> None:
+        self.open_after = open_after
+        self.backoff_sec = backoff_sec
+        self.backoff_max_sec = backoff_max_sec
+        self._sources: Dict[str, SourceHealth] = {}
+
+    def get(self, source: str) -> SourceHealth:
+        health = self._sources.get(source)
+        if health is None:
+            health = SourceHealth(source, self.open_after, self.backoff_sec, self.backoff_max_sec)
+            self._sources[source] = health
+        return health
+
+
+_registry: Optional[HealthRegistry] = None
+
+
+def configure_health(open_after: int, backoff_sec: float, backoff_max_sec: float) -> HealthRegistry:
+    global _registry
+    _registry = HealthRegistry(open_after, backoff_sec, backoff_max_sec)
+    return _registry
+
+
+def get_health() -> HealthRegistry:
+    global _registry
+    if _registry is None:
+        _registry = HealthRegistry()
+    return _registry
@@ -0,0 +1,141 @@
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import logging
+
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+READ_TIMEOUT_SEC = 10.0
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, list]
+    headers: Dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(status)
+        self.status = status
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1-сервер на asyncio для служебных эндпоинтов (/metrics и т.п.).
+
+    Один запрос на соединение, без keep-alive и chunked: клиенты — Prometheus
+    и Telegram, обоим этого достаточно.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.logger = logging.getLogger("httpserver")
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        if not self.port:
+            # Порт 0 — выбранный системой свободный порт (стенды нагрузочного теста)
+            self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info("listening on http://%s:%d", self.host, self.port)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Request:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), READ_TIMEOUT_SEC)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            raise _BadRequest(400)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ", 2)
+        except ValueError:
+            raise _BadRequest(400)
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise _BadRequest(400)
+        if length > MAX_BODY_BYTES:
+            raise _BadRequest(413)
+        body = b""
+        if length:
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT_SEC)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                raise _BadRequest(400)
+        parts = urlsplit(target)
+        return Request(method.upper(), parts.path or "/", parse_qs(parts.query), headers, body)
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, b"method not allowed\n")
+            return Response(404, b"not found\n")
+        try:
+            return await handler(request)
+        except Exception:
+            self.logger.exception("handler for %s %s failed", request.method, request.path)
+            return Response(500, b"internal error\n")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                response = await self._dispatch(await self._read_request(reader))
+            except _BadRequest as e:
+                response = Response(e.status, b"")
+            head = [
+                f"HTTP/1.1 {response.status} {_REASONS.get(response.status, 'Unknown')}",
+                f"Content-Type: {response.content_type}",
+                f"Content-Length: {len(response.body)}",
+                "Connection: close",
+            ]
+            head.extend(f"{k}: {v}" for k, v in response.headers.items())
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + response.body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
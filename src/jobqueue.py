@@ -0,0 +1,281 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from .config import DATA_DIR
+from .health import SourceHealth
+from .models import Listing
+
+
+QUEUE_DB_FILE = DATA_DIR / "queue.db"
+
+# Аренда счётчика пустых циклов: его ведёт один воркер, а не каждый
+TICK_LEASE = "@tick"
+# Задание, которое бот не подтвердил, снова становится видимым через столько секунд
+VISIBILITY_SEC = 120.0
+# После стольких неудачных попыток задание выбрасывается, а не крутится вечно
+MAX_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    visible_at REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    updated REAL NOT NULL,
+    listings TEXT NOT NULL,
+    health TEXT
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class JobQueue:
+    """Очередь и аренды в SQLite для раздельных процессов (--mode worker / --mode bot).
+
+    Воркер опрашивает только источники, аренду которых держит: аренда живёт
+    lease_sec и продлевается, пока процесс жив, поэтому две реплики не ходят на
+    один сайт, а источники упавшего воркера подхватывает другой. Новые
+    объявления воркер кладёт заданиями в jobs, бот забирает их с таймаутом
+    видимости и удаляет после рассылки (доставка «хотя бы один раз»). Последняя
+    выдача и состояние каждого источника лежат в sources — для команд бота.
+
+    Методы блокирующие: из event loop их вызывают через asyncio.to_thread,
+    соединение общее для потоков и защищено замком.
+    """
+
+    def __init__(
+        self,
+        path: Path = QUEUE_DB_FILE,
+        lease_sec: float = 60.0,
+        max_sources: int = 0,
+        owner: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.lease_sec = lease_sec
+        self.max_sources = max_sources
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        # Транзакции открываются явно (BEGIN IMMEDIATE): выбор и захват строк — одна запись
+        self.conn = sqlite3.connect(str(path), timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._free_since: Dict[str, float] = {}
+        self.logger = logging.getLogger("jobqueue")
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _read(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    # Аренды
+
+    def hold(self, name: str, now: Optional[float] = None) -> bool:
+        """Берёт или продлевает аренду; False — её держит другой живой процесс."""
+        now = time.time() if now is None else now
+        with self._tx() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            mine = row is not None and row[0] == self.owner
+            if row is not None and not mine and row[1] >= now:
+                self._free_since.pop(name, None)
+                return False
+            if not mine and self.max_sources and not name.startswith("@"):
+                held = conn.execute(
+                    "SELECT COUNT(*) FROM leases WHERE owner = ? AND expires_at >= ? AND name NOT LIKE '@%'",
+                    (self.owner, now),
+                ).fetchone()[0]
+                # Сверх своей доли берём только источник, который целую аренду никто не подобрал
+                free_since = self._free_since.setdefault(name, now)
+                if held >= self.max_sources and now - free_since < self.lease_sec:
+                    return False
+            self._free_since.pop(name, None)
+            conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at",
+                (name, self.owner, now + self.lease_sec),
+            )
+        if not mine:
+            self.logger.info("%s: lease taken by %s", name, self.owner)
+        return True
+
+    def renew(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._tx() as conn:
+            return conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE owner = ? AND expires_at >= ?",
+                (now + self.lease_sec, self.owner, now),
+            ).rowcount
+
+    def release_all(self) -> None:
+        with self._tx() as conn:
+            conn.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+
+    # Задания
+
+    def put(self, kind: str, payload: Dict[str, Any], listings: int = 0) -> None:
+        now = time.time()
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now),
+            )
+            if listings:
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES ('published', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    (listings,),
+                )
+
+    def take(self, limit: int = 20, visibility_sec: float = VISIBILITY_SEC) -> List[Job]:
+        now = time.time()
+        with self._tx() as conn:
+            rows = conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs WHERE visible_at <= ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            jobs: List[Job] = []
+            for job_id, kind, payload, attempts in rows:
+                if attempts >= MAX_ATTEMPTS:
+                    self.logger.warning("job %d (%s) dropped after %d attempts", job_id, kind, attempts)
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET visible_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now + visibility_sec, job_id),
+                )
+                jobs.append(Job(job_id, kind, json.loads(payload), attempts + 1))
+        return jobs
+
+    def ack(self, job_id: int) -> None:
+        with self._tx() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def published(self) -> int:
+        """Сколько новых объявлений положено в очередь за всё время — для счётчика пустых циклов."""
+        row = self._read("SELECT value FROM counters WHERE name = 'published'")
+        return int(row[0]) if row else 0
+
+    def pending(self) -> int:
+        return self._read("SELECT COUNT(*) FROM jobs")[0]
+
+    # Снимки источников
+
+    def put_source(self, name: str, items: Optional[Iterable[Listing]], health: SourceHealth) -> None:
+        with self._tx() as conn:
+            if items is None:
+                # Выдачи в этот раз нет — обновляем только состояние, прошлый снимок оставляем
+                conn.execute(
+                    "INSERT INTO sources (name, owner, updated, listings, health) VALUES (?, ?, ?, '[]', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, health = excluded.health",
+                    (name, self.owner, time.time(), json.dumps(health.to_dict())),
+                )
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO sources (name, owner, updated, listings, health) VALUES (?, ?, ?, ?, ?)",
+                (
+                    name,
+                    self.owner,
+                    time.time(),
+                    json.dumps([i.to_dict() for i in items], ensure_ascii=False),
+                    json.dumps(health.to_dict()),
+                ),
+            )
+
+    def source_listings(self, name: str) -> List[Listing]:
+        row = self._read("SELECT listings FROM sources WHERE name = ?", (name,))
+        return [Listing.from_dict(d) for d in json.loads(row[0])] if row else []
+
+    def source_health(self, name: str) -> Optional[SourceHealth]:
+        row = self._read("SELECT health FROM sources WHERE name = ?", (name,))
+        if not row or not row[0]:
+            return None
+        return SourceHealth.from_dict(name, json.loads(row[0]))
+
+
+class QueueBot:
+    """Бот для процесса-воркера: вместо отправки в Telegram кладёт задания в очередь."""
+
+    def __init__(self, queue: JobQueue) -> None:
+        self.queue = queue
+
+    async def broadcast(self, items: Iterable[Listing]) -> None:
+        items = list(items)
+        if items:
+            await asyncio.to_thread(
+                self.queue.put, "broadcast", {"listings": [i.to_dict() for i in items]}, len(items)
+            )
+
+    async def notify_no_updates(self, count: int) -> None:
+        await asyncio.to_thread(self.queue.put, "no_updates", {"count": count})
+
+
+async def consume_jobs(queue: JobQueue, bot: Any, poll_sec: float = 1.0) -> None:
+    """Цикл процесса-бота: рассылает задания воркеров и подтверждает их."""
+    logger = logging.getLogger("jobqueue")
+    while True:
+        try:
+            jobs = await asyncio.to_thread(queue.take)
+        except sqlite3.Error as e:
+            logger.warning("queue read failed: %s", e)
+            jobs = []
+        for job in jobs:
+            try:
+                if job.kind == "broadcast":
+                    await bot.broadcast([Listing.from_dict(d) for d in job.payload["listings"]])
+                elif job.kind == "no_updates":
+                    await bot.notify_no_updates(int(job.payload["count"]))
+                else:
+                    logger.warning("job %d: unknown kind %s", job.id, job.kind)
+            except Exception as e:
+                # Задание вернётся в очередь по таймауту видимости
+                logger.warning("job %d (%s) failed, attempt %d: %s", job.id, job.kind, job.attempts, e)
+                continue
+            await asyncio.to_thread(queue.ack, job.id)
+        if not jobs:
+            await asyncio.sleep(poll_sec)
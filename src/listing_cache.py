@@ -0,0 +1,69 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from .models import Listing
+
+
+class ListingCache:
+    """Последняя выдача по каждому источнику с TTL.
+
+    Поллер публикует сюда результаты цикла, команды бота читают без похода на
+    сайт. Запись помнит адрес выдачи: после смены цены (/max_price) выдача по
+    старому адресу не отдаётся. Одновременные промахи по одному адресу
+    сливаются в одну загрузку.
+    """
+
+    def __init__(self, ttl_sec: float = 120.0) -> None:
+        self.ttl_sec = ttl_sec
+        self._entries: Dict[str, Tuple[str, float, List[Listing]]] = {}
+        self._inflight: Dict[Tuple[str, str], "asyncio.Task[List[Listing]]"] = {}
+
+    def publish(self, source: str, url: str, items: List[Listing]) -> None:
+        self._entries[source] = (url, time.monotonic(), list(items))
+
+    def get_fresh(self, source: str, url: Optional[str] = None) -> Optional[List[Listing]]:
+        """Свежая выдача источника; с url — только если она получена по этому адресу."""
+        entry = self._entries.get(source)
+        if entry is None or time.monotonic() - entry[1] > self.ttl_sec:
+            return None
+        if url is not None and entry[0] != url:
+            return None
+        return entry[2]
+
+    async def get(self, source: str, url: str, loader: Callable[[], Awaitable[List[Listing]]]) -> List[Listing]:
+        cached = self.get_fresh(source, url)
+        if cached is not None:
+            return cached
+        key = (source, url)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(source, url, loader))
+            self._inflight[key] = task
+        # shield: отмена одного ожидающего не отменяет общую загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def _load(self, source: str, url: str, loader: Callable[[], Awaitable[List[Listing]]]) -> List[Listing]:
+        try:
+            items = await loader()
+            if items:
+                self.publish(source, url, items)
+            return items
+        finally:
+            self._inflight.pop((source, url), None)
+
+
+_cache: Optional[ListingCache] = None
+
+
+def configure_listing_cache(ttl_sec: float) -> ListingCache:
+    global _cache
+    _cache = ListingCache(ttl_sec=ttl_sec)
+    return _cache
+
+
+def get_listing_cache() -> ListingCache:
+    global _cache
+    if _cache is None:
+        _cache = ListingCache()
+    return _cache
@@ -0,0 +1,483 @@
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+import time
+
+from .bot import BotApp
+from .httpserver import HttpServer, Request, Response
+from .main import poll_loop
+from .models import MINSK_TZ
+from .scrapers.http import close_http_pool
+from .scrapers.kufar import configure_kufar_api
+from .sources import SOURCES
+from .state import StateStore
+from .tracing import SpanCollector, add_sink, remove_sink
+
+
+# Пути стенда повторяют пути сайтов: скраперы и with_page_param работают с ними как с настоящими
+KUFAR_PATH = "/l/minsk/snyat/kvartiru"
+KUFAR_API_PATH = "/search-api/v1/search/rendered-paginated"
+DOMOVITA_PATH = "/minsk/flats/rent"
+REALT_PATH = "/rent/flat-for-long/"
+KUFAR_QUERY = {"cat": "1010", "cur": "USD", "gtsy": "country-belarus~province-minsk~locality-minsk", "lang": "ru", "size": "30", "typ": "let"}
+
+PAGE_SIZE = 30
+FEED_KEEP = 600
+SEED_LISTINGS = 60
+FAKE_TOKEN = "100000:loadtest"
+CHAT_ID_BASE = 10_000_000
+# Короткий всплеск в один чат Telegram терпит — 429 приходит на устойчивое превышение
+CHAT_BURST = 3.0
+
+_URL_RE = re.compile(r"URL: (\S+)")
+
+
+@dataclass
+class FakeListing:
+    id: int
+    title: str
+    rooms: int
+    price: int
+    address: str
+    created: datetime
+
+
+class SiteFeed:
+    """Выдача одного сайта: свежие объявления сверху, новые появляются по publish()."""
+
+    def __init__(self, source: str, first_id: int, listing_url: Callable[[int], str]) -> None:
+        self.source = source
+        self.listing_url = listing_url
+        self.items: List[FakeListing] = []
+        self._next_id = first_id
+
+    def publish(self, count: int, created: datetime) -> List[FakeListing]:
+        fresh = []
+        for _ in range(count):
+            n = self._next_id
+            self._next_id += 1
+            rooms = 1 + n % 3
+            fresh.append(FakeListing(n, f"{rooms}-комнатная квартира, {n}", rooms, 250 + n % 100, f"Минск, ул. Тестовая, {n}", created))
+        self.items[:0] = reversed(fresh)
+        del self.items[FEED_KEEP:]
+        return fresh
+
+    def page(self, page_no: int) -> List[FakeListing]:
+        start = (max(1, page_no) - 1) * PAGE_SIZE
+        return self.items[start:start + PAGE_SIZE]
+
+
+def _page_no(request: Request, key: str = "page") -> int:
+    try:
+        return int((request.query.get(key) or ["1"])[0])
+    except ValueError:
+        return 1
+
+
+def _html(body: str) -> Response:
+    return Response(body=body.encode(), content_type="text/html; charset=utf-8")
+
+
+def _json(data: Any, status: int = 200) -> Response:
+    return Response(status, json.dumps(data, ensure_ascii=False).encode(), "application/json")
+
+
+def _next_data(data: Any) -> str:
+    return f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(data, ensure_ascii=False)}</script>'
+
+
+class FakeSites:
+    """Локальный стенд Kufar (страница + API), Domovita и Realt на одном HttpServer.
+
+    Разметка минимальная, но в тех местах, которые читают скраперы, совпадает с
+    сайтами. Для каждого опубликованного объявления запоминается момент публикации
+    по его URL — так стенд Telegram считает задержку доставки.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.server = HttpServer(host, port)
+        self.feeds = {
+            "kufar": SiteFeed("kufar", 300_000_000, lambda n: f"https://re.kufar.by/vi/{n}"),
+            "domovita": SiteFeed("domovita", 9_000_000, lambda n: f"https://domovita.by{DOMOVITA_PATH}/kvartira-{n}"),
+            "realt": SiteFeed("realt", 4_000_000, lambda n: f"https://realt.by/s/o/2/{n}/"),
+        }
+        self.published: Dict[str, float] = {}
+        self.requests = 0
+        self.server.route("GET", KUFAR_PATH, self._kufar_page)
+        self.server.route("GET", KUFAR_API_PATH, self._kufar_api)
+        self.server.route("GET", DOMOVITA_PATH, self._domovita)
+        self.server.route("GET", REALT_PATH, self._realt)
+
+    def url(self, path: str) -> str:
+        return f"http://{self.server.host}:{self.server.port}{path}"
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    async def close(self) -> None:
+        await self.server.close()
+
+    def seed(self, count: int = SEED_LISTINGS) -> None:
+        # Уже существующая выдача: разнесена по времени назад, уходит в прогрев без рассылки
+        now = datetime.now(MINSK_TZ)
+        for feed in self.feeds.values():
+            for i in reversed(range(count)):
+                feed.publish(1, now - timedelta(minutes=i + 1))
+
+    def publish(self, total: int) -> int:
+        """Публикует total новых объявлений, поровну между сайтами."""
+        now = datetime.now(MINSK_TZ)
+        mono = time.monotonic()
+        share, extra = divmod(total, len(self.feeds))
+        for i, feed in enumerate(self.feeds.values()):
+            for item in feed.publish(share + (1 if i < extra else 0), now):
+                self.published[feed.listing_url(item.id)] = mono
+        return total
+
+    async def _kufar_page(self, request: Request) -> Response:
+        self.requests += 1
+        return _html(f"<html><body>{_next_data({'props': {'initialState': {'router': {'queryForBe': KUFAR_QUERY}}}})}</body></html>")
+
+    async def _kufar_api(self, request: Request) -> Response:
+        self.requests += 1
+        feed = self.feeds["kufar"]
+        page_no = _page_no(request, "cursor")
+        ads = [
+            {
+                "ad_id": item.id,
+                "ad_link": feed.listing_url(item.id),
+                "subject": item.title,
+                "price_usd": str(item.price * 100),
+                "ad_parameters": [{"p": "rooms", "v": str(item.rooms)}],
+                "region_name": item.address,
+                "list_time": item.created.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            }
+            for item in feed.page(page_no)
+        ]
+        pages = [{"label": "next", "num": page_no + 1, "token": str(page_no + 1)}] if ads else []
+        return _json({"ads": ads, "pagination": {"pages": pages}, "total": len(feed.items)})
+
+    async def _domovita(self, request: Request) -> Response:
+        self.requests += 1
+        cards = "".join(
+            f'\n<div class="found_item" data-key="{item.id}">'
+            f'<a class="link-object" href="{DOMOVITA_PATH}/kvartira-{item.id}">{item.title}</a>'
+            f'<div class="price">{item.price} $</div><div class="gr">{item.address}</div>'
+            f'<div class="date">{item.created:%d.%m.%Y}</div></div>'
+            for item in self.feeds["domovita"].page(_page_no(request))
+        )
+        return _html(f'<html><body><div class="listing">{cards}\n</div><div class="pagination"></div></body></html>')
+
+    async def _realt(self, request: Request) -> Response:
+        self.requests += 1
+        objects = [
+            {"code": item.id, "title": item.title, "price": item.price, "priceCurrency": 840, "rooms": item.rooms,
+             "address": item.address, "createdAt": item.created.isoformat()}
+            for item in self.feeds["realt"].page(_page_no(request))
+        ]
+        data = {"props": {"pageProps": {"initialState": {"objectsListing": {"objects": objects}}}}}
+        return _html(f"<html><body><main></main>{_next_data(data)}</body></html>")
+
+
+class FakeTelegram:
+    """Стенд Bot API: getMe, setWebhook и sendMessage с задержкой ответа и флуд-лимитами.
+
+    Лимиты как у Telegram: в среднем не чаще chat_rate сообщений в секунду в один
+    чат (всплеск до CHAT_BURST) и global_rate в секунду на бота, плюс случайные
+    429 с долей flood_rate. При превышении —
+    ответ 429 с parameters.retry_after, который PTB превращает в RetryAfter.
+    """
+
+    def __init__(
+        self,
+        published: Dict[str, float],
+        token: str = FAKE_TOKEN,
+        latency_ms: float = 50.0,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        flood_rate: float = 0.0,
+        flood_retry_after: int = 3,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.server = HttpServer(host, port)
+        self.token = token
+        self.published = published
+        self.latency_sec = latency_ms / 1000.0
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.accepted = 0
+        self.limited = 0
+        self.first_accept: Optional[float] = None
+        self.last_accept: Optional[float] = None
+        # Задержка «опубликовано → получено чатом» на каждую пару (чат, объявление)
+        self.latencies: List[float] = []
+        self._chat_tokens: Dict[int, Tuple[float, float]] = {}
+        self._window_start = 0.0
+        self._window_count = 0
+        self._message_id = 0
+        self._rng = random.Random(0)
+        # Что зарегистрировал бот в режиме вебхука: адрес и секрет
+        self.webhook: Dict[str, str] = {}
+        self.server.route("POST", f"/bot{token}/getMe", self._get_me)
+        self.server.route("POST", f"/bot{token}/setWebhook", self._set_webhook)
+        self.server.route("POST", f"/bot{token}/sendMessage", self._send_message)
+
+    @property
+    def base_url(self) -> str:
+        # PTB дописывает токен и метод сам: {base_url}{token}/{method}
+        return f"http://{self.server.host}:{self.server.port}/bot"
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    async def close(self) -> None:
+        await self.server.close()
+
+    def _latency(self) -> float:
+        # Логнормальная задержка с медианой latency_sec: редкие медленные ответы, как у настоящего API
+        return self._rng.lognormvariate(math.log(self.latency_sec), 0.5) if self.latency_sec > 0 else 0.0
+
+    def _throttle(self, chat_id: int, now: float) -> int:
+        """0 — сообщение принято, иначе retry_after в секундах."""
+        if self.flood_rate and self._rng.random() < self.flood_rate:
+            return self.flood_retry_after
+        tokens = CHAT_BURST
+        if self.chat_rate > 0 and chat_id in self._chat_tokens:
+            left, updated = self._chat_tokens[chat_id]
+            tokens = min(CHAT_BURST, left + (now - updated) * self.chat_rate)
+            if tokens < 1.0:
+                return max(1, math.ceil((1.0 - tokens) / self.chat_rate))
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        if self._window_count >= self.global_rate:
+            return 1
+        self._window_count += 1
+        self._chat_tokens[chat_id] = (tokens - 1.0, now)
+        return 0
+
+    @staticmethod
+    def _params(request: Request) -> Dict[str, str]:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return {k: v for k, v in json.loads(request.body or b"{}").items()}
+        return {k: v[0] for k, v in parse_qs(request.body.decode()).items()}
+
+    async def _get_me(self, request: Request) -> Response:
+        return _json({"ok": True, "result": {"id": 100000, "is_bot": True, "first_name": "Load test", "username": "loadtest_bot"}})
+
+    async def _set_webhook(self, request: Request) -> Response:
+        self.webhook = self._params(request)
+        return _json({"ok": True, "result": True})
+
+    async def _send_message(self, request: Request) -> Response:
+        params = self._params(request)
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text") or "")
+        now = time.monotonic()
+        retry_after = self._throttle(chat_id, now)
+        await asyncio.sleep(self._latency())
+        if retry_after:
+            self.limited += 1
+            return _json(
+                {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                 "parameters": {"retry_after": retry_after}},
+                status=429,
+            )
+        self.accepted += 1
+        if self.first_accept is None:
+            self.first_accept = now
+        self.last_accept = now
+        for url in _URL_RE.findall(text):
+            published = self.published.get(url)
+            if published is not None:
+                self.latencies.append(now - published)
+        self._message_id += 1
+        message = {"message_id": self._message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": text}
+        return _json({"ok": True, "result": message})
+
+
+def _percentile(values: List[float], q: float) -> float:
+    # Ближайший ранг: для хвостов на тысячах значений точнее интерполяции не нужно
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _durations(collector: SpanCollector, name: str, source: Optional[str] = None) -> List[float]:
+    return [
+        r["duration_ms"] / 1000.0
+        for r in collector.records
+        if r["name"] == name and (source is None or (r.get("attrs") or {}).get("source") == source)
+    ]
+
+
+def _stats(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(_percentile(values, 0.50), 3),
+        "p95": round(_percentile(values, 0.95), 3),
+        "p99": round(_percentile(values, 0.99), 3),
+        "max": round(max(values, default=0.0), 3),
+    }
+
+
+async def run_load(
+    subscribers: int,
+    new_per_cycle: int,
+    duration_sec: float,
+    poll_sec: int,
+    drain_sec: float,
+    latency_ms: float,
+    tg_global_rate: float,
+    tg_chat_rate: float,
+    flood_rate: float,
+) -> Dict[str, Any]:
+    """Гоняет poll_loop + BotApp против стендов и возвращает отчёт."""
+    logger = logging.getLogger("loadtest")
+    sites = FakeSites()
+    sites.seed()
+    telegram = FakeTelegram(sites.published, latency_ms=latency_ms, global_rate=tg_global_rate,
+                            chat_rate=tg_chat_rate, flood_rate=flood_rate)
+    await sites.start()
+    await telegram.start()
+    # load_config читается по ходу работы поллером и ботом — стенды подставляются через окружение
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": FAKE_TOKEN,
+        "TELEGRAM_API_URL": telegram.base_url,
+        "KUFAR_URL": sites.url(KUFAR_PATH),
+        "DOMOVITA_URL": sites.url(DOMOVITA_PATH),
+        "REALT_URL": sites.url(REALT_PATH) + "?page=1",
+        "POLL_MIN_SEC": str(poll_sec),
+        "POLL_MAX_SEC": str(poll_sec),
+    })
+    configure_kufar_api(sites.url(KUFAR_API_PATH))
+    # Браузера на стенде нет: фолбэк на рендер выключен
+    for name, source in list(SOURCES.items()):
+        SOURCES[name] = replace(source, parse_rendered=None)
+    collector = SpanCollector(names=("poll.source", "telegram.broadcast"))
+    add_sink(collector)
+    published = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        state = StateStore(path=Path(tmp) / "state.json")
+        with state.batch():
+            for i in range(subscribers):
+                state.add_chat(CHAT_ID_BASE + i)
+        bot = BotApp(state)
+        await bot.app.initialize()
+        poller = asyncio.create_task(poll_loop(state, bot), name="loadtest:poll")
+        try:
+            while not state.has_seen_any():
+                if poller.done():
+                    poller.result()
+                await asyncio.sleep(0.1)
+            logger.info("warmed up, publishing %d listings every %ds for %.0fs", new_per_cycle, poll_sec, duration_sec)
+            started = time.monotonic()
+            while time.monotonic() - started < duration_sec:
+                published += sites.publish(new_per_cycle)
+                await asyncio.sleep(min(poll_sec, max(0.0, duration_sec - (time.monotonic() - started))))
+            expected = published * subscribers
+            deadline = time.monotonic() + drain_sec
+            while len(telegram.latencies) < expected and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+            elapsed = time.monotonic() - started
+        finally:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+            await bot.app.shutdown()
+            remove_sink(collector)
+            await close_http_pool()
+            await telegram.close()
+            await sites.close()
+
+    window = (telegram.last_accept or 0.0) - (telegram.first_accept or 0.0)
+    return {
+        "subscribers": subscribers,
+        "published": published,
+        "elapsed_sec": round(elapsed, 1),
+        "site_requests": sites.requests,
+        "poll_sec": {name: _stats(_durations(collector, "poll.source", name)) for name in SOURCES},
+        "broadcast_sec": _stats(_durations(collector, "telegram.broadcast")),
+        "telegram": {
+            "accepted": telegram.accepted,
+            "rate_limited": telegram.limited,
+            "messages_per_sec": round(telegram.accepted / window, 1) if window > 0 else 0.0,
+        },
+        "delivery": {
+            "delivered": len(telegram.latencies),
+            "expected": expected,
+            "latency_sec": _stats(telegram.latencies),
+        },
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    def row(label: str, s: Dict[str, float]) -> str:
+        return f"  {label:<12} n={s['count']:<6} p50={s['p50']:.3f}s p95={s['p95']:.3f}s p99={s['p99']:.3f}s max={s['max']:.3f}s"
+
+    tg = report["telegram"]
+    delivery = report["delivery"]
+    print(f"subscribers={report['subscribers']} published={report['published']} elapsed={report['elapsed_sec']}s "
+          f"site_requests={report['site_requests']}")
+    print("poll (fetch + parse + state):")
+    for name, s in report["poll_sec"].items():
+        print(row(name, s))
+    print("broadcast:")
+    print(row("all", report["broadcast_sec"]))
+    print(f"telegram: accepted={tg['accepted']} 429={tg['rate_limited']} throughput={tg['messages_per_sec']} msg/s")
+    print(f"delivery: {delivery['delivered']}/{delivery['expected']} listing×chat")
+    print(row("latency", delivery["latency_sec"]))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.loadtest",
+        description="Нагрузочный прогон poll_loop + BotApp против локальных стендов сайтов и Telegram (без сети)",
+    )
+    parser.add_argument("--subscribers", type=int, default=5000, help="число чатов-подписчиков")
+    parser.add_argument("--new-per-cycle", type=int, default=200, help="новых объявлений за цикл на все сайты")
+    parser.add_argument("--duration", type=float, default=120.0, help="сколько секунд публиковать объявления")
+    parser.add_argument("--poll-sec", type=int, default=15, help="интервал опроса и публикации, секунды")
+    parser.add_argument("--drain", type=float, default=60.0, help="сколько ждать досылки после публикации, секунды")
+    parser.add_argument("--tg-latency-ms", type=float, default=50.0, help="медианная задержка ответа Bot API")
+    parser.add_argument("--tg-global-rate", type=float, default=30.0, help="лимит стенда: сообщений в секунду на бота")
+    parser.add_argument("--tg-chat-rate", type=float, default=1.0, help="лимит стенда: сообщений в секунду в чат")
+    parser.add_argument("--flood-rate", type=float, default=0.01, help="доля случайных ответов 429")
+    parser.add_argument("--json", action="store_true", help="отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s - %(message)s")
+    logging.getLogger("loadtest").setLevel(logging.INFO)
+    report = asyncio.run(run_load(
+        subscribers=args.subscribers,
+        new_per_cycle=args.new_per_cycle,
+        duration_sec=args.duration,
+        poll_sec=args.poll_sec,
+        drain_sec=args.drain,
+        latency_ms=args.tg_latency_ms,
+        tg_global_rate=args.tg_global_rate,
+        tg_chat_rate=args.tg_chat_rate,
+        flood_rate=args.flood_rate,
+    ))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,111 @@
+from typing import Any, List, Optional
+import argparse
 import asyncio
 import logging
+import secrets
+import signal
 
-from .state import StateStore
+from .config import AppConfig, load_config
+from .state import StateStore, open_state_store
 from .bot import BotApp
-from .poller import poll_once
+from .scheduler import PollScheduler
+from .sources import SOURCES
+from .browser import configure_browser_pool, close_browser_pool
+from .listing_cache import configure_listing_cache
+from .dedup import configure_dedup
+from .health import configure_health
+from .jobqueue import JobQueue, QueueBot, consume_jobs
+from .scrapers.http import close_http_pool
+from .scrapers.kufar import configure_kufar_api
+from .httpserver import HttpServer
+from .metrics import metrics_endpoint
+from .tracing import add_sink, log_sink
 
 
 POLL_INTERVAL_SEC = 60
 
 
-async def poll_loop(state: StateStore, bot: BotApp) -> None:
-    while True:
-        await poll_once(state, bot)
-        await asyncio.sleep(POLL_INTERVAL_SEC)
+async def poll_loop(state: StateStore, bot: Any, queue: Optional[JobQueue] = None) -> None:
+    # Каждый источник опрашивается своей задачей с адаптивным интервалом
+    cfg = load_config()
+    scheduler = PollScheduler(
+        state,
+        bot,
+        SOURCES,
+        base_sec=POLL_INTERVAL_SEC,
+        min_sec=cfg.poll_min_sec,
+        max_sec=cfg.poll_max_sec,
+        queue=queue,
+    )
+    await scheduler.run()
+
+
+async def run_worker(state: StateStore, cfg: AppConfig) -> None:
+    """Процесс-воркер: опрашивает арендованные источники и кладёт новые объявления в очередь."""
+    queue = JobQueue(lease_sec=cfg.queue_lease_sec, max_sources=cfg.worker_max_sources)
+    metrics_server = None
+    if cfg.metrics_port:
+        metrics_server = await start_metrics_server(cfg.metrics_host, cfg.metrics_port)
+    try:
+        await poll_loop(state, QueueBot(queue), queue=queue)
+    finally:
+        if metrics_server is not None:
+            await metrics_server.close()
+        await close_http_pool()
+        await close_browser_pool()
+        queue.close()
+
 
+async def start_metrics_server(host: str, port: int) -> HttpServer:
+    server = HttpServer(host, port)
+    server.route("GET", "/metrics", metrics_endpoint)
+    await server.start()
+    return server
 
-def main() -> None:
+
+async def run_webhook(state: StateStore, bot: BotApp, cfg: AppConfig, queue: Optional[JobQueue] = None) -> None:
+    """Бот на вебхуке: обновления принимает встроенный сервер, опрос идёт в том же event loop."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    server = HttpServer(cfg.webhook_host, cfg.webhook_port)
+    metrics_server = None
+    if cfg.metrics_port:
+        if (cfg.metrics_host, cfg.metrics_port) == (cfg.webhook_host, cfg.webhook_port):
+            # Один адрес — один сервер с обоими маршрутами
+            server.route("GET", "/metrics", metrics_endpoint)
+        else:
+            metrics_server = await start_metrics_server(cfg.metrics_host, cfg.metrics_port)
+    await bot.start_webhook(server, cfg.webhook_url, cfg.webhook_secret or secrets.token_urlsafe(32))
+    background = asyncio.create_task(poll_loop(state, bot) if queue is None else consume_jobs(queue, bot))
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({background, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if background.done():
+            # Опрос не должен завершаться сам: падение не прячем за живым вебхуком
+            background.result()
+    finally:
+        for task in (background, stopped):
+            task.cancel()
+        await asyncio.gather(background, stopped, return_exceptions=True)
+        await server.close()
+        await bot.stop_webhook()
+        if metrics_server is not None:
+            await metrics_server.close()
+        await close_http_pool()
+        await close_browser_pool()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.main")
+    parser.add_argument(
+        "--mode",
+        choices=("all", "worker", "bot"),
+        default="all",
+        help="all — опрос и бот в одном процессе; worker — только опрос сайтов; bot — только Telegram",
+    )
+    args = parser.parse_args(argv)
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s %(levelname)s %(name)s - %(message)s",
@@ -24,12 +114,41 @@ def main() -> None:
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("telegram").setLevel(logging.WARNING)
     logging.getLogger("apscheduler").setLevel(logging.WARNING)
-    state = StateStore()
-    bot = BotApp(state)
+    cfg = load_config()
+    if cfg.trace_spans:
+        add_sink(log_sink)
+    configure_browser_pool(cfg.browser_max_concurrency, cfg.browser_max_pages, cfg.browser_max_rss_mb)
+    configure_listing_cache(cfg.listing_cache_ttl_sec)
+    configure_kufar_api(cfg.kufar_api_url)
+    configure_dedup(cfg.dedup_window_hours * 3600, cfg.dedup_max_entries)
+    configure_health(cfg.breaker_open_after, cfg.breaker_probe_sec, cfg.breaker_probe_max_sec)
+    if args.mode != "all" and cfg.state_backend != "sqlite":
+        # JSON-файл каждый процесс перезаписывал бы своей копией состояния
+        raise RuntimeError("--mode worker/bot требует STATE_BACKEND=sqlite: состояние общее для процессов")
+    state = open_state_store(cfg)
+    if args.mode == "worker":
+        asyncio.run(run_worker(state, cfg))
+        return
+    queue = JobQueue(lease_sec=cfg.queue_lease_sec) if args.mode == "bot" else None
+    bot = BotApp(state, queue=queue)
+    if cfg.webhook_url:
+        asyncio.run(run_webhook(state, bot, cfg, queue))
+        return
 
     loop = asyncio.get_event_loop()
-    loop.create_task(poll_loop(state, bot))
+    metrics_server = None
+    if cfg.metrics_port:
+        metrics_server = loop.run_until_complete(start_metrics_server(cfg.metrics_host, cfg.metrics_port))
+    if queue is None:
+        loop.create_task(poll_loop(state, bot))
+    else:
+        loop.create_task(consume_jobs(queue, bot))
     bot.run_polling()
+    if metrics_server is not None:
+        loop.run_until_complete(metrics_server.close())
+    # Закрываем keep-alive соединения скраперов и пул браузера
+    loop.run_until_complete(close_http_pool())
+    loop.run_until_complete(close_browser_pool())
 
 
 if __name__ == "__main__":
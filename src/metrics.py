@@ -0,0 +1,234 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+import asyncio
+import bisect
+import math
+import threading
+import time
+
+from .httpserver import Request, Response
+from .tracing import span
+
+
+T = TypeVar("T")
+
+# Источник, для которого сейчас идёт работа: задаётся поллером и наследуется
+# задачами и asyncio.to_thread, поэтому HTTP-пул и парсеры не знают о нём явно
+current_source: ContextVar[str] = ContextVar("current_source", default="other")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        # Наблюдения приходят и из потоков (запись состояния), поэтому под замком
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.label_names):
+            raise ValueError(f"{self.name}: expected labels {self.label_names}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self, lock: threading.Lock) -> None:
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def render(self, metric: _Metric, key: Tuple[str, ...]) -> List[str]:
+        return [f"{metric.name}{_format_labels(metric.label_names, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild(self._lock)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, lock: threading.Lock, buckets: Tuple[float, ...]) -> None:
+        self._lock = lock
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, metric: _Metric, key: Tuple[str, ...]) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(metric.label_names, key, ("le", _format_value(bound)))
+            lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(metric.label_names, key)
+        lines.append(f"{metric.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{metric.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам (le), плюс сумма и количество."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labels)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> Any:
+        return self.labels().time()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SIZE_BUCKETS = (1024, 8192, 32768, 131072, 524288, 2097152, 8388608)
+
+# Поллер и скраперы
+POLL_SECONDS = Histogram("flatbot_poll_seconds", "Full poll of one source, including fallback", ["source"])
+POLL_ERRORS = Counter("flatbot_poll_errors_total", "Polls that failed, timed out or returned nothing", ["source"])
+POLL_NOT_MODIFIED = Counter("flatbot_poll_not_modified_total", "Polls short-circuited on an unchanged first page", ["source"])
+FETCH_SECONDS = Histogram("flatbot_fetch_seconds", "Fetching and parsing listing pages of a source", ["source"])
+HTTP_REQUEST_SECONDS = Histogram("flatbot_http_request_seconds", "Single HTTP request latency", ["source"])
+HTTP_REQUESTS = Counter("flatbot_http_requests_total", "HTTP requests by response status", ["source", "status"])
+HTTP_BYTES = Counter("flatbot_http_downloaded_bytes_total", "Bytes downloaded (as received on the wire)", ["source"])
+HTTP_RESPONSE_BYTES = Histogram("flatbot_http_response_bytes", "Response size", ["source"], buckets=SIZE_BUCKETS)
+PARSE_SECONDS = Histogram("flatbot_parse_seconds", "Parsing pages into listings", ["source"])
+FALLBACK_TOTAL = Counter("flatbot_render_fallback_total", "Playwright fallback invocations", ["source"])
+FALLBACK_SECONDS = Histogram("flatbot_render_fallback_seconds", "Playwright fallback duration", ["source"])
+FALLBACK_CAPTURED = Counter("flatbot_render_fallback_captured_total", "Fallbacks answered by a captured API response", ["source"])
+FALLBACK_SKIPPED = Counter("flatbot_render_fallback_skipped_total", "Fallbacks skipped while the source is open", ["source"])
+SOURCE_STATE_CHANGES = Counter("flatbot_source_state_changes_total", "Source health transitions by new state", ["source", "state"])
+ITEMS_FETCHED = Counter("flatbot_items_fetched_total", "Listings fetched", ["source"])
+ITEMS_NEW = Counter("flatbot_items_new_total", "Listings not seen before", ["source"])
+
+# Состояние
+STATE_SAVE_SECONDS = Histogram("flatbot_state_save_seconds", "Persisting state (serialize + write or commit)", ["backend"])
+
+# Telegram
+SEND_SECONDS = Histogram("flatbot_telegram_send_seconds", "send_message call latency")
+SEND_FAILURES = Counter("flatbot_telegram_send_failures_total", "Messages that were not delivered", ["reason"])
+SEND_RETRIES = Counter("flatbot_telegram_send_retries_total", "send_message retries", ["reason"])
+COMMAND_SECONDS = Histogram("flatbot_command_seconds", "Bot command and callback handler latency", ["command"])
+WEBHOOK_UPDATES = Counter("flatbot_webhook_updates_total", "Webhook requests by outcome", ["status"])
+
+
+async def parse_in_thread(func: Callable[..., T], *args: Any) -> T:
+    """asyncio.to_thread для разбора страницы с учётом времени в PARSE_SECONDS."""
+    start = time.perf_counter()
+    try:
+        with span("parse", fn=getattr(func, "__name__", "?")):
+            return await asyncio.to_thread(func, *args)
+    finally:
+        PARSE_SECONDS.labels(current_source.get()).observe(time.perf_counter() - start)
+
+
+def timed_command(name: str, callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Обёртка обработчика команды бота, пишущая его латентность в COMMAND_SECONDS."""
+    child = COMMAND_SECONDS.labels(name)
+
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+
+    wrapper.__name__ = getattr(callback, "__name__", name)
+    wrapper.__doc__ = callback.__doc__
+    return wrapper
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(body=REGISTRY.render().encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
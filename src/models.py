@@ -1,15 +1,84 @@
-from dataclasses import dataclass
-from typing import Optional
-from datetime import datetime
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timedelta, timezone
 
 
-@dataclass(frozen=True)
+# Числовые коды валют ISO 4217
+USD = 840
+EUR = 978
+BYN = 933
+
+CURRENCY_SIGNS = {USD: "$", EUR: "€", BYN: "BYN"}
+
+# Даты без зоны на сайтах — минское время (UTC+3, без перехода на летнее)
+MINSK_TZ = timezone(timedelta(hours=3))
+
+
+@dataclass(frozen=True, slots=True)
 class Listing:
+    """Объявление в типизированном виде.
+
+    Цена — целое в минимальных единицах (центы, копейки) и числовой код валюты,
+    площадь — м², координаты — градусы WGS84, даты — с часовым поясом.
+    Строки для показа (price) собираются по запросу.
+    """
+
     source: str
     id: str
     url: str
     title: Optional[str] = None
-    price: Optional[str] = None
+    price_amount: Optional[int] = None
+    currency: Optional[int] = None
     location: Optional[str] = None
     created_at: Optional[datetime] = None
+    rooms: Optional[int] = None
+    area: Optional[float] = None
+    floor: Optional[int] = None
+    floors: Optional[int] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    images: Tuple[str, ...] = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        data["created_at"] = self.created_at.isoformat() if self.created_at else None
+        data["images"] = list(self.images)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Listing":
+        known = {f.name for f in fields(cls)}
+        values = {k: v for k, v in data.items() if k in known}
+        if values.get("created_at"):
+            values["created_at"] = datetime.fromisoformat(values["created_at"])
+        values["images"] = tuple(values.get("images") or ())
+        return cls(**values)
+
+    @property
+    def price_value(self) -> Optional[float]:
+        """Цена в основных единицах валюты."""
+        return self.price_amount / 100 if self.price_amount is not None else None
+
+    @property
+    def price_usd(self) -> Optional[float]:
+        return self.price_value if self.currency == USD else None
+
+    @property
+    def price(self) -> Optional[str]:
+        if self.price_amount is None:
+            return None
+        major, minor = divmod(self.price_amount, 100)
+        number = f"{major:,}".replace(",", " ") + (f".{minor:02d}" if minor else "")
+        return f"{number} {CURRENCY_SIGNS.get(self.currency, '')}".strip()
 
+    @property
+    def details(self) -> Optional[str]:
+        """«2 комн. · 54 м² · этаж 3/9» из того, что известно."""
+        parts = []
+        if self.rooms is not None:
+            parts.append(f"{self.rooms} комн.")
+        if self.area is not None:
+            parts.append(f"{self.area:g} м²")
+        if self.floor is not None:
+            parts.append(f"этаж {self.floor}/{self.floors}" if self.floors else f"этаж {self.floor}")
+        return " · ".join(parts) or None
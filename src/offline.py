@@ -0,0 +1,68 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from .bot import format_listing_message
+from .models import Listing
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent.parent / "fixtures"
+
+# Записанная страница для каждого хоста: офлайн-прогоны отвечают ей на любой путь и любую страницу
+FIXTURE_ROUTES: Dict[str, str] = {
+    "re.kufar.by": "kufar/search.html",
+    "api.kufar.by": "kufar/api.json",
+    "domovita.by": "domovita/search.html",
+    "realt.by": "realt/search.html",
+}
+
+
+def fixture_transport(fixtures_dir: Path = FIXTURES_DIR, routes: Optional[Dict[str, str]] = None) -> httpx.MockTransport:
+    """httpx-транспорт, отдающий страницы из фикстур вместо сети."""
+    routes = routes or FIXTURE_ROUTES
+    cache: Dict[str, bytes] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        name = routes.get(urlsplit(str(request.url)).netloc)
+        if name is None:
+            return httpx.Response(404, request=request)
+        body = cache.get(name)
+        if body is None:
+            body = cache[name] = (fixtures_dir / name).read_bytes()
+        content_type = "application/json" if name.endswith(".json") else "text/html; charset=utf-8"
+        return httpx.Response(200, content=body, headers={"Content-Type": content_type}, request=request)
+
+    return httpx.MockTransport(handler)
+
+
+class NullBot:
+    """Бот без Telegram: рендерит сообщения как BotApp и только считает их."""
+
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+        self.no_updates = 0
+
+    async def broadcast(self, items: Iterable[Listing]) -> None:
+        self.sent.extend(format_listing_message(i) for i in items)
+
+    async def notify_no_updates(self, count: int) -> None:
+        self.no_updates += 1
+
+
+class InlineExecutor(ThreadPoolExecutor):
+    """Исполнитель для asyncio.to_thread, выполняющий работу прямо в потоке event loop.
+
+    cProfile видит только свой поток: на время профилирования разбор и запись
+    состояния переносятся туда, ценой последовательного выполнения.
+    """
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> "Future[Any]":
+        future: "Future[Any]" = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
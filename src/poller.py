@@ -1,152 +1,306 @@
+from dataclasses import replace
 from datetime import datetime
-from typing import List
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import cProfile
 import logging
+import os
+import pstats
+import tempfile
 import time
 
-from .config import load_config
+from .config import AppConfig, load_config
 from .state import StateStore
 from .bot import BotApp
-from .scrapers.kufar import fetch_kufar, parse_kufar_html
-from .scrapers.domovita import fetch_domovita, parse_domovita_html
-from .scrapers.realt import fetch_realt, parse_realt_html
-from .browser import fetch_rendered_html
+from .models import Listing
+from .listing_cache import get_listing_cache
+from .metrics import (
+    FALLBACK_SKIPPED,
+    FETCH_SECONDS,
+    ITEMS_FETCHED,
+    ITEMS_NEW,
+    POLL_ERRORS,
+    POLL_NOT_MODIFIED,
+    POLL_SECONDS,
+    current_source,
+)
+from .health import OPEN, get_health
+from .tracing import SpanCollector, add_sink, log_sink, span
+from .offline import FIXTURES_DIR, InlineExecutor, NullBot, fixture_transport
+from .scrapers.http import close_http_pool, configure_http_pool
+from .sources import SOURCES, Source, get_source
+from .scrapers.revalidate import NotModified
 
 
-async def poll_once(state: StateStore, bot: BotApp) -> None:
-    logger = logging.getLogger("poller")
-    t0 = time.perf_counter()
-    # Загружаем конфиг с учетом цены из state (если установлена)
-    cfg = load_config(override_max_price=state.get_max_price())
-    logger.info("cycle start")
+PollResult = Tuple[List[Listing], List[Listing], bool]
 
-    # Первый запуск: прогреваем кэш и выходим без рассылки
-    if not state.seen_ids_by_source:
-        for src, url, fetch in (
-            ("kufar", cfg.kufar_url, fetch_kufar),
-            ("domovita", cfg.domovita_url, fetch_domovita),
-            ("realt", cfg.realt_url, fetch_realt),
-        ):
-            try:
-                items = fetch(url)
-                state.mark_seen(src, {i.id for i in items})
-                logger.info("warmup %s: fetched=%d", src, len(items))
-            except Exception as e:
-                logger.warning("warmup %s failed: %s", src, e)
-        logger.info("warmup done")
-        return
-
-    new_items: List = []
-    kufar_fetched = 0
-    kufar_new = 0
 
-    try:
-        kufar_items = fetch_kufar(cfg.kufar_url)
-        kufar_fetched = len(kufar_items)
-        fresh = [i for i in kufar_items if state.is_new("kufar", i.id, i.created_at)]
-        kufar_new = len(fresh)
-        if not kufar_fetched:
-            try:
-                html = await fetch_rendered_html(cfg.kufar_url, wait_selector="a[href*='/item/']")
-                kufar_items = parse_kufar_html(html)
-                kufar_fetched = len(kufar_items)
-                fresh = [i for i in kufar_items if state.is_new("kufar", i.id, i.created_at)]
-                kufar_new = len(fresh)
-            except Exception as e2:
-                logger.warning("kufar playwright fallback failed: %s", e2)
-        # Обновляем последнюю дату для ВСЕХ полученных объявлений
-        for i in kufar_items:
-            state.update_last_date("kufar", i.created_at)
-        
-        if fresh:
-            state.mark_seen("kufar", {i.id for i in fresh})
-            new_items.extend(fresh)
-        logger.info("kufar: fetched=%d new=%d", kufar_fetched, kufar_new)
-        if fresh:
-            logger.info("kufar new urls: %s", ", ".join(i.url for i in fresh[:3]))
-        # Логируем дату последнего поста
-        if state.last_date_by_source.get("kufar"):
-            logger.info("kufar last post date: %s", state.last_date_by_source["kufar"].strftime("%Y-%m-%d %H:%M:%S"))
-    except Exception as e:
-        logger.warning("kufar fetch failed: %s", e)
+async def _poll_source(
+    state: StateStore, source: Source, url: str, max_pages: int = 1, timeout_sec: Optional[float] = None
+) -> PollResult:
+    """Один источник: fetch → is_new → fallback на рендер → даты → mark_seen.
 
-    domovita_fetched = 0
-    domovita_new = 0
+    timeout_sec — бюджет опроса: фолбэку достаётся то, что от него осталось.
+    Возвращает (полученные объявления, новые объявления, успешен ли опрос).
+    """
+    deadline = time.monotonic() + (timeout_sec or source.timeout_sec)
+    logger = logging.getLogger("poller")
+    name = source.name
+    health = get_health().get(name)
+    items: List[Listing] = []
+    fresh: List[Listing] = []
     try:
-        domovita_items = fetch_domovita(cfg.domovita_url)
-        domovita_fetched = len(domovita_items)
-        fresh = [i for i in domovita_items if state.is_new("domovita", i.id, i.created_at)]
-        domovita_new = len(fresh)
-        if not domovita_fetched:
-            try:
-                html = await fetch_rendered_html(cfg.domovita_url, wait_selector="a[href*='/rent/']")
-                domovita_items = parse_domovita_html(html)
-                domovita_fetched = len(domovita_items)
-                fresh = [i for i in domovita_items if state.is_new("domovita", i.id, i.created_at)]
-                domovita_new = len(fresh)
-            except Exception as e2:
-                logger.warning("domovita playwright fallback failed: %s", e2)
-        # Обновляем последнюю дату для ВСЕХ полученных объявлений
-        for i in domovita_items:
-            state.update_last_date("domovita", i.created_at)
-        
-        if fresh:
-            state.mark_seen("domovita", {i.id for i in fresh})
-            new_items.extend(fresh)
-        logger.info("domovita: fetched=%d new=%d", domovita_fetched, domovita_new)
-        if fresh:
-            logger.info("domovita new urls: %s", ", ".join(i.url for i in fresh[:3]))
-        # Логируем дату последнего поста
-        if state.last_date_by_source.get("domovita"):
-            logger.info("domovita last post date: %s", state.last_date_by_source["domovita"].strftime("%Y-%m-%d %H:%M:%S"))
-    except Exception as e:
-        logger.warning("domovita fetch failed: %s", e)
+        # Следующие страницы читаются, только пока выдача не упрётся в уже известное
+        try:
+            with FETCH_SECONDS.labels(name).time(), span("fetch", source=name):
+                items = await source.fetch_listings(
+                    url,
+                    is_known=lambda i: not state.is_new(name, i.id, i.created_at),
+                    max_pages=max_pages,
+                    conditional=True,
+                )
+        except NotModified as e:
+            # Выдача та же, что при прошлом опросе: всё из неё уже обработано,
+            # разбор, is_new и запись состояния не нужны
+            POLL_NOT_MODIFIED.labels(name).inc()
+            logger.info("%s: not modified, fetched=%d new=0", name, len(e.items))
+            get_listing_cache().publish(name, url, e.items)
+            return e.items, [], True
+        fresh = [i for i in items if state.is_new(name, i.id, i.created_at)]
+        if not items:
+            health.last_error = "empty listing page"
+            # Пока источник сломан, браузер запускается только пробой раз в backoff
+            if health.allow_fallback():
+                try:
+                    items = await source.render_fallback(url, deadline - time.monotonic())
+                    fresh = [i for i in items if state.is_new(name, i.id, i.created_at)]
+                except Exception as e2:
+                    health.last_error = f"fallback: {e2}"
+                    logger.warning("%s playwright fallback failed: %s", name, e2)
+            else:
+                FALLBACK_SKIPPED.labels(name).inc()
+        if items:
+            # Команды бота читают выдачу из кэша без похода на сайт
+            get_listing_cache().publish(name, url, items)
+        # Изменения без await между ними: параллельные источники не вклиниваются, а отмена
+        # по таймауту не оставляет состояние обновлённым наполовину.
+        # Запись откладывается до flush вызывающего
+        with state.batch(flush=False), span("state.update", source=name):
+            # Обновляем последнюю дату для ВСЕХ полученных объявлений
+            for i in items:
+                state.update_last_date(name, i.created_at)
 
-    realt_fetched = 0
-    realt_new = 0
-    try:
-        realt_items = fetch_realt(cfg.realt_url)
-        realt_fetched = len(realt_items)
-        fresh = [i for i in realt_items if state.is_new("realt", i.id, i.created_at)]
-        realt_new = len(fresh)
-        if not realt_fetched:
-            try:
-                html = await fetch_rendered_html(cfg.realt_url, wait_selector="a[href*='/rent/flat-for-long/']")
-                realt_items = parse_realt_html(html)
-                realt_fetched = len(realt_items)
-                fresh = [i for i in realt_items if state.is_new("realt", i.id, i.created_at)]
-                realt_new = len(fresh)
-            except Exception as e2:
-                logger.warning("realt playwright fallback failed: %s", e2)
-        # Обновляем последнюю дату для ВСЕХ полученных объявлений
-        for i in realt_items:
-            state.update_last_date("realt", i.created_at)
-        
-        if fresh:
-            state.mark_seen("realt", {i.id for i in fresh})
-            new_items.extend(fresh)
-        logger.info("realt: fetched=%d new=%d", realt_fetched, realt_new)
+            if fresh:
+                state.mark_seen(name, {i.id for i in fresh})
+        ITEMS_FETCHED.labels(name).inc(len(items))
+        ITEMS_NEW.labels(name).inc(len(fresh))
+        logger.info("%s: fetched=%d new=%d", name, len(items), len(fresh))
         if fresh:
-            logger.info("realt new urls: %s", ", ".join(i.url for i in fresh[:3]))
+            logger.info("%s new urls: %s", name, ", ".join(i.url for i in fresh[:3]))
         # Логируем дату последнего поста
-        if state.last_date_by_source.get("realt"):
-            logger.info("realt last post date: %s", state.last_date_by_source["realt"].strftime("%Y-%m-%d %H:%M:%S"))
+        if state.last_date_by_source.get(name):
+            logger.info("%s last post date: %s", name, state.last_date_by_source[name].strftime("%Y-%m-%d %H:%M:%S"))
     except Exception as e:
-        logger.warning("realt fetch failed: %s", e)
+        health.last_error = str(e) or type(e).__name__
+        # Сломанный источник не повторяет одно и то же предупреждение каждый цикл
+        logger.log(logging.DEBUG if health.state == OPEN else logging.WARNING, "%s fetch failed: %s", name, e)
+        return items, [], False
+    return items, fresh, bool(items)
+
 
-    if new_items:
-        state.reset_empty_cycles()
-        await bot.broadcast(new_items)
-        logger.info("broadcasting %d new items", len(new_items))
+async def _poll_source_in_budget(state: StateStore, cfg: AppConfig, source: Source) -> PollResult:
+    # Зависший сайт отменяется по истечении своего бюджета и не держит остальные
+    timeout = source.budget(cfg)
+    health = get_health().get(source.name)
+    token = current_source.set(source.name)
+    start = time.perf_counter()
+    with span("poll.source", source=source.name) as sp:
+        try:
+            items, fresh, ok = await asyncio.wait_for(
+                _poll_source(state, source, source.url(cfg), cfg.crawl_max_pages, timeout), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logging.getLogger("poller").log(
+                logging.DEBUG if health.state == OPEN else logging.WARNING,
+                "%s: poll exceeded %.0fs, cancelled", source.name, timeout,
+            )
+            items, fresh, ok = [], [], False
+            health.last_error = f"timeout {timeout:.0f}s"
+        finally:
+            current_source.reset(token)
+        sp.set(fetched=len(items), new=len(fresh), ok=ok)
+    POLL_SECONDS.labels(source.name).observe(time.perf_counter() - start)
+    if ok:
+        health.record_success()
     else:
-        empty = state.increment_empty_cycle()
+        POLL_ERRORS.labels(source.name).inc()
+        health.record_failure()
+    return items, fresh, ok
+
+
+async def poll_source(state: StateStore, bot: BotApp, name: str) -> PollResult:
+    """Отдельный опрос одного источника с немедленной рассылкой его новых объявлений."""
+    cfg = load_config(override_max_price=state.get_max_price())
+    items, fresh, ok = await _poll_source_in_budget(state, cfg, get_source(name))
+    with span("state.flush", source=name):
+        await state.flush_async()
+    if fresh:
+        await bot.broadcast(fresh)
+        logging.getLogger("poller").info("%s: broadcasting %d new items", name, len(fresh))
+    return items, fresh, ok
+
+
+async def _warmup(state: StateStore, cfg: AppConfig) -> None:
+    logger = logging.getLogger("poller")
+    sources = list(SOURCES.values())
+    results = await asyncio.gather(
+        *(asyncio.wait_for(s.fetch_listings(s.url(cfg)), timeout=s.budget(cfg)) for s in sources),
+        return_exceptions=True,
+    )
+    for source, items in zip(sources, results):
+        if isinstance(items, BaseException):
+            logger.warning("warmup %s failed: %r", source.name, items)
+            continue
+        if items:
+            get_listing_cache().publish(source.name, source.url(cfg), items)
+        state.mark_seen(source.name, {i.id for i in items})
+        logger.info("warmup %s: fetched=%d", source.name, len(items))
+    logger.info("warmup done")
+
+
+async def poll_once(state: StateStore, bot: BotApp) -> None:
+    with span("poll.cycle"):
+        await _poll_cycle(state, bot)
+
+
+async def _poll_cycle(state: StateStore, bot: BotApp) -> None:
+    logger = logging.getLogger("poller")
+    t0 = time.perf_counter()
+    # Загружаем конфиг с учетом цены из state (если установлена)
+    cfg = load_config(override_max_price=state.get_max_price())
+    logger.info("cycle start")
+
+    async with state.batch():
+        expired = state.expire_seen()
+        if expired:
+            logger.info("expired %d seen ids", expired)
+
+        # Первый запуск: прогреваем кэш и выходим без рассылки
+        if not state.has_seen_any():
+            await _warmup(state, cfg)
+            return
+
+    # Каждый источник — своя задача со своим бюджетом; новые объявления рассылаются,
+    # как только источник готов, не дожидаясь самого медленного
+    tasks: Dict["asyncio.Task[PollResult]", str] = {
+        asyncio.create_task(_poll_source_in_budget(state, cfg, source), name=f"poll:{name}"): name
+        for name, source in SOURCES.items()
+    }
+    stats: Dict[str, Tuple[int, int]] = {}
+    total_new = 0
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        with span("state.flush"):
+            await state.flush_async()
+        for task in done:
+            name = tasks[task]
+            items, fresh, _ = task.result()
+            stats[name] = (len(items), len(fresh))
+            if fresh:
+                total_new += len(fresh)
+                await bot.broadcast(fresh)
+                logger.info("%s: broadcasting %d new items", name, len(fresh))
+
+    async with state.batch():
+        empty = 0
+        if total_new:
+            state.reset_empty_cycles()
+        else:
+            empty = state.increment_empty_cycle()
+    if not total_new:
         if empty % 30 == 0:
             await bot.notify_no_updates(empty)
         logger.info("no updates this cycle, empty_cycles=%d", empty)
 
     duration = time.perf_counter() - t0
-    total_new = len(new_items)
+    per_source = " | ".join(f"{n} fetched={stats[n][0]} new={stats[n][1]}" for n in SOURCES if n in stats)
     logger.info(
-        "cycle: %.2fs | kufar fetched=%d new=%d | domovita fetched=%d new=%d | realt fetched=%d new=%d | total_new=%d | empty_cycles=%d",
-        duration, kufar_fetched, kufar_new, domovita_fetched, domovita_new, realt_fetched, realt_new, total_new, state.empty_cycles,
+        "cycle: %.2fs | %s | total_new=%d | empty_cycles=%d",
+        duration, per_source, total_new, state.empty_cycles,
+    )
+
+
+async def _run_offline_cycle(
+    fixtures_dir: Path, warm: bool, collector: SpanCollector, profiler: Optional[cProfile.Profile]
+) -> NullBot:
+    """Один цикл опроса на страницах из fixtures/: без сети, браузера и Telegram."""
+    asyncio.get_running_loop().set_default_executor(InlineExecutor())
+    configure_http_pool(transport=fixture_transport(fixtures_dir))
+    # Фолбэк на браузер офлайн не нужен: пустая выдача — это проблема самих фикстур
+    for name, source in list(SOURCES.items()):
+        SOURCES[name] = replace(source, parse_rendered=None)
+    bot = NullBot()
+    with tempfile.TemporaryDirectory() as tmp:
+        state = StateStore(path=Path(tmp) / "state.json")
+        if warm:
+            # Прогрев + цикл, запоминающий страницы: профилируется холостой цикл без новых объявлений
+            await poll_once(state, bot)
+            await poll_once(state, bot)
+        else:
+            # Непустое состояние — цикл не уходит в прогрев, все объявления из фикстур новые
+            state.mark_seen("offline", {"0"})
+        collector.records.clear()
+        bot.sent.clear()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await poll_once(state, bot)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    await close_http_pool()
+    return bot
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m src.poller",
+        description="Один цикл опроса на страницах из fixtures/ — для трассировки и профилирования",
     )
+    parser.add_argument("--once", action="store_true", help="выполнить один цикл и выйти")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR, help="каталог со страницами выдачи")
+    parser.add_argument("--warm", action="store_true", help="профилировать холостой цикл (всё уже видено)")
+    parser.add_argument("--profile", nargs="?", const="poll.prof", metavar="FILE",
+                        help="cProfile в FILE (по умолчанию poll.prof) и свёрнутые стеки span'ов в FILE.folded")
+    parser.add_argument("--trace", action="store_true", help="печатать span'ы JSON-строками")
+    args = parser.parse_args(argv)
+    if not args.once:
+        parser.error("поддерживается только режим --once")
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s - %(message)s")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:offline")
+    collector = SpanCollector()
+    add_sink(collector)
+    if args.trace:
+        logging.getLogger("trace").setLevel(logging.INFO)
+        add_sink(log_sink)
+    profiler = cProfile.Profile() if args.profile else None
+
+    started = time.perf_counter()
+    bot = asyncio.run(_run_offline_cycle(args.fixtures, args.warm, collector, profiler))
+    print(f"offline run: {time.perf_counter() - started:.3f}s total, messages in profiled cycle={len(bot.sent)}")
+    print("\n".join(collector.summary()))
+
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        folded = f"{args.profile}.folded"
+        Path(folded).write_text("\n".join(collector.folded_stacks()) + "\n", encoding="utf-8")
+        print(f"\ncProfile: {args.profile} (snakeviz / flameprof), span flamegraph: {folded} (flamegraph.pl / speedscope)\n")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
 
+if __name__ == "__main__":
+    main()
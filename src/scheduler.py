@@ -0,0 +1,234 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import logging
+import time
+
+from .state import StateStore
+from .bot import BotApp
+from .models import MINSK_TZ, Listing
+from .poller import poll_once, poll_source
+from .health import get_health
+from .jobqueue import TICK_LEASE, JobQueue
+from .listing_cache import get_listing_cache
+
+
+# Сколько новых объявлений в среднем допускаем за один опрос: 0.25 — опрос примерно
+# в 4 раза чаще, чем приходят объявления
+TARGET_NEW_PER_POLL = 0.25
+EWMA_ALPHA = 0.3
+MIN_HOURLY_SAMPLES = 3
+
+
+class AdaptiveInterval:
+    """Интервал опроса одного источника.
+
+    Оценивает частоту новых объявлений (EWMA, отдельно по каждому часу суток),
+    опрашивает так, чтобы за опрос приходило около TARGET_NEW_PER_POLL
+    объявлений, и удваивает интервал на каждую ошибку подряд. Результат всегда
+    в пределах [min_sec, max_sec].
+    """
+
+    def __init__(self, min_sec: float, max_sec: float, base_sec: float) -> None:
+        self.min_sec = min_sec
+        self.max_sec = max(min_sec, max_sec)
+        self.base_sec = base_sec
+        self.rate_per_hour: Optional[float] = None
+        self.hourly_rate: List[Optional[float]] = [None] * 24
+        self.hourly_samples: List[int] = [0] * 24
+        self.consecutive_errors = 0
+        self._last_poll: Optional[float] = None
+
+    @staticmethod
+    def _ewma(old: Optional[float], sample: float) -> float:
+        return sample if old is None else old + EWMA_ALPHA * (sample - old)
+
+    @staticmethod
+    def _rate_from_dates(items: Iterable[Listing]) -> Optional[float]:
+        # Холодный старт: частота по разбросу дат публикации на странице
+        dates = sorted(i.created_at for i in items if i.created_at)
+        if len(dates) < 2:
+            return None
+        try:
+            span = (dates[-1] - dates[0]).total_seconds()
+        except TypeError:
+            return None
+        if span <= 0:
+            return None
+        return (len(dates) - 1) * 3600.0 / span
+
+    def observe(self, items: List[Listing], new_count: int, ok: bool, now: Optional[datetime] = None) -> None:
+        mono = time.monotonic()
+        if not ok:
+            self.consecutive_errors += 1
+            self._last_poll = mono
+            return
+        self.consecutive_errors = 0
+        sample: Optional[float] = None
+        if self._last_poll is not None:
+            elapsed = mono - self._last_poll
+            if elapsed > 0:
+                sample = new_count * 3600.0 / elapsed
+        elif self.rate_per_hour is None:
+            sample = self._rate_from_dates(items)
+        self._last_poll = mono
+        if sample is None:
+            return
+        self.rate_per_hour = self._ewma(self.rate_per_hour, sample)
+        hour = (now or datetime.now(MINSK_TZ)).hour
+        self.hourly_rate[hour] = self._ewma(self.hourly_rate[hour], sample)
+        self.hourly_samples[hour] += 1
+
+    def next_interval(self, now: Optional[datetime] = None) -> float:
+        hour = (now or datetime.now(MINSK_TZ)).hour
+        rate = self.rate_per_hour
+        if self.hourly_samples[hour] >= MIN_HOURLY_SAMPLES:
+            rate = self.hourly_rate[hour]
+        if rate is None:
+            interval = self.base_sec
+        elif rate <= 0:
+            interval = self.max_sec
+        else:
+            interval = TARGET_NEW_PER_POLL * 3600.0 / rate
+        if self.consecutive_errors:
+            interval *= 2 ** min(self.consecutive_errors, 6)
+        return max(self.min_sec, min(self.max_sec, interval))
+
+
+class PollScheduler:
+    """Каждый источник опрашивается своей задачей со своим временем следующего опроса.
+
+    Счётчик пустых циклов по-прежнему тикает раз в base_sec: тик пустой, если
+    ни один источник за это время не дал новых объявлений.
+
+    С queue (процесс-воркер) источник опрашивается, только пока воркер держит
+    его аренду, а после опроса его выдача и состояние публикуются для бота.
+    Счётчик пустых циклов ведёт один воркер — держатель аренды TICK_LEASE.
+    """
+
+    def __init__(
+        self,
+        state: StateStore,
+        bot: BotApp,
+        sources: Iterable[str],
+        base_sec: float,
+        min_sec: float,
+        max_sec: float,
+        queue: Optional[JobQueue] = None,
+    ) -> None:
+        self.state = state
+        self.queue = queue
+        self.bot = bot
+        self.sources = list(sources)
+        self.base_sec = base_sec
+        self.intervals: Dict[str, AdaptiveInterval] = {
+            s: AdaptiveInterval(min_sec, max_sec, base_sec) for s in self.sources
+        }
+        self.next_due: Dict[str, float] = {}
+        self._new_since_tick = 0
+        self._published_at_tick: Optional[int] = None
+        self.logger = logging.getLogger("scheduler")
+
+    async def run(self) -> None:
+        # Первый запуск: прогрев всех источников разом, без рассылки
+        while not self.state.has_seen_any():
+            await poll_once(self.state, self.bot)
+            if not self.state.has_seen_any():
+                await asyncio.sleep(self.base_sec)
+        tasks = [asyncio.create_task(self._source_loop(s), name=f"poll:{s}") for s in self.sources]
+        tasks.append(asyncio.create_task(self._tick_loop(), name="poll:tick"))
+        if self.queue is not None:
+            tasks.append(asyncio.create_task(self._lease_loop(), name="poll:leases"))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.queue is not None:
+                # Источники сразу достаются другим воркерам, не дожидаясь истечения аренды
+                await asyncio.to_thread(self.queue.release_all)
+
+    async def _lease_loop(self) -> None:
+        # Аренды продлеваются независимо от опросов: между ними может пройти poll_max_sec
+        while True:
+            await asyncio.sleep(self.queue.lease_sec / 3)
+            try:
+                await asyncio.to_thread(self.queue.renew)
+            except Exception as e:
+                self.logger.warning("lease renewal failed: %s", e)
+
+    async def _wait_for_lease(self, name: str) -> None:
+        while True:
+            try:
+                if await asyncio.to_thread(self.queue.hold, name):
+                    return
+            except Exception as e:
+                self.logger.warning("%s: lease check failed: %s", name, e)
+            await asyncio.sleep(self.queue.lease_sec / 2)
+
+    async def _source_loop(self, source: str) -> None:
+        interval = self.intervals[source]
+        while True:
+            if self.queue is not None:
+                await self._wait_for_lease(source)
+                # Цену меняет бот, а дату источника — прошлый владелец аренды
+                await self.state.refresh_async()
+            started = time.monotonic()
+            try:
+                items, fresh, ok = await poll_source(self.state, self.bot, source)
+            except Exception as e:
+                self.logger.warning("%s poll crashed: %s", source, e)
+                items, fresh, ok = [], [], False
+            if self.queue is not None:
+                try:
+                    await asyncio.to_thread(
+                        self.queue.put_source, source, get_listing_cache().get_fresh(source), get_health().get(source)
+                    )
+                except Exception as e:
+                    self.logger.warning("%s: publishing snapshot failed: %s", source, e)
+            self._new_since_tick += len(fresh)
+            interval.observe(items, len(fresh), ok)
+            delay = interval.next_interval()
+            self.next_due[source] = started + delay
+            self.logger.info(
+                "%s: next poll in %.0fs (rate=%s/h, errors=%d)",
+                source,
+                delay,
+                f"{interval.rate_per_hour:.2f}" if interval.rate_per_hour is not None else "n/a",
+                interval.consecutive_errors,
+            )
+            await asyncio.sleep(max(0.0, self.next_due[source] - time.monotonic()))
+
+    async def _tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.base_sec)
+            if self.queue is not None:
+                if not await asyncio.to_thread(self.queue.hold, TICK_LEASE):
+                    # Тикает другой воркер: свой счётчик не копим до того, как аренда перейдёт к нам
+                    self._published_at_tick = None
+                    self._new_since_tick = 0
+                    continue
+                # Новые объявления считаем по всем воркерам, а не только по своим источникам
+                published = await asyncio.to_thread(self.queue.published)
+                first_tick = self._published_at_tick is None
+                if not first_tick:
+                    self._new_since_tick = published - self._published_at_tick
+                self._published_at_tick = published
+                if first_tick:
+                    # Аренда только что перешла к нам: что опубликовали другие с прошлого тика,
+                    # неизвестно — этот тик только запоминает отсчёт
+                    self._new_since_tick = 0
+                    continue
+                await self.state.refresh_async()
+            empty = 0
+            async with self.state.batch():
+                expired = self.state.expire_seen()
+                if expired:
+                    self.logger.info("expired %d seen ids", expired)
+                if self._new_since_tick:
+                    self.state.reset_empty_cycles()
+                else:
+                    empty = self.state.increment_empty_cycle()
+            self._new_since_tick = 0
+            if empty and empty % 30 == 0:
+                await self.bot.notify_no_updates(empty)
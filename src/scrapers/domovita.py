@@ -1,11 +1,14 @@
-from typing import List
+from typing import List, Optional
 import logging
-import requests
 from bs4 import BeautifulSoup
 from datetime import datetime
 
-from ..models import Listing
-from ..utils import normalize_price
+from ..models import MINSK_TZ, Listing
+from ..utils import area_from_text, parse_price_text, rooms_from_text
+from ..metrics import parse_in_thread
+from .http import get_http_pool
+from .paging import KnownPredicate, crawl_pages, with_page_param
+from .revalidate import get_page_memo, payload_digest
 
 
 HEADERS = {
@@ -47,16 +50,19 @@ def parse_domovita_html(html: str) -> List[Listing]:
         title = link.get_text(strip=True) or None
         
         # Цена
-        price = None
+        price_amount = currency = None
         price_el = container.select_one("div.price")
         if price_el:
-            price = normalize_price(price_el.get_text(strip=True), default_currency="$")
+            price_amount, currency = parse_price_text(price_el.get_text(strip=True))
         
-        # Локация
-        location = None
-        loc_el = container.select_one("div.gr, [class*='address']")
-        if loc_el:
-            location = loc_el.get_text(strip=True) or None
+        # Локация: район из div.gr, улица и дом — из адреса карточки или из заголовка после первой запятой
+        district_el = container.select_one("div.gr")
+        district = district_el.get_text(strip=True) if district_el else None
+        address_el = container.select_one("[class*='address']")
+        street = address_el.get_text(strip=True) if address_el else None
+        if not street and title and "," in title:
+            street = title.split(",", 1)[1].strip()
+        location = ", ".join(p for p in (district, street) if p) or None
         
         # Дата: формат "04.10.2025" в <div class="date">
         created_at = None
@@ -64,8 +70,8 @@ def parse_domovita_html(html: str) -> List[Listing]:
         if date_el:
             date_text = date_el.get_text(strip=True)
             try:
-                # Парсим дату в формате DD.MM.YYYY
-                created_at = datetime.strptime(date_text, "%d.%m.%Y")
+                # Парсим дату в формате DD.MM.YYYY; сайт показывает минское время
+                created_at = datetime.strptime(date_text, "%d.%m.%Y").replace(tzinfo=MINSK_TZ)
             except Exception:
                 pass
         
@@ -75,18 +81,62 @@ def parse_domovita_html(html: str) -> List[Listing]:
                 id=item_id,
                 url=full_url,
                 title=title,
-                price=price,
+                price_amount=price_amount,
+                currency=currency,
                 location=location,
                 created_at=created_at,
+                rooms=rooms_from_text(title),
+                area=area_from_text(title),
             )
         )
 
     return results
 
 
-def fetch_domovita(url: str) -> List[Listing]:
+# Карточки выдачи: хэш считается по этому блоку, а не по всей странице с баннерами и токенами
+CARD_MARKER = 'class="found_item'
+CARD_BLOCK_TAIL = 8192
+
+
+def _card_block(html: str) -> Optional[str]:
+    start = html.find(CARD_MARKER)
+    if start == -1:
+        return None
+    last = html.rfind(CARD_MARKER)
+    end = html.find("pagination", last)
+    if end == -1:
+        end = last + CARD_BLOCK_TAIL
+    return html[start:end]
+
+
+async def _fetch_domovita_page(url: str) -> List[Listing]:
+    resp = await get_http_pool().get(url, headers=HEADERS)
+    resp.raise_for_status()
+    return await parse_in_thread(parse_domovita_html, resp.text)
+
+
+async def fetch_domovita(
+    url: str, is_known: Optional[KnownPredicate] = None, max_pages: int = 1, conditional: bool = False
+) -> List[Listing]:
     logger = logging.getLogger("scraper.domovita")
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+    # conditional: опрос поллера — неизменившаяся первая страница даёт NotModified без разбора
+    rev = get_page_memo().begin(url) if conditional else None
+    headers = dict(HEADERS)
+    if rev is not None:
+        headers.update(rev.request_headers(url))
+    resp = await get_http_pool().get(url, headers=headers)
+    if rev is not None:
+        rev.check_response(resp)
     resp.raise_for_status()
-    return parse_domovita_html(resp.text)
+    html = resp.text
+    if rev is not None:
+        rev.check_digest(payload_digest(_card_block(html)))
+    first_page = await parse_in_thread(parse_domovita_html, html)
 
+    async def next_page(page_no: int) -> List[Listing]:
+        return await _fetch_domovita_page(with_page_param(url, page_no))
+
+    results = await crawl_pages(first_page, next_page, is_known, max_pages, logger)
+    if rev is not None:
+        rev.commit(first_page)
+    return results
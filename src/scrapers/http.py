@@ -0,0 +1,89 @@
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import time
+import httpx
+
+from ..tracing import span
+from ..metrics import HTTP_BYTES, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_RESPONSE_BYTES, current_source
+
+
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+# Несколько keep-alive соединений на хост: страница выдачи + API/пагинация
+DEFAULT_LIMITS = httpx.Limits(max_connections=8, max_keepalive_connections=4, keepalive_expiry=120.0)
+
+
+class HttpPool:
+    """Асинхронные HTTP-клиенты с keep-alive: по одному пулу соединений на хост."""
+
+    def __init__(
+        self,
+        timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+        limits: httpx.Limits = DEFAULT_LIMITS,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.limits = limits
+        # Подменённый транспорт (страницы из фикстур вместо сети) — для офлайн-прогонов
+        self.transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _client_for(self, url: str) -> httpx.AsyncClient:
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                follow_redirects=True,
+                transport=self.transport,
+            )
+            self._clients[key] = client
+        return client
+
+    async def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        source = current_source.get()
+        with span("http.get", host=urlsplit(url).netloc) as sp:
+            start = time.perf_counter()
+            try:
+                resp = await self._client_for(url).get(url, headers=headers)
+            except Exception:
+                HTTP_REQUESTS.labels(source, "error").inc()
+                raise
+            finally:
+                HTTP_REQUEST_SECONDS.labels(source).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(source, resp.status_code).inc()
+            size = resp.num_bytes_downloaded or len(resp.content)
+            HTTP_BYTES.labels(source).inc(size)
+            HTTP_RESPONSE_BYTES.labels(source).observe(size)
+            sp.set(status=resp.status_code, bytes=size)
+        return resp
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+_pool: Optional[HttpPool] = None
+
+
+def configure_http_pool(transport: Optional[httpx.AsyncBaseTransport] = None) -> HttpPool:
+    global _pool
+    _pool = HttpPool(transport=transport)
+    return _pool
+
+
+def get_http_pool() -> HttpPool:
+    global _pool
+    if _pool is None:
+        _pool = HttpPool()
+    return _pool
+
+
+async def close_http_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
@@ -1,13 +1,16 @@
-from typing import Iterable, List, Optional, Any
+from collections import Counter
+from typing import Dict, List, Optional, Any, Tuple, Union
 import logging
-import json
 from urllib.parse import urlencode
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
 
-from ..models import Listing
-from ..utils import normalize_price
+from ..models import BYN, USD, Listing
+from ..utils import area_from_text, lat_lon, parse_datetime, parse_price_text, price_from_minor, rooms_from_text, to_float, to_int
+from ..tracing import span
+from ..metrics import PARSE_SECONDS, current_source, parse_in_thread
+from .http import get_http_pool
+from .nextdata import Document, as_document
+from .paging import KnownPredicate, crawl_pages
+from .revalidate import NotModified, Revalidation, get_page_memo, payload_digest
 
 
 HEADERS = {
@@ -15,6 +18,16 @@ HEADERS = {
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
 }
 
+API_URL = "https://api.kufar.by/search-api/v1/search/rendered-paginated"
+IMAGE_URL = "https://rms.kufar.by/v1/gallery/"
+# Куда на самом деле ходит скрапер: KUFAR_API_URL подменяет его на локальный стенд
+_api_url = API_URL
+
+
+def configure_kufar_api(url: Optional[str] = None) -> None:
+    global _api_url
+    _api_url = url or API_URL
+
 
 def _extract_id_from_url(url: str) -> str:
     # На Kufar id обычно в конце URL: /item/{id}
@@ -22,9 +35,12 @@ def _extract_id_from_url(url: str) -> str:
     return parts[-1].split("?")[0]
 
 
-def parse_kufar_html(html: str) -> List[Listing]:
-    soup = BeautifulSoup(html, "lxml")
-    cards: Iterable = soup.select("a[data-name='adLink'], a.SerpItem_link__") or soup.select("a[href*='/item/']")
+def parse_kufar_html(html: Union[str, Document]) -> List[Listing]:
+    soup = as_document(html).soup
+    cards = soup.select("a[data-name='adLink'], a.SerpItem_link__") or soup.select("a[href*='/item/']")
+    # Родитель, общий для нескольких ссылок, — это вся выдача, а не карточка: поиск цены
+    # в нём обходил бы страницу заново на каждое объявление (квадратично от их числа)
+    shared = Counter(id(a.find_parent()) for a in cards)
     results: List[Listing] = []
     for a in cards:
         href = a.get("href")
@@ -38,53 +54,93 @@ def parse_kufar_html(html: str) -> List[Listing]:
         parent = a.find_parent()
         price_text = None
         location_text = None
-        if parent:
-            price_el = parent.select_one("[data-name='price'], span, div:contains('$')")
+        if parent is not None and shared[id(parent)] == 1:
+            # Только элемент цены: первая попавшаяся цифра в карточке ценой не является
+            price_el = parent.select_one("[data-name='price'], [class*='price']")
             if price_el:
                 price_text = price_el.get_text(strip=True) or None
             loc_el = parent.select_one("[data-name='location'], span, div")
             if loc_el:
                 location_text = loc_el.get_text(strip=True) or None
 
+        price_amount, currency = parse_price_text(price_text)
         results.append(
             Listing(
                 source="kufar",
                 id=item_id,
                 url=full_url,
                 title=title_el,
-                price=price_text,
+                price_amount=price_amount,
+                currency=currency,
                 location=location_text,
+                rooms=rooms_from_text(title_el),
+                area=area_from_text(title_el),
             )
         )
 
     return results
 
 
-def fetch_kufar(url: str) -> List[Listing]:
+# queryForBe по URL поисковой страницы. HTML перечитывается только при смене URL
+# (например, после /max_price) или если API по закэшированному запросу сломался/пуст
+_QUERY_CACHE_LIMIT = 8
+_query_cache: Dict[str, dict[str, Any]] = {}
+
+
+async def fetch_kufar(
+    url: str, is_known: Optional[KnownPredicate] = None, max_pages: int = 1, conditional: bool = False
+) -> List[Listing]:
     logger = logging.getLogger("scraper.kufar")
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+    # conditional: опрос поллера — неизменившийся ответ API по первой странице даёт NotModified
+    rev = get_page_memo().begin(url) if conditional else None
+
+    async def crawl(query: dict[str, Any], first_page: List[Listing], cursor: Optional[str]) -> List[Listing]:
+        results = await _crawl_kufar_api(query, url, first_page, cursor, is_known, max_pages)
+        if rev is not None:
+            rev.commit(first_page)
+        return results
+
+    query = _query_cache.get(url)
+    if query is not None:
+        try:
+            api_results, cursor = await _fetch_kufar_api_page(query, page_url=url, rev=rev)
+            if api_results:
+                return await crawl(query, api_results, cursor)
+            logger.info("kufar api returned no ads for cached query, refreshing page")
+        except NotModified:
+            raise
+        except Exception as e:
+            logger.warning("kufar api with cached query failed: %s", e)
+        _query_cache.pop(url, None)
+
+    resp = await get_http_pool().get(url, headers=HEADERS)
     resp.raise_for_status()
+    # Одна страница на оба пути: JSON читается без DOM, дерево строится только для фолбэка
+    doc = Document(resp.text)
 
     # Попытка дернуть официальный API через __NEXT_DATA__ → queryForBe
     try:
-        api_results = fetch_kufar_via_api_from_html(resp.text, page_url=url)
-        if api_results:
-            return api_results
+        query = await parse_in_thread(_extract_query_for_be_from_html, doc)
+        if query and isinstance(query, dict):
+            api_results, cursor = await _fetch_kufar_api_page(query, page_url=url, rev=rev)
+            if api_results:
+                if len(_query_cache) >= _QUERY_CACHE_LIMIT:
+                    _query_cache.clear()
+                _query_cache[url] = query
+                return await crawl(query, api_results, cursor)
+    except NotModified:
+        raise
     except Exception as e:
         logger.warning("kufar api extraction failed: %s", e)
 
-    # Фолбэк на простой HTML разметки (если сервер всё же отдал ссылки)
-    return parse_kufar_html(resp.text)
+    # Фолбэк на простой HTML разметки (если сервер всё же отдал ссылки).
+    # Разбор DOM — CPU-работа, уводим её из event loop
+    return await parse_in_thread(parse_kufar_html, doc)
 
 
-def _extract_query_for_be_from_html(html: str) -> Optional[dict[str, Any]]:
-    soup = BeautifulSoup(html, "lxml")
-    script = soup.select_one("script#__NEXT_DATA__")
-    if not script or not script.text:
-        return None
-    try:
-        data = json.loads(script.text)
-    except Exception:
+def _extract_query_for_be_from_html(html: Union[str, Document]) -> Optional[dict[str, Any]]:
+    data = as_document(html).next_data
+    if not data:
         return None
     try:
         return (
@@ -97,29 +153,123 @@ def _extract_query_for_be_from_html(html: str) -> Optional[dict[str, Any]]:
         return None
 
 
-def fetch_kufar_via_api_from_html(html: str, page_url: str) -> List[Listing]:
-    query = _extract_query_for_be_from_html(html)
+async def fetch_kufar_via_api_from_html(html: Union[str, Document], page_url: str) -> List[Listing]:
+    query = await parse_in_thread(_extract_query_for_be_from_html, html)
     if not query or not isinstance(query, dict):
         return []
+    return await fetch_kufar_via_api(query, page_url=page_url)
+
+
+async def _crawl_kufar_api(
+    query: dict[str, Any],
+    page_url: str,
+    first_page: List[Listing],
+    cursor: Optional[str],
+    is_known: Optional[KnownPredicate],
+    max_pages: int,
+) -> List[Listing]:
+    # Следующие страницы API адресуются курсором из pagination предыдущего ответа
+    next_cursor = cursor
+
+    async def next_page(_page_no: int) -> List[Listing]:
+        nonlocal next_cursor
+        if not next_cursor:
+            return []
+        items, next_cursor = await _fetch_kufar_api_page(query, page_url=page_url, cursor=next_cursor)
+        return items
+
+    return await crawl_pages(first_page, next_page, is_known, max_pages, logging.getLogger("scraper.kufar"))
+
+
+def _next_cursor(data: dict[str, Any]) -> Optional[str]:
+    pages = (data.get("pagination") or {}).get("pages") or []
+    for page in pages:
+        if isinstance(page, dict) and page.get("label") == "next" and page.get("token"):
+            return page["token"]
+    return None
+
+
+async def fetch_kufar_via_api(query: dict[str, Any], page_url: str) -> List[Listing]:
+    items, _ = await _fetch_kufar_api_page(query, page_url=page_url)
+    return items
+
+
+async def _fetch_kufar_api_page(
+    query: dict[str, Any], page_url: str, cursor: Optional[str] = None, rev: Optional[Revalidation] = None
+) -> Tuple[List[Listing], Optional[str]]:
+    if cursor:
+        query = {**query, "cursor": cursor}
     qs = urlencode(query)
-    api_url = f"https://api.kufar.by/search-api/v1/search/rendered-paginated?{qs}"
+    api_url = f"{_api_url}?{qs}"
 
     headers = dict(HEADERS)
     headers.update({
         "Accept": "application/json, text/plain, */*",
         "Referer": page_url,
     })
-    resp = requests.get(api_url, headers=headers, timeout=30)
+    if rev is not None:
+        headers.update(rev.request_headers(api_url))
+    resp = await get_http_pool().get(api_url, headers=headers)
+    if rev is not None:
+        rev.check_response(resp)
     resp.raise_for_status()
-    data = resp.json()
+    # JSON разбирается на месте: без DOM это дешевле, чем пересылка в поток
+    with PARSE_SECONDS.labels(current_source.get()).time(), span("parse", fn="kufar_api"):
+        data = resp.json()
+        ads = _ads_of(data)
+        if rev is not None:
+            # Тот же список объявлений — разбирать и сверять с состоянием нечего
+            rev.check_digest(payload_digest(ads))
+        results = _parse_kufar_ads(ads)
+    return results, _next_cursor(data)
+
 
-    ads = (
+def _ads_of(data: dict[str, Any]) -> List[dict[str, Any]]:
+    return (
         data.get("ads")
         or (data.get("result") or {}).get("ads")
         or data.get("items")
         or []
     )
 
+
+def parse_kufar_payload(data: Any) -> List[Listing]:
+    """Ответ search-api, перехваченный в браузере, → объявления."""
+    return _parse_kufar_ads(_ads_of(data)) if isinstance(data, dict) else []
+
+
+def _kufar_price(ad: dict[str, Any]) -> Tuple[Optional[int], Optional[int]]:
+    # API отдаёт цену строкой в центах/копейках: "29500" — это 295 $
+    if ad.get("price_usd"):
+        return price_from_minor(ad["price_usd"], USD)
+    if ad.get("price_byn"):
+        return price_from_minor(ad["price_byn"], BYN)
+    return None, None
+
+
+def _kufar_params(ad: dict[str, Any]) -> Dict[str, Any]:
+    params = ad.get("ad_parameters") or ad.get("parameters") or []
+    return {p["p"]: p.get("v") for p in params if isinstance(p, dict) and p.get("p")}
+
+
+def _kufar_location(ad: dict[str, Any]) -> Optional[str]:
+    # Улица и дом лежат в параметрах объявления, region_name — только город
+    region = ad.get("region_name") or ad.get("settlement") or ad.get("region")
+    address = None
+    for params in (ad.get("account_parameters"), ad.get("ad_parameters")):
+        for p in params or ():
+            if isinstance(p, dict) and p.get("p") == "address" and p.get("v"):
+                address = str(p["v"])
+                break
+        if address:
+            break
+    address = address or ad.get("location")
+    if address and region and region not in address:
+        return f"{region}, {address}"
+    return address or region
+
+
+def _parse_kufar_ads(ads: List[dict[str, Any]]) -> List[Listing]:
     results: List[Listing] = []
     for ad in ads:
         ad_id = str(ad.get("ad_id") or ad.get("id") or ad.get("adId") or "")
@@ -131,42 +281,34 @@ def fetch_kufar_via_api_from_html(html: str, page_url: str) -> List[Listing]:
             or f"https://re.kufar.by/vi/{ad_id}"
         )
         title = ad.get("subject") or ad.get("title")
+        price_amount, currency = _kufar_price(ad)
+        params = _kufar_params(ad)
 
-        # Цена может быть числом, строкой или объектом
-        price_val = ad.get("price") or ad.get("price_usd") or ad.get("price_byn") or ad.get("price_byr")
-        price = normalize_price(price_val, default_currency="$")
-
-        location = (
-            ad.get("region_name")
-            or ad.get("location")
-            or ad.get("settlement")
-            or ad.get("region")
+        location = _kufar_location(ad)
+        lat, lon = lat_lon(params.get("coordinates"))
+        images = tuple(
+            IMAGE_URL + img["path"] for img in ad.get("images") or () if isinstance(img, dict) and img.get("path")
         )
 
-        # Дата создания: list_time или created_at
-        created_at = None
-        date_str = ad.get("list_time") or ad.get("created_at") or ad.get("listTime")
-        if date_str:
-            try:
-                # Формат ISO: 2025-10-01T20:22:05+03:00 или timestamp
-                if isinstance(date_str, (int, float)):
-                    created_at = datetime.fromtimestamp(date_str)
-                else:
-                    created_at = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            except Exception:
-                pass
-
         results.append(
             Listing(
                 source="kufar",
                 id=ad_id,
                 url=url,
                 title=title,
-                price=price,
+                price_amount=price_amount,
+                currency=currency,
                 location=location,
-                created_at=created_at,
+                # list_time: ISO с зоной или unix-время
+                created_at=parse_datetime(ad.get("list_time") or ad.get("created_at") or ad.get("listTime")),
+                rooms=to_int(params.get("rooms")),
+                area=to_float(params.get("size")),
+                floor=to_int(params.get("floor")),
+                floors=to_int(params.get("re_number_floors")),
+                lat=lat,
+                lon=lon,
+                images=images,
             )
         )
 
     return results
-
@@ -0,0 +1,85 @@
+from typing import Any, List, Optional, Union
+import json
+from bs4 import BeautifulSoup
+
+
+NEXT_DATA_ID = "__NEXT_DATA__"
+
+_UNSET = object()
+
+
+def extract_next_data(html: str) -> Optional[dict[str, Any]]:
+    """Достаёт JSON из <script id="__NEXT_DATA__"> поиском по строке, без построения DOM."""
+    pos = html.find(NEXT_DATA_ID)
+    while pos != -1:
+        tag_start = html.rfind("<", 0, pos)
+        tag_end = html.find(">", pos)
+        # Вхождение должно быть атрибутом открывающего тега <script ...>, а не текстом скрипта
+        in_tag = tag_start != -1 and tag_end != -1 and html.find(">", tag_start, pos) == -1
+        if in_tag and html[tag_start:tag_start + 7].lower() == "<script":
+            end = html.find("</script", tag_end)
+            if end == -1:
+                return None
+            try:
+                data = json.loads(html[tag_end + 1:end])
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                return data
+        pos = html.find(NEXT_DATA_ID, pos + len(NEXT_DATA_ID))
+    return None
+
+
+class Document:
+    """HTML-страница, которая разбирается не больше одного раза.
+
+    JSON-путь читает __NEXT_DATA__ без DOM; дерево BeautifulSoup строится
+    лениво и только если до него дошёл HTML-фолбэк — тогда оно общее для всех.
+    """
+
+    def __init__(self, html: str) -> None:
+        self.html = html
+        self._soup: Optional[BeautifulSoup] = None
+        self._next_data: Any = _UNSET
+
+    @property
+    def soup(self) -> BeautifulSoup:
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.html, "lxml")
+        return self._soup
+
+    @property
+    def next_data(self) -> Optional[dict[str, Any]]:
+        if self._next_data is _UNSET:
+            data = extract_next_data(self.html)
+            if data is None and NEXT_DATA_ID in self.html:
+                # Нестандартная разметка тега — доверяем полноценному парсеру
+                script = self.soup.select_one(f"script#{NEXT_DATA_ID}")
+                if script and script.text:
+                    try:
+                        data = json.loads(script.text)
+                    except ValueError:
+                        data = None
+            self._next_data = data
+        return self._next_data
+
+
+def as_document(page: Union[str, Document]) -> Document:
+    return page if isinstance(page, Document) else Document(page)
+
+
+def find_records(data: Any, key: str) -> List[dict[str, Any]]:
+    """Первый список объектов с полем key в произвольном JSON (ответ GraphQL, /_next/data/...).
+
+    Обход в ширину: список объявлений лежит выше вложенных в объявления списков.
+    """
+    queue: List[Any] = [data]
+    while queue:
+        node = queue.pop(0)
+        if isinstance(node, dict):
+            queue.extend(node.values())
+        elif isinstance(node, list):
+            if node and all(isinstance(x, dict) for x in node) and any(key in x for x in node):
+                return node
+            queue.extend(node)
+    return []
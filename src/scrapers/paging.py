@@ -0,0 +1,60 @@
+from typing import Awaitable, Callable, List, Optional
+import logging
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from ..models import Listing
+
+
+KnownPredicate = Callable[[Listing], bool]
+
+
+def with_page_param(url: str, page: int, param: str = "page") -> str:
+    """URL той же выдачи с номером страницы (остальные параметры сохраняются, включая повторы)."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != param]
+    query.append((param, str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def page_is_exhausted(items: List[Listing], is_known: KnownPredicate) -> bool:
+    """Страница «догнала» уже обработанное: пусто или хотя бы половина объявлений известна.
+
+    Известное объявление — уже виденный ID или дата старше сохранённой. Порог в
+    половину страницы, а не «все известны», чтобы обычный цикл с парой новых
+    объявлений стоил одну страницу, а закреплённые старые карточки не мешали
+    дойти вглубь после простоя.
+    """
+    if not items:
+        return True
+    known = sum(1 for i in items if is_known(i))
+    return known * 2 >= len(items)
+
+
+async def crawl_pages(
+    first_page: List[Listing],
+    next_page: Callable[[int], Awaitable[List[Listing]]],
+    is_known: Optional[KnownPredicate],
+    max_pages: int,
+    logger: logging.Logger,
+) -> List[Listing]:
+    """Лениво дочитывает страницы 2..max_pages, пока выдача не упрётся в известные объявления."""
+    results = list(first_page)
+    seen_ids = {i.id for i in results}
+    page_items = first_page
+    page_no = 1
+    while is_known is not None and page_no < max_pages and not page_is_exhausted(page_items, is_known):
+        page_no += 1
+        try:
+            page_items = await next_page(page_no)
+        except Exception as e:
+            logger.warning("page %d fetch failed: %s", page_no, e)
+            break
+        # Объявления сдвигаются между страницами — отбрасываем повторы
+        page_items = [i for i in page_items if i.id not in seen_ids]
+        if not page_items:
+            break
+        seen_ids.update(i.id for i in page_items)
+        results.extend(page_items)
+    if page_no > 1:
+        logger.info("catch-up crawl: %d pages, %d items", page_no, len(results))
+    return results
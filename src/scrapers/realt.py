@@ -1,12 +1,13 @@
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Union
 import logging
-import json
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
 
-from ..models import Listing
-from ..utils import normalize_price
+from ..models import USD, Listing
+from ..utils import area_from_text, lat_lon, parse_datetime, parse_price_text, price_from_major, rooms_from_text, to_float, to_int
+from ..metrics import parse_in_thread
+from .http import get_http_pool
+from .nextdata import Document, as_document, find_records
+from .paging import KnownPredicate, crawl_pages, with_page_param
+from .revalidate import get_page_memo, payload_digest
 
 
 HEADERS = {
@@ -21,8 +22,8 @@ def _extract_id_from_url(url: str) -> str:
     return ''.join(ch for ch in last if ch.isdigit()) or last
 
 
-def parse_realt_html(html: str) -> List[Listing]:
-    soup = BeautifulSoup(html, "lxml")
+def parse_realt_html(html: Union[str, Document]) -> List[Listing]:
+    soup = as_document(html).soup
 
     # Карточки объявлений
     cards = soup.select("a[href*='/rent/flat-for-long/']") or soup.select("a.card-btn")
@@ -40,12 +41,12 @@ def parse_realt_html(html: str) -> List[Listing]:
 
         title = a.get_text(strip=True) or None
         parent = a.find_parent()
-        price = None
+        price_amount = currency = None
         location = None
         if parent:
             price_el = parent.select_one("[class*='price'], [data-price]")
             if price_el:
-                price = normalize_price(price_el.get_text(strip=True), default_currency="$")
+                price_amount, currency = parse_price_text(price_el.get_text(strip=True))
             loc_el = parent.select_one("[class*='address'], [data-address]")
             if loc_el:
                 location = loc_el.get_text(strip=True) or None
@@ -56,39 +57,74 @@ def parse_realt_html(html: str) -> List[Listing]:
                 id=item_id,
                 url=full_url,
                 title=title,
-                price=price,
+                price_amount=price_amount,
+                currency=currency,
                 location=location,
+                rooms=rooms_from_text(title),
+                area=area_from_text(title),
             )
         )
 
     return results
 
 
-def fetch_realt(url: str) -> List[Listing]:
+async def fetch_realt(
+    url: str, is_known: Optional[KnownPredicate] = None, max_pages: int = 1, conditional: bool = False
+) -> List[Listing]:
     logger = logging.getLogger("scraper.realt")
-    resp = requests.get(url, headers=HEADERS, timeout=30)
+    # conditional: опрос поллера — неизменившаяся первая страница даёт NotModified без разбора
+    rev = get_page_memo().begin(url) if conditional else None
+    headers = dict(HEADERS)
+    if rev is not None:
+        headers.update(rev.request_headers(url))
+    resp = await get_http_pool().get(url, headers=headers)
+    if rev is not None:
+        rev.check_response(resp)
     resp.raise_for_status()
+    doc = Document(resp.text)
+    if rev is not None:
+        rev.check_digest(await parse_in_thread(_objects_digest, doc))
+    first_page = await _parse_realt_page(doc)
 
+    async def next_page(page_no: int) -> List[Listing]:
+        return await _fetch_realt_page(with_page_param(url, page_no))
+
+    results = await crawl_pages(first_page, next_page, is_known, max_pages, logger)
+    if rev is not None:
+        rev.commit(first_page)
+    return results
+
+
+async def _fetch_realt_page(url: str) -> List[Listing]:
+    resp = await get_http_pool().get(url, headers=HEADERS)
+    resp.raise_for_status()
+    return await _parse_realt_page(Document(resp.text))
+
+
+async def _parse_realt_page(doc: Document) -> List[Listing]:
+    logger = logging.getLogger("scraper.realt")
+    # Один Document на оба пути: JSON читается без DOM, дерево строится только для фолбэка
     # Попытка дернуть JSON из __NEXT_DATA__
     try:
-        api_results = fetch_realt_via_json_from_html(resp.text)
+        api_results = await parse_in_thread(fetch_realt_via_json_from_html, doc)
         if api_results:
             return api_results
     except Exception as e:
         logger.warning("realt json extraction failed: %s", e)
 
     # Фолбэк на простой HTML разметки
-    return parse_realt_html(resp.text)
+    return await parse_in_thread(parse_realt_html, doc)
 
 
-def _extract_objects_from_html(html: str) -> Optional[list[Any]]:
-    soup = BeautifulSoup(html, "lxml")
-    script = soup.select_one("script#__NEXT_DATA__")
-    if not script or not script.text:
-        return None
-    try:
-        data = json.loads(script.text)
-    except Exception:
+def _objects_digest(doc: Document) -> Optional[bytes]:
+    # Хэшируются только объявления из __NEXT_DATA__: остальная страница меняется от запроса к запросу
+    objects = _extract_objects_from_html(doc)
+    return payload_digest(objects) if isinstance(objects, list) else None
+
+
+def _extract_objects_from_html(html: Union[str, Document]) -> Optional[list[Any]]:
+    data = as_document(html).next_data
+    if not data:
         return None
     try:
         return (
@@ -102,11 +138,19 @@ def _extract_objects_from_html(html: str) -> Optional[list[Any]]:
         return None
 
 
-def fetch_realt_via_json_from_html(html: str) -> List[Listing]:
+def fetch_realt_via_json_from_html(html: Union[str, Document]) -> List[Listing]:
     objects = _extract_objects_from_html(html)
     if not objects or not isinstance(objects, list):
         return []
+    return _parse_realt_objects(objects)
 
+
+def parse_realt_payload(data: Any) -> List[Listing]:
+    """JSON-ответ сайта, перехваченный в браузере (GraphQL или /_next/data/), → объявления."""
+    return _parse_realt_objects(find_records(data, "code"))
+
+
+def _parse_realt_objects(objects: List[dict[str, Any]]) -> List[Listing]:
     results: List[Listing] = []
     for obj in objects:
         obj_uuid = str(obj.get("code") or "")
@@ -115,21 +159,13 @@ def fetch_realt_via_json_from_html(html: str) -> List[Listing]:
         url = f"https://realt.by/s/o/2/{obj_uuid}/"
         title = obj.get("title") or obj.get("headline")
         
-        # Цена: price + priceCurrency=840 (USD)
-        price_val = obj.get("price")
-        price = normalize_price(price_val, default_currency="$")
+        # Цена: price в основных единицах + priceCurrency (числовой код ISO 4217, 840 — USD)
+        price_amount, currency = price_from_major(obj.get("price"), to_int(obj.get("priceCurrency")) or USD)
 
         # Локация: address или streetName
         location = obj.get("address") or obj.get("streetName") or obj.get("townName")
-
-        # Дата создания: createdAt
-        created_at = None
-        date_str = obj.get("createdAt") or obj.get("created_at")
-        if date_str:
-            try:
-                created_at = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            except Exception:
-                pass
+        lat, lon = lat_lon(obj.get("location"))
+        images = tuple(img for img in obj.get("images") or () if isinstance(img, str))
 
         results.append(
             Listing(
@@ -137,9 +173,17 @@ def fetch_realt_via_json_from_html(html: str) -> List[Listing]:
                 id=obj_uuid,
                 url=url,
                 title=title,
-                price=price,
+                price_amount=price_amount,
+                currency=currency,
                 location=location,
-                created_at=created_at,
+                created_at=parse_datetime(obj.get("createdAt") or obj.get("created_at")),
+                rooms=to_int(obj.get("rooms")),
+                area=to_float(obj.get("areaTotal")),
+                floor=to_int(obj.get("storey")),
+                floors=to_int(obj.get("storeys")),
+                lat=lat,
+                lon=lon,
+                images=images,
             )
         )
 
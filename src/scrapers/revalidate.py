@@ -0,0 +1,109 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+
+import httpx
+
+from ..models import Listing
+
+
+class NotModified(Exception):
+    """Первая страница выдачи не изменилась с прошлого условного опроса."""
+
+    def __init__(self, items: List[Listing]) -> None:
+        super().__init__("listing page not modified")
+        self.items = items
+
+
+def payload_digest(payload: Any) -> Optional[bytes]:
+    """Хэш полезной части страницы (JSON с объявлениями или блок карточек). None — хэшировать нечего."""
+    if not payload:
+        return None
+    if isinstance(payload, str):
+        data = payload.encode("utf-8", "surrogatepass")
+    elif isinstance(payload, bytes):
+        data = payload
+    else:
+        data = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+@dataclass
+class _Entry:
+    request_url: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    digest: Optional[bytes] = None
+    items: List[Listing] = field(default_factory=list)
+
+
+class Revalidation:
+    """Один условный опрос выдачи.
+
+    Подставляет ETag/Last-Modified прошлого ответа, бросает NotModified на 304
+    или совпавший хэш и запоминает новый ответ только в commit() — после того,
+    как вся выдача прочитана, чтобы прерванный опрос не спрятал объявления.
+    """
+
+    def __init__(self, memo: "PageMemo", key: str, previous: Optional[_Entry]) -> None:
+        self._memo = memo
+        self._key = key
+        self._previous = previous
+        self._pending = _Entry()
+
+    def request_headers(self, request_url: str) -> Dict[str, str]:
+        self._pending.request_url = request_url
+        prev = self._previous
+        if prev is None or prev.request_url != request_url:
+            return {}
+        headers: Dict[str, str] = {}
+        if prev.etag:
+            headers["If-None-Match"] = prev.etag
+        if prev.last_modified:
+            headers["If-Modified-Since"] = prev.last_modified
+        return headers
+
+    def check_response(self, resp: httpx.Response) -> None:
+        if resp.status_code == 304 and self._previous is not None:
+            raise NotModified(self._previous.items)
+        self._pending.etag = resp.headers.get("ETag")
+        self._pending.last_modified = resp.headers.get("Last-Modified")
+
+    def check_digest(self, digest: Optional[bytes]) -> None:
+        self._pending.digest = digest
+        prev = self._previous
+        if digest is not None and prev is not None and prev.digest == digest:
+            raise NotModified(prev.items)
+
+    def commit(self, items: List[Listing]) -> None:
+        if not items:
+            return
+        self._pending.items = list(items)
+        self._memo._store(self._key, self._pending)
+
+
+class PageMemo:
+    """Что было на первой странице каждой выдачи при прошлом условном опросе."""
+
+    def __init__(self, limit: int = 32) -> None:
+        self.limit = limit
+        self._entries: Dict[str, _Entry] = {}
+
+    def begin(self, key: str) -> Revalidation:
+        return Revalidation(self, key, self._entries.get(key))
+
+    def _store(self, key: str, entry: _Entry) -> None:
+        if key not in self._entries and len(self._entries) >= self.limit:
+            self._entries.clear()
+        self._entries[key] = entry
+
+
+_memo: Optional[PageMemo] = None
+
+
+def get_page_memo() -> PageMemo:
+    global _memo
+    if _memo is None:
+        _memo = PageMemo()
+    return _memo
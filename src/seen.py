@@ -0,0 +1,144 @@
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import time
+
+
+# Числовые ID (Kufar, Domovita) храним как int64 в отсортированном массиве
+_MAX_INT_ID_LEN = 18
+
+
+def _as_int(item_id: str) -> Optional[int]:
+    # Только каноничные десятичные строки: "007" как int не восстановится обратно
+    if item_id.isdigit() and len(item_id) <= _MAX_INT_ID_LEN and (item_id == "0" or item_id[0] != "0"):
+        return int(item_id)
+    return None
+
+
+class BloomFilter:
+    """Простой фильтр Блума: быстрый отрицательный ответ до точного поиска."""
+
+    def __init__(self, bits: int, hashes: int = 4) -> None:
+        self.bits = max(8, bits)
+        self.hashes = hashes
+        self._data = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item_id: str) -> Iterator[int]:
+        digest = blake2b(item_id.encode(), digest_size=8 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self.bits
+
+    def add(self, item_id: str) -> None:
+        for pos in self._positions(item_id):
+            self._data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item_id: str) -> bool:
+        return all(self._data[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item_id))
+
+
+class SeenIds:
+    """Просмотренные ID одного источника со временем первого появления.
+
+    Числовые ID лежат в двух параллельных массивах array('q') (ID по
+    возрастанию и unix-время), остальные (UUID Realt) — в словаре.
+    Устаревшие записи удаляются через expire().
+    """
+
+    def __init__(self, bloom_bits: int = 0) -> None:
+        self._int_ids = array("q")
+        self._int_first_seen = array("q")
+        self._str_first_seen: Dict[str, int] = {}
+        self.bloom_bits = bloom_bits
+        self._bloom: Optional[BloomFilter] = BloomFilter(bloom_bits) if bloom_bits else None
+
+    def __len__(self) -> int:
+        return len(self._int_ids) + len(self._str_first_seen)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[str]:
+        for n in self._int_ids:
+            yield str(n)
+        yield from self._str_first_seen
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        for n, ts in zip(self._int_ids, self._int_first_seen):
+            yield str(n), ts
+        yield from self._str_first_seen.items()
+
+    def __contains__(self, item_id: object) -> bool:
+        if not isinstance(item_id, str):
+            return False
+        if self._bloom is not None and item_id not in self._bloom:
+            return False
+        n = _as_int(item_id)
+        if n is None:
+            return item_id in self._str_first_seen
+        pos = bisect_left(self._int_ids, n)
+        return pos < len(self._int_ids) and self._int_ids[pos] == n
+
+    def add(self, ids: Iterable[str], first_seen: Optional[int] = None) -> None:
+        ts = int(first_seen if first_seen is not None else time.time())
+        self._add_pairs((item_id, ts) for item_id in ids)
+
+    def _add_pairs(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        new_ints: Dict[int, int] = {}
+        for item_id, ts in pairs:
+            if item_id in self:
+                continue
+            if self._bloom is not None:
+                self._bloom.add(item_id)
+            n = _as_int(item_id)
+            if n is None:
+                self._str_first_seen[item_id] = ts
+            else:
+                new_ints.setdefault(n, ts)
+        if new_ints:
+            # Слияние пачкой: одна пересортировка вместо вставки по одному
+            merged = sorted([*zip(self._int_ids, self._int_first_seen), *new_ints.items()])
+            self._int_ids = array("q", (n for n, _ in merged))
+            self._int_first_seen = array("q", (t for _, t in merged))
+
+    def expire(self, cutoff: int) -> int:
+        """Удаляет ID, впервые замеченные раньше cutoff (unix-время). Возвращает число удалённых."""
+        before = len(self)
+        if any(t < cutoff for t in self._int_first_seen):
+            keep = [i for i, t in enumerate(self._int_first_seen) if t >= cutoff]
+            self._int_ids = array("q", (self._int_ids[i] for i in keep))
+            self._int_first_seen = array("q", (self._int_first_seen[i] for i in keep))
+        stale = [k for k, t in self._str_first_seen.items() if t < cutoff]
+        for k in stale:
+            del self._str_first_seen[k]
+        removed = before - len(self)
+        if removed and self._bloom is not None:
+            self._rebuild_bloom()
+        return removed
+
+    def _rebuild_bloom(self) -> None:
+        self._bloom = BloomFilter(self.bloom_bits)
+        for item_id in self:
+            self._bloom.add(item_id)
+
+    def to_json(self) -> Dict[str, List[Any]]:
+        str_items = sorted(self._str_first_seen.items())
+        return {
+            "ids": [*self._int_ids.tolist(), *(k for k, _ in str_items)],
+            "first_seen": [*self._int_first_seen.tolist(), *(t for _, t in str_items)],
+        }
+
+    @classmethod
+    def from_json(cls, data: Any, default_first_seen: int, bloom_bits: int = 0) -> "SeenIds":
+        seen = cls(bloom_bits=bloom_bits)
+        # Старый формат state.json: просто список ID без времени
+        if isinstance(data, list):
+            seen.add((str(i) for i in data), first_seen=default_first_seen)
+            return seen
+        ids = data.get("ids") or []
+        first_seen = data.get("first_seen") or []
+        seen._add_pairs(
+            (str(item_id), int(first_seen[i]) if i < len(first_seen) else default_first_seen)
+            for i, item_id in enumerate(ids)
+        )
+        return seen
@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from .config import AppConfig
+from .models import Listing
+from .browser import capture_rendered_json, fetch_rendered_html
+from .health import OPEN, get_health
+from .tracing import span
+from .metrics import FALLBACK_CAPTURED, FALLBACK_SECONDS, FALLBACK_TOTAL, current_source, parse_in_thread
+from .scrapers.kufar import fetch_kufar, parse_kufar_html, parse_kufar_payload
+from .scrapers.domovita import fetch_domovita, parse_domovita_html
+from .scrapers.realt import fetch_realt, parse_realt_html, parse_realt_payload
+from .scrapers.paging import KnownPredicate
+
+
+# Ожидание страницы при рендере, если бюджет опроса не ограничивает его сильнее
+RENDER_TIMEOUT_MS = 20000
+
+
+@dataclass(frozen=True)
+class Source:
+    """Сайт с объявлениями: как получить выдачу и как её спасти, если она пуста.
+
+    fetch(url, is_known=..., max_pages=..., conditional=...) — обычный путь (HTTP/API,
+    пагинация); с conditional=True бросает NotModified, если первая страница не менялась;
+    parse_rendered — парсер HTML после рендера в браузере (фолбэк);
+    wait_selector — что ждать на отрендеренной странице;
+    capture_urls / parse_captured — части URL запросов страницы к API сайта и разбор их
+    JSON: рендер возвращается, как только пришёл такой ответ, без ожидания всей страницы;
+    timeout_sec — бюджет на весь опрос источника, включая фолбэк (SOURCE_TIMEOUT_SEC
+    его перекрывает, см. budget).
+    """
+
+    name: str
+    url: Callable[[AppConfig], str]
+    fetch: Callable[..., Awaitable[List[Listing]]]
+    parse_rendered: Optional[Callable[[str], List[Listing]]] = None
+    wait_selector: Optional[str] = None
+    capture_urls: Tuple[str, ...] = ()
+    parse_captured: Optional[Callable[[Any], List[Listing]]] = None
+    timeout_sec: float = 90.0
+
+    def budget(self, cfg: AppConfig) -> float:
+        return cfg.source_timeout_sec or self.timeout_sec
+
+    def _captures(self, url: str) -> bool:
+        return any(part in url for part in self.capture_urls)
+
+    async def fetch_listings(
+        self, url: str, is_known: Optional[KnownPredicate] = None, max_pages: int = 1, conditional: bool = False
+    ) -> List[Listing]:
+        return await self.fetch(url, is_known=is_known, max_pages=max_pages, conditional=conditional)
+
+    async def render_fallback(self, url: str, timeout_sec: Optional[float] = None) -> List[Listing]:
+        """Рендер в браузере; timeout_sec — остаток бюджета опроса, ограничивает ожидание страницы."""
+        if self.parse_rendered is None:
+            return []
+        timeout_ms = RENDER_TIMEOUT_MS
+        if timeout_sec is not None:
+            timeout_ms = max(1, min(timeout_ms, int(timeout_sec * 1000)))
+        FALLBACK_TOTAL.labels(self.name).inc()
+        with span("render_fallback", source=self.name) as sp:
+            start = time.perf_counter()
+            try:
+                if self.parse_captured is not None and self.capture_urls:
+                    items, html = await capture_rendered_json(
+                        url, self._captures, self.parse_captured, timeout_ms=timeout_ms
+                    )
+                    sp.set(captured=items is not None)
+                    if items is not None:
+                        FALLBACK_CAPTURED.labels(self.name).inc()
+                        return items
+                else:
+                    html = await fetch_rendered_html(url, wait_selector=self.wait_selector, timeout_ms=timeout_ms)
+            finally:
+                FALLBACK_SECONDS.labels(self.name).observe(time.perf_counter() - start)
+            return await parse_in_thread(self.parse_rendered, html)
+
+
+# Реестр источников в порядке регистрации: новый сайт — это один вызов register_source
+SOURCES: Dict[str, Source] = {}
+
+
+def register_source(source: Source) -> Source:
+    SOURCES[source.name] = source
+    return source
+
+
+def get_source(name: str) -> Source:
+    return SOURCES[name]
+
+
+def source_url(cfg: AppConfig, name: str) -> str:
+    return SOURCES[name].url(cfg)
+
+
+async def fetch_with_fallback(name: str, url: str, timeout_sec: Optional[float] = None) -> List[Listing]:
+    """Первая страница выдачи: обычный fetch, при пустом ответе — рендер в браузере.
+
+    timeout_sec — бюджет на всё вместе (Source.budget), по умолчанию timeout_sec источника.
+    """
+    source = SOURCES[name]
+    budget = timeout_sec or source.timeout_sec
+    deadline = time.monotonic() + budget
+
+    async def run() -> List[Listing]:
+        token = current_source.set(name)
+        try:
+            items = await source.fetch_listings(url)
+            # Команды бота пробу не занимают: у сломанного источника браузер ждёт поллера
+            if not items and get_health().get(name).state != OPEN:
+                try:
+                    items = await source.render_fallback(url, deadline - time.monotonic())
+                except Exception:
+                    items = []
+            return items
+        finally:
+            current_source.reset(token)
+
+    return await asyncio.wait_for(run(), timeout=budget)
+
+
+register_source(Source(
+    name="kufar",
+    url=lambda cfg: cfg.kufar_url,
+    fetch=fetch_kufar,
+    parse_rendered=parse_kufar_html,
+    wait_selector="a[href*='/item/']",
+    capture_urls=("/search-api/",),
+    parse_captured=parse_kufar_payload,
+))
+register_source(Source(
+    name="domovita",
+    url=lambda cfg: cfg.domovita_url,
+    fetch=fetch_domovita,
+    parse_rendered=parse_domovita_html,
+    wait_selector="a[href*='/rent/']",
+))
+register_source(Source(
+    name="realt",
+    url=lambda cfg: cfg.realt_url,
+    fetch=fetch_realt,
+    parse_rendered=parse_realt_html,
+    wait_selector="a[href*='/rent/flat-for-long/']",
+    capture_urls=("graphql", "/_next/data/"),
+    parse_captured=parse_realt_payload,
+))
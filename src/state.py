@@ -1,22 +1,68 @@
+import asyncio
 import json
+import os
+import threading
+import time
 from pathlib import Path
-from typing import Dict, Set, Optional
+from typing import Any, Dict, Set, Optional
 from datetime import datetime
 
-from .config import DATA_DIR
+from .config import DATA_DIR, AppConfig
+from .seen import SeenIds
+from .filters import NO_FILTER, ChatFilter, FilterIndex
+from .metrics import STATE_SAVE_SECONDS
+from .tracing import span
+from .utils import parse_datetime
 
 
 STATE_FILE = DATA_DIR / "state.json"
 
 
+class _Batch:
+    """Откладывает запись состояния до выхода из блока (with / async with)."""
+
+    def __init__(self, store: "StateStore", flush: bool = True) -> None:
+        self.store = store
+        self.flush = flush
+
+    def __enter__(self) -> "StateStore":
+        self.store._batch_depth += 1
+        return self.store
+
+    def __exit__(self, *exc: Any) -> None:
+        self.store._batch_depth -= 1
+        if self.store._batch_depth == 0 and self.flush:
+            self.store.flush()
+
+    async def __aenter__(self) -> "StateStore":
+        return self.__enter__()
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.store._batch_depth -= 1
+        if self.store._batch_depth == 0 and self.flush:
+            await self.store.flush_async()
+
+
 class StateStore:
-    def __init__(self, path: Path = STATE_FILE) -> None:
+    def __init__(self, path: Path = STATE_FILE, retention_days: int = 30, bloom_bits: int = 0) -> None:
         self.path = path
-        self.seen_ids_by_source: Dict[str, Set[str]] = {}
+        # Просмотренные ID живут retention_days с момента первого появления (0 — бессрочно)
+        self.retention_sec = retention_days * 86400
+        self.bloom_bits = bloom_bits
+        self.seen_ids_by_source: Dict[str, SeenIds] = {}
         self.last_date_by_source: Dict[str, Optional[datetime]] = {}
         self.chat_ids: Set[int] = set()
+        # Фильтры чатов; чат без записи получает всё. Индекс строится лениво и сбрасывается при изменениях
+        self.chat_filters: Dict[int, ChatFilter] = {}
+        self._filter_index: Optional[FilterIndex] = None
         self.empty_cycles: int = 0
         self.max_price: Optional[int] = None
+        self._dirty = False
+        self._batch_depth = 0
+        # Версии снимков: запись более старого снимка поверх нового пропускается
+        self._version = 0
+        self._written_version = 0
+        self._write_lock = threading.Lock()
         self._load()
 
     def _load(self) -> None:
@@ -27,53 +73,144 @@ class StateStore:
             data = json.loads(self.path.read_text(encoding="utf-8"))
         except Exception:
             data = {}
+        now = int(time.time())
         self.seen_ids_by_source = {
-            k: set(v) for k, v in (data.get("seen_ids_by_source") or {}).items()
+            k: SeenIds.from_json(v, default_first_seen=now, bloom_bits=self.bloom_bits)
+            for k, v in (data.get("seen_ids_by_source") or {}).items()
         }
         self.chat_ids = set(data.get("chat_ids") or [])
+        self.chat_filters = {
+            int(k): ChatFilter.from_dict(v) for k, v in (data.get("chat_filters") or {}).items()
+        }
         self.empty_cycles = int(data.get("empty_cycles") or 0)
         self.max_price = data.get("max_price")
         # Загрузка дат
         last_dates_raw = data.get("last_date_by_source") or {}
-        self.last_date_by_source = {}
-        for k, v in last_dates_raw.items():
-            if v:
-                try:
-                    self.last_date_by_source[k] = datetime.fromisoformat(v)
-                except Exception:
-                    self.last_date_by_source[k] = None
-            else:
-                self.last_date_by_source[k] = None
+        # Старые файлы хранили даты Domovita без зоны — parse_datetime считает их минскими
+        self.last_date_by_source = {k: parse_datetime(v) for k, v in last_dates_raw.items()}
+
+    def batch(self, flush: bool = True) -> _Batch:
+        """Все изменения внутри блока сохраняются одной записью на выходе.
+
+        `with state.batch():` пишет синхронно, `async with state.batch():`
+        сериализует и пишет файл в отдельном потоке. С flush=False запись
+        остаётся за вызывающим (flush / flush_async).
+        """
+        return _Batch(self, flush=flush)
 
     def _save(self) -> None:
-        # Сериализация дат в ISO-формат
-        last_dates_ser = {}
-        for k, v in self.last_date_by_source.items():
-            if v:
-                last_dates_ser[k] = v.isoformat()
-            else:
-                last_dates_ser[k] = None
-
-        payload = {
-            "seen_ids_by_source": {k: sorted(list(v)) for k, v in self.seen_ids_by_source.items()},
-            "chat_ids": sorted(list(self.chat_ids)),
+        # Изменение только помечает состояние грязным; внутри batch() запись откладывается
+        self._dirty = True
+        self._version += 1
+        if self._batch_depth == 0:
+            self.flush()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        # Копируем коллекции в потоке event loop, тяжёлую сериализацию делаем при записи
+        return {
+            "seen_ids_by_source": {k: v.to_json() for k, v in self.seen_ids_by_source.items()},
+            "chat_ids": list(self.chat_ids),
+            "chat_filters": {str(k): v.to_dict() for k, v in self.chat_filters.items()},
             "empty_cycles": self.empty_cycles,
-            "last_date_by_source": last_dates_ser,
+            "last_date_by_source": dict(self.last_date_by_source),
             "max_price": self.max_price,
         }
-        self.path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    def _write_snapshot(self, snapshot: Dict[str, Any], version: int) -> None:
+        with span("state.write", backend="json"):
+            start = time.perf_counter()
+            # Сериализация дат в ISO-формат
+            last_dates_ser = {}
+            for k, v in snapshot["last_date_by_source"].items():
+                if v:
+                    last_dates_ser[k] = v.isoformat()
+                else:
+                    last_dates_ser[k] = None
+
+            payload = {
+                "seen_ids_by_source": snapshot["seen_ids_by_source"],
+                "chat_ids": sorted(snapshot["chat_ids"]),
+                "chat_filters": snapshot["chat_filters"],
+                "empty_cycles": snapshot["empty_cycles"],
+                "last_date_by_source": last_dates_ser,
+                "max_price": snapshot["max_price"],
+            }
+            text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+            with self._write_lock:
+                if version < self._written_version:
+                    return
+                self._write_atomic(text)
+                self._written_version = version
+            STATE_SAVE_SECONDS.labels("json").observe(time.perf_counter() - start)
+
+    def _write_atomic(self, text: str) -> None:
+        # temp + fsync + rename: при падении на диске остаётся либо старый, либо новый файл целиком
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        try:
+            dir_fd = os.open(self.path.parent, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        # Флаг снимается до записи, чтобы изменения во время неё снова его ставили,
+        # и возвращается, если запись не удалась: иначе изменения молча потеряются
+        self._dirty = False
+        try:
+            self._write_snapshot(self._snapshot(), self._version)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    async def flush_async(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write_snapshot, self._snapshot(), self._version)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def has_seen_any(self) -> bool:
+        # Пустое хранилище — признак первого запуска (прогрев без рассылки)
+        return bool(self.seen_ids_by_source)
 
     def mark_seen(self, source: str, ids: Set[str]) -> None:
-        current = self.seen_ids_by_source.get(source) or set()
-        current |= set(ids)
-        self.seen_ids_by_source[source] = current
+        current = self.seen_ids_by_source.get(source)
+        if current is None:
+            current = self.seen_ids_by_source[source] = SeenIds(bloom_bits=self.bloom_bits)
+        current.add(ids)
         self._save()
 
+    def expire_seen(self) -> int:
+        """Забывает ID старше срока хранения. Возвращает число удалённых."""
+        if not self.retention_sec:
+            return 0
+        cutoff = int(time.time()) - self.retention_sec
+        removed = sum(seen.expire(cutoff) for seen in self.seen_ids_by_source.values())
+        if removed:
+            self._save()
+        return removed
+
     def is_new(self, source: str, item_id: str, created_at: Optional[datetime] = None) -> bool:
         # Сначала проверяем по ID - это основной критерий
-        if item_id in (self.seen_ids_by_source.get(source) or set()):
+        seen = self.seen_ids_by_source.get(source)
+        if seen is not None and item_id in seen:
             return False
-        
+
         # Если есть дата создания — сравниваем с последней сохранённой датой
         # Но отклоняем только если дата СТРОГО меньше (created_at < last)
         # Это позволит обрабатывать несколько объявлений с одинаковой датой (например, Domovita)
@@ -82,7 +219,7 @@ class StateStore:
             if last and created_at < last:
                 return False
         return True
-    
+
     def update_last_date(self, source: str, date: Optional[datetime]) -> None:
         if date:
             current = self.last_date_by_source.get(source)
@@ -92,13 +229,33 @@ class StateStore:
 
     def add_chat(self, chat_id: int) -> None:
         self.chat_ids.add(chat_id)
+        self._filter_index = None
         self._save()
 
     def remove_chat(self, chat_id: int) -> None:
         if chat_id in self.chat_ids:
             self.chat_ids.remove(chat_id)
+            self.chat_filters.pop(chat_id, None)
+            self._filter_index = None
             self._save()
 
+    def get_chat_filter(self, chat_id: int) -> ChatFilter:
+        return self.chat_filters.get(chat_id, NO_FILTER)
+
+    def set_chat_filter(self, chat_id: int, flt: ChatFilter) -> None:
+        if flt.is_empty:
+            self.chat_filters.pop(chat_id, None)
+        else:
+            self.chat_filters[chat_id] = flt
+        self._filter_index = None
+        self._save()
+
+    def filter_index(self) -> FilterIndex:
+        """Индекс фильтров подписчиков для рассылки; перестраивается после изменений."""
+        if self._filter_index is None:
+            self._filter_index = FilterIndex({c: self.chat_filters.get(c, NO_FILTER) for c in self.chat_ids})
+        return self._filter_index
+
     def increment_empty_cycle(self) -> int:
         self.empty_cycles += 1
         self._save()
@@ -116,3 +273,19 @@ class StateStore:
     def get_max_price(self) -> Optional[int]:
         return self.max_price
 
+    def refresh(self) -> None:
+        """Перечитывает то, что могли поменять другие процессы; у JSON-файла владелец один."""
+
+    async def refresh_async(self) -> None:
+        self.refresh()
+
+
+def open_state_store(cfg: AppConfig) -> StateStore:
+    """Создаёт хранилище состояния по имени бэкенда из конфига (json | sqlite)."""
+    if cfg.state_backend == "sqlite":
+        from .state_sqlite import SqliteStateStore
+
+        return SqliteStateStore(retention_days=cfg.seen_retention_days)
+    if cfg.state_backend != "json":
+        raise RuntimeError(f"Неизвестный STATE_BACKEND: {cfg.state_backend}")
+    return StateStore(retention_days=cfg.seen_retention_days, bloom_bits=cfg.seen_bloom_bits)
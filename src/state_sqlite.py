@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+from datetime import datetime
+
+from .config import DATA_DIR
+from .state import StateStore, STATE_FILE
+from .seen import SeenIds
+from .filters import ChatFilter
+from .metrics import STATE_SAVE_SECONDS
+from .tracing import span
+from .utils import parse_datetime
+
+
+STATE_DB_FILE = DATA_DIR / "state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_ids (
+    source TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    first_seen INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, item_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS chat_filters (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY,
+    last_date TEXT
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteStateStore(StateStore):
+    """StateStore поверх SQLite (WAL).
+
+    Просмотренные ID не загружаются в память: is_new/mark_seen — точечные
+    запросы по первичному ключу. Подписчики, даты и настройки малы и
+    держатся в памяти как зеркало таблиц. Изменения коммитятся так же, как
+    в JSON-хранилище: сразу или одной транзакцией на выходе из batch().
+    """
+
+    def __init__(self, path: Path = STATE_DB_FILE, json_path: Path = STATE_FILE, retention_days: int = 30) -> None:
+        self.json_path = json_path
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        self.conn.commit()
+        # Соединение для refresh_async в потоке: основное принадлежит event loop
+        self._reader: Optional[sqlite3.Connection] = None
+        self._reader_lock = threading.Lock()
+        super().__init__(path, retention_days=retention_days)
+
+    def _upgrade_schema(self) -> None:
+        # Базы первой версии без first_seen: считаем старые ID замеченными сейчас
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(seen_ids)")}
+        if "first_seen" not in columns:
+            self.conn.execute("ALTER TABLE seen_ids ADD COLUMN first_seen INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("UPDATE seen_ids SET first_seen = ?", (int(time.time()),))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS seen_ids_first_seen ON seen_ids (first_seen)")
+
+    def _get_setting(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value: Optional[str]) -> None:
+        self.conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _load(self) -> None:
+        if self._get_setting("schema_version") is None:
+            self._migrate_from_json()
+        self.chat_ids = {row[0] for row in self.conn.execute("SELECT chat_id FROM subscribers")}
+        self.chat_filters = {
+            chat_id: ChatFilter.from_dict(json.loads(data))
+            for chat_id, data in self.conn.execute("SELECT chat_id, data FROM chat_filters")
+        }
+        self.refresh()
+
+    def refresh(self) -> None:
+        # В режиме --mode worker/bot цену меняет бот, а даты и счётчик циклов — воркеры
+        self._apply_shared(self._read_shared(self.conn))
+
+    async def refresh_async(self) -> None:
+        self._apply_shared(await asyncio.to_thread(self._read_shared_in_thread))
+
+    def _read_shared_in_thread(self) -> Tuple[int, Optional[int], Dict[str, Optional[datetime]]]:
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = sqlite3.connect(str(self.path), check_same_thread=False)
+            return self._read_shared(self._reader)
+
+    @staticmethod
+    def _read_shared(conn: sqlite3.Connection) -> Tuple[int, Optional[int], Dict[str, Optional[datetime]]]:
+        settings = dict(conn.execute("SELECT key, value FROM settings WHERE key IN ('empty_cycles', 'max_price')"))
+        watermarks = {source: parse_datetime(value) for source, value in conn.execute("SELECT source, last_date FROM watermarks")}
+        max_price = settings.get("max_price")
+        return int(settings.get("empty_cycles") or 0), int(max_price) if max_price is not None else None, watermarks
+
+    def _apply_shared(self, shared: Tuple[int, Optional[int], Dict[str, Optional[datetime]]]) -> None:
+        self.empty_cycles, self.max_price, watermarks = shared
+        for source, date in watermarks.items():
+            current = self.last_date_by_source.get(source)
+            # Даты только растут: своя ещё не закоммиченная дата новее прочитанной
+            if current is None or (date is not None and date > current):
+                self.last_date_by_source[source] = date
+
+    def _migrate_from_json(self) -> None:
+        # Одноразовый перенос data/state.json в базу; сам JSON-файл не трогаем
+        logger = logging.getLogger("state")
+        data = {}
+        if self.json_path.exists():
+            try:
+                data = json.loads(self.json_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.warning("state.json migration skipped: %s", e)
+        now = int(time.time())
+        with self.conn:
+            for source, raw in (data.get("seen_ids_by_source") or {}).items():
+                seen = SeenIds.from_json(raw, default_first_seen=now)
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO seen_ids (source, item_id, first_seen) VALUES (?, ?, ?)",
+                    ((source, item_id, ts) for item_id, ts in seen.items()),
+                )
+                self._set_setting("warmed_up", "1")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)",
+                ((int(c),) for c in data.get("chat_ids") or []),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO chat_filters (chat_id, data) VALUES (?, ?)",
+                ((int(c), json.dumps(f, ensure_ascii=False)) for c, f in (data.get("chat_filters") or {}).items()),
+            )
+            for source, value in (data.get("last_date_by_source") or {}).items():
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (source, last_date) VALUES (?, ?)",
+                    (source, value),
+                )
+            self._set_setting("empty_cycles", str(int(data.get("empty_cycles") or 0)))
+            if data.get("max_price") is not None:
+                self._set_setting("max_price", str(data["max_price"]))
+            self._set_setting("schema_version", "1")
+        if data:
+            logger.info("migrated %s into %s", self.json_path, self.path)
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            with STATE_SAVE_SECONDS.labels("sqlite").time(), span("state.write", backend="sqlite"):
+                self.conn.commit()
+        except BaseException:
+            # Коммит не прошёл — изменения остаются грязными до следующей попытки
+            self._dirty = True
+            raise
+
+    async def flush_async(self) -> None:
+        # Коммит в WAL дешёвый — выполняем на месте
+        self.flush()
+
+    def has_seen_any(self) -> bool:
+        return self._get_setting("warmed_up") is not None
+
+    def mark_seen(self, source: str, ids: Set[str]) -> None:
+        now = int(time.time())
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO seen_ids (source, item_id, first_seen) VALUES (?, ?, ?)",
+            ((source, i, now) for i in ids),
+        )
+        self._set_setting("warmed_up", "1")
+        self._save()
+
+    def expire_seen(self) -> int:
+        if not self.retention_sec:
+            return 0
+        cutoff = int(time.time()) - self.retention_sec
+        removed = self.conn.execute("DELETE FROM seen_ids WHERE first_seen < ?", (cutoff,)).rowcount
+        if removed:
+            self._save()
+        return removed
+
+    def is_new(self, source: str, item_id: str, created_at: Optional[datetime] = None) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM seen_ids WHERE source = ? AND item_id = ?",
+            (source, item_id),
+        ).fetchone()
+        if row:
+            return False
+        if created_at and source in self.last_date_by_source:
+            last = self.last_date_by_source[source]
+            if last and created_at < last:
+                return False
+        return True
+
+    def update_last_date(self, source: str, date: Optional[datetime]) -> None:
+        if date:
+            current = self.last_date_by_source.get(source)
+            if not current or date > current:
+                self.last_date_by_source[source] = date
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (source, last_date) VALUES (?, ?)",
+                    (source, date.isoformat()),
+                )
+                self._save()
+
+    def add_chat(self, chat_id: int) -> None:
+        self.chat_ids.add(chat_id)
+        self._filter_index = None
+        self.conn.execute("INSERT OR IGNORE INTO subscribers (chat_id) VALUES (?)", (chat_id,))
+        self._save()
+
+    def remove_chat(self, chat_id: int) -> None:
+        if chat_id in self.chat_ids:
+            self.chat_ids.remove(chat_id)
+            self.chat_filters.pop(chat_id, None)
+            self._filter_index = None
+            self.conn.execute("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,))
+            self.conn.execute("DELETE FROM chat_filters WHERE chat_id = ?", (chat_id,))
+            self._save()
+
+    def set_chat_filter(self, chat_id: int, flt: ChatFilter) -> None:
+        if flt.is_empty:
+            self.conn.execute("DELETE FROM chat_filters WHERE chat_id = ?", (chat_id,))
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chat_filters (chat_id, data) VALUES (?, ?)",
+                (chat_id, json.dumps(flt.to_dict(), ensure_ascii=False)),
+            )
+        super().set_chat_filter(chat_id, flt)
+
+    def increment_empty_cycle(self) -> int:
+        self.empty_cycles += 1
+        self._set_setting("empty_cycles", str(self.empty_cycles))
+        self._save()
+        return self.empty_cycles
+
+    def reset_empty_cycles(self) -> None:
+        if self.empty_cycles != 0:
+            self.empty_cycles = 0
+            self._set_setting("empty_cycles", "0")
+            self._save()
+
+    def set_max_price(self, price: int) -> None:
+        self.max_price = price
+        self._set_setting("max_price", str(price))
+        self._save()
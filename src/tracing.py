@@ -0,0 +1,162 @@
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import json
+import logging
+import os
+import threading
+import time
+
+
+# Текущий span: задачи asyncio и asyncio.to_thread наследуют его, поэтому
+# вложенность сохраняется и между параллельными источниками, и в потоках разбора
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+Sink = Callable[[Dict[str, Any]], None]
+_sinks: List[Sink] = []
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    """Отрезок работы с именем, атрибутами и длительностью.
+
+    Используется как `with span("fetch", source="kufar") as sp:` и внутри
+    корутин — вокруг await тоже. Без подписчиков ничего не записывается.
+    """
+
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "duration", "_t0", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = ""
+        self.span_id = ""
+        self.parent_id: Optional[str] = None
+        self.start = 0.0
+        self.duration = 0.0
+        self._t0 = 0.0
+        self._token: Any = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        parent = _current.get()
+        self.trace_id = parent.trace_id if parent is not None else _new_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = _new_id()
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.duration = time.perf_counter() - self._t0
+        _current.reset(self._token)
+        record: Dict[str, Any] = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        for sink in list(_sinks):
+            sink(record)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs: Any) -> Any:
+    """Новый span; если трассировка выключена — пустышка без затрат на время и ID."""
+    if not _sinks:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def add_sink(sink: Sink) -> None:
+    _sinks.append(sink)
+
+
+def remove_sink(sink: Sink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def log_sink(record: Dict[str, Any]) -> None:
+    # Одна JSON-строка на span: её можно грепать или отправить в сборщик логов как есть
+    logging.getLogger("trace").info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class SpanCollector:
+    """Собирает span'ы в память — для офлайн-профилирования одного цикла.
+
+    names — собирать только span'ы с этими именами (долгие прогоны без лишней памяти).
+    """
+
+    def __init__(self, names: Optional[Iterable[str]] = None) -> None:
+        self.records: List[Dict[str, Any]] = []
+        self.names = frozenset(names) if names is not None else None
+        self._lock = threading.Lock()
+
+    def __call__(self, record: Dict[str, Any]) -> None:
+        if self.names is not None and record["name"] not in self.names:
+            return
+        with self._lock:
+            self.records.append(record)
+
+    def folded_stacks(self) -> List[str]:
+        """Свёрнутые стеки для flamegraph.pl / speedscope: путь по span'ам и собственное время, мкс."""
+        by_id = {r["span_id"]: r for r in self.records}
+        child_ms: Dict[str, float] = {}
+        for r in self.records:
+            if r["parent_id"] in by_id:
+                child_ms[r["parent_id"]] = child_ms.get(r["parent_id"], 0.0) + r["duration_ms"]
+        totals: Dict[str, int] = {}
+        for r in self.records:
+            path = []
+            node: Optional[Dict[str, Any]] = r
+            while node is not None:
+                label = node["name"]
+                source = (node.get("attrs") or {}).get("source")
+                path.append(f"{label}[{source}]" if source else label)
+                node = by_id.get(node["parent_id"])
+            # Дети параллельных задач могут в сумме превышать родителя — собственное время не меньше нуля
+            self_us = int(max(0.0, r["duration_ms"] - child_ms.get(r["span_id"], 0.0)) * 1000)
+            if self_us:
+                key = ";".join(reversed(path))
+                totals[key] = totals.get(key, 0) + self_us
+        return [f"{k} {v}" for k, v in sorted(totals.items())]
+
+    def summary(self) -> List[str]:
+        """Суммарное время и количество по имени span'а, по убыванию времени."""
+        agg: Dict[str, List[float]] = {}
+        for r in self.records:
+            source = (r.get("attrs") or {}).get("source")
+            key = f"{r['name']}[{source}]" if source else r["name"]
+            entry = agg.setdefault(key, [0.0, 0])
+            entry[0] += r["duration_ms"]
+            entry[1] += 1
+        rows = sorted(agg.items(), key=lambda kv: kv[1][0], reverse=True)
+        return [f"{total:10.1f} ms {int(count):6d}x  {name}" for name, (total, count) in rows]
@@ -1,57 +1,130 @@
-from typing import Any, Optional
+from datetime import datetime
+from typing import Any, Optional, Tuple
+import re
 
+from .models import BYN, EUR, MINSK_TZ, USD
 
-def normalize_price(value: Any, default_currency: str = "$") -> Optional[str]:
-    if value is None:
-        return None
 
-    # Если это объект с полем display — используем его как есть
-    if isinstance(value, dict):
-        display = value.get("display")
-        if display:
-            return display.strip()
-        raw = value.get("value")
-        if raw is None:
-            return None
-        try:
-            num = float(raw)
-            if num.is_integer():
-                return f"{int(num)} {default_currency}"
-            return f"{num:.2f} {default_currency}"
-        except Exception:
-            return f"{raw} {default_currency}".strip()
-
-    # Числовые типы: приводим к float
+Price = Tuple[Optional[int], Optional[int]]
+
+_NUMBER_RE = re.compile(r"\d[\d\s]*(?:[.,]\d+)?")
+_ROOMS_RE = re.compile(r"(\d)\s*-?\s*(?:комн|к\b|к\.)", re.IGNORECASE)
+_AREA_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:м²|м2|кв\.?\s*м)", re.IGNORECASE)
+# Сумма в тексте цены: «1 150», «1150,50»; группы разрядов — через пробел, в том числе неразрывный
+_AMOUNT = r"\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?"
+_MARK = r"\$|usd|у\.\s?е\.|€|eur|byn|руб|р\.|р\b"
+# Сумма с валютой вплотную до или после неё: «350 $», «$350», «1 150 р.»
+_PRICE_RE = re.compile(
+    rf"(?P<mark_before>{_MARK})\s*(?P<amount_after>{_AMOUNT})|(?P<amount>{_AMOUNT})\s*(?P<mark>{_MARK})",
+    re.IGNORECASE,
+)
+_CURRENCY_MARKS = {"$": USD, "usd": USD, "у.е.": USD, "€": EUR, "eur": EUR, "byn": BYN, "руб": BYN, "р.": BYN, "р": BYN}
+
+# Границы Беларуси: по ним пара координат раскладывается в (широта, долгота) при любом порядке
+_LAT_RANGE = (51.0, 56.5)
+_LON_RANGE = (23.0, 33.0)
+
+
+def _to_number(value: Any) -> Optional[float]:
     if isinstance(value, (int, float)):
-        num = float(value)
-        # Эвристика: большие значения трактуем как центы (например, 35000 => 350.00)
-        if num >= 1000:
-            num = num / 100.0
-        if num.is_integer():
-            return f"{int(num)} {default_currency}"
-        return f"{num:.2f} {default_currency}"
-
-    # Строки
+        return float(value)
     if isinstance(value, str):
-        s = value.strip()
-        if not s:
-            return None
-        # Если уже есть валюта — оставляем как есть
-        lowers = s.lower()
-        if "$" in s or "usd" in lowers or "byn" in lowers or "руб" in lowers or "р." in lowers:
-            return s
-        # Если только цифры/.,/, пробуем распарсить
-        try:
-            s_norm = s.replace(" ", "").replace(",", ".")
-            num = float(s_norm)
-            if num >= 1000:
-                num = num / 100.0
-            if num.is_integer():
-                return f"{int(num)} {default_currency}"
-            return f"{num:.2f} {default_currency}"
-        except Exception:
-            return s
-
-    # Иные типы — строковое представление
-    return str(value)
+        m = _NUMBER_RE.search(value)
+        if m:
+            try:
+                return float(re.sub(r"\s", "", m.group(0)).replace(",", "."))
+            except ValueError:
+                return None
+    return None
+
+
+def price_from_major(value: Any, currency: Optional[int] = USD) -> Price:
+    """Цена в основных единицах (450, "450.5") → (центы, код валюты)."""
+    num = _to_number(value)
+    if num is None:
+        return None, None
+    return int(round(num * 100)), currency
+
+
+def price_from_minor(value: Any, currency: Optional[int] = USD) -> Price:
+    """Цена в минимальных единицах (API Kufar отдаёт "29500" за 295 $) → (центы, код валюты)."""
+    num = _to_number(value)
+    if num is None:
+        return None, None
+    return int(round(num)), currency
+
+
+def parse_price_text(text: Optional[str]) -> Price:
+    """Цена из текста карточки: "1 200 $", "950 р." → (центы, код валюты).
+
+    Каждая сумма берётся вместе с валютой рядом с ней: в «1 150 р. ≈ 350 $»
+    это 1150 BYN и 350 $. Если есть сумма в долларах, возвращается она;
+    число без валюты рядом ценой не считается — (None, None).
+    """
+    if not text:
+        return None, None
+    prices = []
+    for m in _PRICE_RE.finditer(text.lower()):
+        mark = re.sub(r"\s", "", m.group("mark") or m.group("mark_before"))
+        amount = m.group("amount") or m.group("amount_after")
+        prices.append(price_from_major(re.sub(r"[ \u00a0\u202f]", "", amount), _CURRENCY_MARKS[mark]))
+    if not prices:
+        return None, None
+    return next((p for p in prices if p[1] == USD), prices[0])
+
 
+def rooms_from_text(text: Optional[str]) -> Optional[int]:
+    if not text:
+        return None
+    m = _ROOMS_RE.search(text)
+    if m:
+        return int(m.group(1))
+    if "студи" in text.lower():
+        return 1
+    return None
+
+
+def area_from_text(text: Optional[str]) -> Optional[float]:
+    m = _AREA_RE.search(text or "")
+    return float(m.group(1).replace(",", ".")) if m else None
+
+
+def to_int(value: Any) -> Optional[int]:
+    # Параметры API приходят числом, строкой или списком из одного значения
+    if isinstance(value, list):
+        value = value[0] if value else None
+    num = _to_number(value)
+    return int(num) if num is not None else None
+
+
+def to_float(value: Any) -> Optional[float]:
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return _to_number(value)
+
+
+def lat_lon(pair: Any) -> Tuple[Optional[float], Optional[float]]:
+    """Пара координат в любом порядке ([lon, lat] у одних сайтов, [lat, lon] у других) → (lat, lon)."""
+    if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+        return None, None
+    try:
+        a, b = float(pair[0]), float(pair[1])
+    except (TypeError, ValueError):
+        return None, None
+    for lat, lon in ((a, b), (b, a)):
+        if _LAT_RANGE[0] <= lat <= _LAT_RANGE[1] and _LON_RANGE[0] <= lon <= _LON_RANGE[1]:
+            return lat, lon
+    return None, None
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """ISO-строка или unix-время → datetime с зоной; время без зоны считается минским."""
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=MINSK_TZ)
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except (ValueError, OverflowError, OSError):
+        return None
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=MINSK_TZ)